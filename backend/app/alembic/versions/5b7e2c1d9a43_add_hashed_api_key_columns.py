@@ -0,0 +1,55 @@
+"""Add hashed API key columns
+
+Revision ID: 5b7e2c1d9a43
+Revises: 3a8b5971fdc9
+Create Date: 2026-10-17 10:12:41.318202
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+# revision identifiers, used by Alembic.
+revision = '5b7e2c1d9a43'
+down_revision = '3a8b5971fdc9'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # The apitoken table predates migrations on some deployments; create it in its old shape if missing
+    if not sa.inspect(op.get_bind()).has_table('apitoken'):
+        op.create_table('apitoken',
+            sa.Column('id', sa.Uuid(), nullable=False),
+            sa.Column('token', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+            sa.Column('user_id', sa.Uuid(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.Column('expires_at', sa.DateTime(), nullable=False),
+            sa.Column('is_active', sa.Boolean(), nullable=False),
+            sa.Column('request_count', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('token')
+        )
+        op.create_index(op.f('ix_apitoken_user_id'), 'apitoken', ['user_id'], unique=False)
+
+    op.add_column('apitoken', sa.Column('key_prefix', sqlmodel.sql.sqltypes.AutoString(length=32), nullable=True))
+    op.add_column('apitoken', sa.Column('key_hash', sqlmodel.sql.sqltypes.AutoString(length=64), nullable=True))
+    # Existing JWT keys keep working: store their hash and the prefix derived from it
+    # (see app.core.security.api_key_lookup_prefix)
+    op.execute(
+        "UPDATE apitoken SET key_hash = encode(sha256(convert_to(token, 'UTF8')), 'hex') "
+        "WHERE key_hash IS NULL"
+    )
+    op.execute("UPDATE apitoken SET key_prefix = 'legacy_' || left(key_hash, 16) WHERE key_prefix IS NULL")
+    op.alter_column('apitoken', 'key_prefix', nullable=False)
+    op.alter_column('apitoken', 'key_hash', nullable=False)
+    op.alter_column('apitoken', 'token', nullable=True)
+    op.create_index(op.f('ix_apitoken_key_prefix'), 'apitoken', ['key_prefix'], unique=True)
+
+def downgrade():
+    # New-format keys have no stored token and cannot be represented in the old schema
+    op.execute("DELETE FROM apitoken WHERE token IS NULL")
+    op.alter_column('apitoken', 'token', nullable=False)
+    op.drop_index(op.f('ix_apitoken_key_prefix'), table_name='apitoken')
+    op.drop_column('apitoken', 'key_hash')
+    op.drop_column('apitoken', 'key_prefix')
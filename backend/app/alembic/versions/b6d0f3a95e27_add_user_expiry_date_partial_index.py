@@ -0,0 +1,37 @@
+"""Add partial index on user expiry_date for subscribed users
+
+Revision ID: b6d0f3a95e27
+Revises: 9c3e7b2d4a18
+Create Date: 2026-10-18 16:48:33.090125
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d0f3a95e27'
+down_revision = '9c3e7b2d4a18'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Built concurrently so signups and logins are not blocked on large user tables
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_user_expiry_date_subscribed',
+            'user',
+            ['expiry_date'],
+            unique=False,
+            postgresql_where=sa.text('has_subscription'),
+            postgresql_concurrently=True,
+        )
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_user_expiry_date_subscribed',
+            table_name='user',
+            postgresql_where=sa.text('has_subscription'),
+            postgresql_concurrently=True,
+        )
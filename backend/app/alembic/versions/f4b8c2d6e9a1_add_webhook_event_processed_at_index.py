@@ -0,0 +1,35 @@
+"""Add index on webhookevent processed_at
+
+Revision ID: f4b8c2d6e9a1
+Revises: b6d0f3a95e27
+Create Date: 2026-10-18 19:12:40.518337
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b8c2d6e9a1'
+down_revision = 'b6d0f3a95e27'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Every worker reads recently processed catalog events; pruning filters on it too
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f('ix_webhookevent_processed_at'),
+            'webhookevent',
+            ['processed_at'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            op.f('ix_webhookevent_processed_at'),
+            table_name='webhookevent',
+            postgresql_concurrently=True,
+        )
@@ -2,19 +2,30 @@ from fastapi import APIRouter, Depends, HTTPException, Request, BackgroundTasks
 from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
+from sqlmodel import select
 from typing import Annotated, Optional, Any
 from pydantic import BaseModel, EmailStr, Field, validator
 from datetime import datetime, timedelta
 import uuid
+import json
 import secrets
 import logging
 import stripe
 import os
+from concurrent.futures import Future, ThreadPoolExecutor
 from jinja2 import Environment, FileSystemLoader
 from tenacity import retry, stop_after_attempt, wait_exponential
 
-from app.models import User, Message, Token, UserPublic, NewPassword
-from app.api.deps import get_db, get_current_user, get_current_active_superuser, CurrentUser, SessionDep
+from app.models import User, Message, Token, UserPublic, NewPassword, SubscriptionResyncJob, SubscriptionResyncJobPublic
+from app.api.deps import get_db, get_current_user, get_current_active_superuser, AsyncSessionDep, CurrentUser, SessionDep
+from app.core.product_catalog import CATALOG_EVENT_TYPES, product_catalog
+from app.core.entitlements import (
+    cancel_customer_entitlements,
+    subscription_flags,
+    upsert_entitlement,
+)
+from app.core.stripe_sync import invalidate_users, subscription_resync
+from app.core.webhook_inbox import WebhookInbox, after_commit
 from app.core.security import create_access_token, get_password_hash, verify_access_token
 from app.core.config import settings
 from app import crud
@@ -60,6 +71,17 @@ def send_email_with_retry(email_to: str, subject: str, html_content: str) -> boo
         raise Exception(f"Email sending failed for {email_to}")
     return result
 
+# Emails sent from the webhook inbox; their SMTP round trips and retries would otherwise hold up the drain
+email_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="email")
+
+def _log_email_failure(future: Future) -> None:
+    if future.exception() is not None:
+        logger.error(f"Giving up on email: {future.exception()}")
+
+def send_email_in_background(email_to: str, subject: str, html_content: str) -> None:
+    future = email_executor.submit(send_email_with_retry, email_to=email_to, subject=subject, html_content=html_content)
+    future.add_done_callback(_log_email_failure)
+
 def send_email(*, email_to: str, subject: str = "", html_content: str = "") -> bool:
     try:
         if not settings.emails_enabled:
@@ -162,12 +184,11 @@ def generate_password_reset_email(email_to: str, email: str, token: str) -> Emai
     return EmailData(html_content=html_content, subject=subject)
 
 # User creation
-async def create_user_if_not_exists(
+def create_user_if_not_exists(
     db: Session,
     email: str,
     customer_id: Optional[str] = None,
-    subscription_id: Optional[str] = None,
-    background_tasks: BackgroundTasks = None
+    background_tasks: Optional[BackgroundTasks] = None
 ):
     user = db.query(User).filter(User.email == email).first()
     if user:
@@ -182,35 +203,37 @@ async def create_user_if_not_exists(
         full_name="New User",
         hashed_password=get_password_hash(temporary_password),
         is_active=False,
-        stripe_customer_id=customer_id,
-        subscription_id=subscription_id
+        stripe_customer_id=customer_id
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    # The caller commits; in the webhook inbox that is one commit per event
+    db.flush()
     logger.info(f"Created new user: {email}")
     
+    activation_token = create_access_token(
+        subject=user_id,
+        expires_delta=timedelta(hours=settings.EMAIL_RESET_TOKEN_EXPIRE_HOURS)
+    )
+    email_data = generate_activation_email(
+        email_to=email,
+        token=activation_token,
+        username=user.full_name or email
+    )
     if background_tasks:
-        try:
-            activation_token = create_access_token(
-                subject=user_id,
-                expires_delta=timedelta(hours=settings.EMAIL_RESET_TOKEN_EXPIRE_HOURS)
-            )
-            email_data = generate_activation_email(
-                email_to=email,
-                token=activation_token,
-                username=user.full_name or email
-            )
-            background_tasks.add_task(
-                send_email_with_retry,
-                email_to=email,
-                subject=email_data.subject,
-                html_content=email_data.html_content
-            )
-            logger.info(f"Scheduled activation email for: {email}")
-        except Exception as e:
-            logger.error(f"Failed to generate or schedule activation email for {email}: {str(e)}")
-            raise
+        background_tasks.add_task(
+            send_email_with_retry,
+            email_to=email,
+            subject=email_data.subject,
+            html_content=email_data.html_content
+        )
+        logger.info(f"Scheduled activation email for: {email}")
+    else:
+        # Called from the webhook inbox worker; the user must exist before the activation
+        # link in the email can work, and the drain must not wait for the send
+        after_commit(
+            db,
+            lambda: send_email_in_background(email_to=email, subject=email_data.subject, html_content=email_data.html_content),
+        )
     
     return user
 
@@ -324,7 +347,11 @@ async def create_customer_portal(
 
 # Webhook handler
 @router.post("/stripe/webhook")
-async def stripe_webhook(request: Request, background_tasks: BackgroundTasks, db: Annotated[Session, Depends(get_db)]):
+async def stripe_webhook(request: Request, background_tasks: BackgroundTasks, session: AsyncSessionDep):
+    """
+    Verify a Stripe event, store it in the webhook inbox and acknowledge it. The
+    event is processed by `process_stripe_event` off the request path.
+    """
     correlation_id = str(uuid.uuid4())
     logger.info(f"Webhook request started [correlation_id={correlation_id}]")
     
@@ -336,202 +363,144 @@ async def stripe_webhook(request: Request, background_tasks: BackgroundTasks, db
     payload = await request.body()
     
     try:
-        event = stripe.Webhook.construct_event(payload, signature, webhook_secret)
+        stripe.WebhookSignature.verify_header(
+            payload.decode("utf-8"), signature, webhook_secret, tolerance=stripe.Webhook.DEFAULT_TOLERANCE
+        )
+        event = json.loads(payload)
     except (ValueError, stripe.error.SignatureVerificationError) as e:
         logger.error(f"Invalid webhook signature: {str(e)} [correlation_id={correlation_id}]")
         raise HTTPException(status_code=400, detail=f"Invalid webhook signature: {str(e)}")
     
     event_type = event.get("type")
-    logger.info(f"Processing Stripe webhook event: {event_type} [correlation_id={correlation_id}]")
+    stored = await stripe_inbox.enqueue(session, event)
+    logger.info(f"Stored Stripe webhook event {event.get('id')}: {event_type} (duplicate={not stored}) [correlation_id={correlation_id}]")
+    if stored:
+        background_tasks.add_task(stripe_inbox.drain)
+    return {"status": "success", "event_type": event_type}
+
+def process_stripe_event(db: Session, event: dict) -> None:
+    """
+    Apply one stored Stripe event. Runs in the webhook inbox worker, which commits
+    once the event is applied, so nothing here commits. Raising leaves the event
+    pending for a retry, so every branch must be idempotent.
+    """
+    event_type = event.get("type")
+    data = event["data"]["object"]
+    logger.info(f"Processing Stripe webhook event {event.get('id')}: {event_type}")
     
     if event_type == "checkout.session.completed":
-        session = event.data.object
-        customer_id = session.get("customer")
-        subscription_id = session.get("subscription")
-        email = session.metadata.get("email") or session.get("customer_details", {}).get("email")
+        customer_id = data.get("customer")
+        subscription_id = data.get("subscription")
+        email = (data.get("metadata") or {}).get("email") or (data.get("customer_details") or {}).get("email")
         
-        logger.info(f"Checkout completed: customer={customer_id}, subscription={subscription_id}, email={email} [correlation_id={correlation_id}]")
+        logger.info(f"Checkout completed: customer={customer_id}, subscription={subscription_id}, email={email}")
         
         if email:
-            try:
-                user = await create_user_if_not_exists(
-                    db=db,
-                    email=email,
-                    customer_id=customer_id,
-                    subscription_id=subscription_id,
-                    background_tasks=background_tasks
-                )
-                if subscription_id:
-                    subscription = stripe.Subscription.retrieve(
-                        subscription_id,
-                        expand=["plan.product"]
-                    )
-                    background_tasks.add_task(
-                        update_user_subscription,
-                        db=db,
-                        stripe_customer_id=customer_id,
-                        subscription_data=subscription
-                    )
-            except Exception as e:
-                logger.error(f"Error processing checkout.session.completed: {str(e)} [correlation_id={correlation_id}]")
-                raise HTTPException(status_code=500, detail=str(e))
+            create_user_if_not_exists(db=db, email=email, customer_id=customer_id)
+            if subscription_id:
+                # Retrieved now, so the subscription is at least as new as the event
+                subscription = stripe.Subscription.retrieve(subscription_id)
+                update_user_subscription(db, customer_id, subscription, event_created=event["created"])
     
     elif event_type == "charge.succeeded":
-        charge = event.data.object
-        customer_id = charge.get("customer")
-        email = charge.get("billing_details", {}).get("email")
-        charge_id = charge.get("id")
-        amount = charge.get("amount") / 100.0
-        currency = charge.get("currency")
+        customer_id = data.get("customer")
+        email = (data.get("billing_details") or {}).get("email")
+        amount = data.get("amount") / 100.0
         
-        logger.info(f"Charge succeeded: customer={customer_id}, charge={charge_id}, email={email}, amount={amount} {currency} [correlation_id={correlation_id}]")
+        logger.info(f"Charge succeeded: customer={customer_id}, charge={data.get('id')}, email={email}, amount={amount} {data.get('currency')}")
         
         if email:
-            try:
-                await create_user_if_not_exists(
-                    db=db,
-                    email=email,
-                    customer_id=customer_id,
-                    background_tasks=background_tasks
-                )
-            except Exception as e:
-                logger.error(f"Error processing charge.succeeded: {str(e)} [correlation_id={correlation_id}]")
-                raise HTTPException(status_code=500, detail=str(e))
+            create_user_if_not_exists(db=db, email=email, customer_id=customer_id)
     
-    elif event_type in ["product.created", "product.updated", "price.created"]:
-        data = event.data.object
+    elif event_type in CATALOG_EVENT_TYPES:
         product_id = data.get("id")
-        logger.info(f"Processing {event_type}: product/price={product_id} [correlation_id={correlation_id}]")
+        logger.info(f"Processing {event_type}: product/price={product_id}")
         
-        try:
-            subscriptions = stripe.Subscription.list(
-                limit=10,
-                expand=["data.customer"]
-            )
-            for sub in subscriptions.data:
-                if sub.plan.product == product_id:
-                    email = sub.customer.email
-                    customer_id = sub.customer.id
-                    subscription_id = sub.id
-                    if email:
-                        user = await create_user_if_not_exists(
-                            db=db,
-                            email=email,
-                            customer_id=customer_id,
-                            subscription_id=subscription_id,
-                            background_tasks=background_tasks
-                        )
-                        background_tasks.add_task(
-                            update_user_subscription,
-                            db=db,
-                            stripe_customer_id=customer_id,
-                            subscription_data=sub
-                        )
-                        break
-        except stripe.error.StripeError as e:
-            logger.error(f"Error retrieving subscriptions for product: {str(e)} [correlation_id={correlation_id}]")
-            raise HTTPException(status_code=500, detail=str(e))
+        product_catalog.apply_event(event_type, data, event["created"])
+        # Existing subscribers pick up the changed product metadata in the background
+        if event_type == "product.updated":
+            subscription_resync.enqueue(db, product_id)
     
     elif event_type.startswith("customer.subscription."):
-        subscription_data = event.data.object
-        customer_id = subscription_data.get("customer")
-        email = None
-        try:
-            customer = stripe.Customer.retrieve(customer_id)
-            email = customer.get("email")
-        except stripe.error.StripeError as e:
-            logger.error(f"Error retrieving customer: {str(e)} [correlation_id={correlation_id}]")
+        customer_id = data.get("customer")
         
         log_data = {
             "event_type": event_type,
-            "subscription_id": subscription_data.get("id"),
+            "subscription_id": data.get("id"),
             "customer_id": customer_id,
-            "status": subscription_data.get("status"),
-            "plan_id": subscription_data.get("plan", {}).get("id"),
+            "status": data.get("status"),
+            "plan_id": (data.get("plan") or {}).get("id"),
         }
-        logger.info(f"Subscription event details: {log_data} [correlation_id={correlation_id}]")
+        logger.info(f"Subscription event details: {log_data}")
         
-        if email:
-            user = await create_user_if_not_exists(
-                db=db,
-                email=email,
-                customer_id=customer_id,
-                subscription_id=subscription_data.get("id"),
-                background_tasks=background_tasks
-            )
-            background_tasks.add_task(
-                update_user_subscription,
-                db=db,
-                stripe_customer_id=customer_id,
-                subscription_data=subscription_data
-            )
+        if not db.query(User).filter(User.stripe_customer_id == customer_id).first():
+            customer = stripe.Customer.retrieve(customer_id)
+            email = customer.get("email")
+            if not email:
+                return
+            create_user_if_not_exists(db=db, email=email, customer_id=customer_id)
+        update_user_subscription(db, customer_id, data, event_created=event["created"])
     
     elif event_type == "customer.deleted":
-        customer_data = event.data.object
-        customer_id = customer_data.get("id")
-        
-        try:
-            user = db.query(User).filter(User.stripe_customer_id == customer_id).first()
-            if user:
-                logger.info(f"Customer deleted: {customer_id} for user: {user.email} [correlation_id={correlation_id}]")
-                user.has_subscription = False
-                user.is_trial = False
-                user.is_deactivated = True
-                user.subscription_id = None
-                user.subscription_plan_id = None
-                user.subscription_plan_name = None
-                user.has_proxy_api_access = False
-                db.commit()
-        except Exception as e:
-            logger.error(f"Error processing customer.deleted event: {str(e)} [correlation_id={correlation_id}]")
-            db.rollback()
-            raise HTTPException(status_code=500, detail=str(e))
-    
-    logger.info(f"Webhook request completed [correlation_id={correlation_id}]")
-    return {"status": "success", "event_type": event_type}
+        customer_id = data.get("id")
+        user = db.query(User).filter(User.stripe_customer_id == customer_id).first()
+        if user:
+            logger.info(f"Customer deleted: {customer_id} for user: {user.email}")
+            user.has_subscription = False
+            user.is_trial = False
+            user.is_deactivated = True
+            cancel_customer_entitlements(db, customer_id)
+            db.flush()
+            after_commit(db, lambda user_id=user.id: invalidate_users([user_id]))
+
+stripe_inbox = WebhookInbox(
+    process_stripe_event,
+    batch_size=settings.WEBHOOK_INBOX_BATCH_SIZE,
+    max_attempts=settings.WEBHOOK_INBOX_MAX_ATTEMPTS,
+)
+
+@router.get(
+    "/stripe/resync-jobs",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=list[SubscriptionResyncJobPublic],
+)
+async def list_resync_jobs(session: AsyncSessionDep, limit: int = 20):
+    """Progress of the most recent product resync jobs."""
+    jobs = await session.exec(
+        select(SubscriptionResyncJob).order_by(SubscriptionResyncJob.created_at.desc()).limit(limit)
+    )
+    return jobs.all()
 
 # Subscription update
-async def update_user_subscription(db: Session, stripe_customer_id: str, subscription_data: dict):
-    try:
-        user = db.query(User).filter(User.stripe_customer_id == stripe_customer_id).first()
-        if not user:
-            logger.warning(f"No user found with Stripe customer ID: {stripe_customer_id}")
-            return
-        
-        logger.info(f"Updating subscription for user: {user.email}")
-        
-        status = subscription_data.get("status", "")
-        metadata = {}
-        if subscription_data.get("plan") and subscription_data["plan"].get("product"):
-            product_id = subscription_data["plan"].get("product")
-            try:
-                product = stripe.Product.retrieve(product_id)
-                if hasattr(product, "metadata"):
-                    metadata = product.metadata
-            except Exception as e:
-                logger.error(f"Error retrieving product metadata: {str(e)}")
-        
-        user.subscription_id = subscription_data.get("id")
-        user.has_subscription = status in ["active", "trialing", "past_due"]
-        user.is_trial = status == "trialing"
-        user.is_deactivated = status in ["canceled", "unpaid", "incomplete_expired"]
-        
-        if subscription_data.get("plan"):
-            user.subscription_plan_id = subscription_data["plan"].get("id")
-            user.subscription_plan_name = subscription_data["plan"].get("nickname")
-        
-        if subscription_data.get("current_period_start"):
-            user.subscription_start = datetime.fromtimestamp(subscription_data["current_period_start"])
-        if subscription_data.get("current_period_end"):
-            user.subscription_end = datetime.fromtimestamp(subscription_data["current_period_end"])
-        
-        user.has_proxy_api_access = metadata.get("proxy-api") == "true"
-        
-        db.commit()
-        logger.info(f"Successfully updated subscription for user: {user.email}")
-    except Exception as e:
-        logger.error(f"Error updating user subscription: {str(e)}")
-        db.rollback()
+def update_user_subscription(db: Session, stripe_customer_id: str, subscription_data: dict, event_created: Optional[int] = None):
+    user = db.query(User).filter(User.stripe_customer_id == stripe_customer_id).first()
+    if not user:
+        logger.warning(f"No user found with Stripe customer ID: {stripe_customer_id}")
+        return
+    
+    logger.info(f"Updating subscription for user: {user.email}")
+    
+    status = subscription_data.get("status", "")
+    product = None
+    plan = subscription_data.get("plan")
+    if plan and plan.get("product"):
+        product = plan.get("product")
+        # The product is an id unless the event expanded it
+        if isinstance(product, str):
+            product = product_catalog.get_product(product)
+        else:
+            product = product_catalog.set_product(product)
+    
+    if not upsert_entitlement(db, user.id, subscription_data, product, event_created):
+        logger.info(f"Ignoring out-of-date update for subscription {subscription_data.get('id')}")
+        return
+    for field, value in subscription_flags(status).items():
+        setattr(user, field, value)
+    
+    db.flush()
+    # The id is bound now: `user` is expired and detached by the time the callback runs
+    after_commit(db, lambda user_id=user.id: invalidate_users([user_id]))
+    logger.info(f"Successfully updated subscription for user: {user.email}")
 
 # Test endpoint for activation email
 @router.post("/test-activation-email")
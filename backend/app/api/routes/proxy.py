@@ -1,28 +1,54 @@
 
 
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Header, Request
-from typing import Annotated, Dict, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Annotated, AsyncIterator, Awaitable, Callable, Dict, List, Literal, Optional, TypeVar, Union
+from collections import deque
+from dataclasses import dataclass
 from pydantic import BaseModel, HttpUrl
 import httpx
 import logging
 import asyncio
+import hmac
 import time
 import random
+import statistics
 import uuid
 import os
 from datetime import datetime, timedelta
-from app.api.deps import SessionDep, CurrentUser
+from app.api.deps import AsyncCurrentUser, AsyncSessionDep, get_current_active_superuser
 from app.models import User
-from app.core.security import generate_api_key, verify_api_key
+from app.core.security import api_key_lookup_prefix, generate_api_key, hash_api_key
+from app.core.config import settings
+from app.core.upstream import (
+    EnvelopeStream,
+    UpstreamTargetError,
+    UpstreamTooLarge,
+    limit_bytes,
+    raise_for_upstream_status,
+    upstream_clients,
+)
+from app.core.circuit_breaker import CircuitBreaker, CircuitState
+from app.core.metrics import metrics
+from app.core.db import engine
+from app.core.api_key_cache import api_key_cache
+from app.core.cache import TieredCache, cache_requests, make_cache_key
+from app.core.singleflight import SingleFlight
+from app.core.usage import UsageAggregator
+from app.core.rate_limit import rate_limiter
+from app.core.serp_parser import SerpResponse, SerpResult
+from app.core.serp_cache import serp_cache
+from app.core.serp_pool import serp_parser_pool
+from app.core.entitlements import get_plan_limits
 # REMOVED: No longer need to import `users` for the lookup
 # from app.api.routes import users 
+from sqlalchemy import bindparam, update
 from sqlalchemy.orm import Session
-from sqlmodel import SQLModel, Field
+from sqlmodel import SQLModel, Field, select
 from uuid import UUID, uuid4
 from app.utils import generate_test_email, send_email
 
-from bs4 import BeautifulSoup
-from urllib.parse import quote_plus, unquote, parse_qs
+from urllib.parse import quote_plus, urlsplit
 
 
 # Configure logging based on environment
@@ -30,6 +56,8 @@ log_level = logging.INFO if os.getenv("ENV") == "production" else logging.DEBUG
 logging.basicConfig(level=log_level)
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 # REGION_ENDPOINTS dictionary... (keep as is)
 REGION_ENDPOINTS = {
     "us-east": [
@@ -86,18 +114,200 @@ REGION_ENDPOINTS = {
 }
 
 
-# ProxyEndpointManager class... (keep as is)
+@dataclass
+class EndpointStats:
+    ewma_latency: Optional[float] = None
+    error_rate: float = 0.0
+    in_flight: int = 0
+    requests: int = 0
+    failures: int = 0
+
+    def observe(self, latency: float, ok: bool, alpha: float) -> None:
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = alpha * latency + (1 - alpha) * self.ewma_latency
+        self.error_rate = alpha * (0.0 if ok else 1.0) + (1 - alpha) * self.error_rate
+
+    def score(self, prior_latency: float) -> float:
+        # Lower is better. Endpoints without fetch history are assumed to be as fast as the
+        # prior, so a burst spreads over them instead of piling onto one unmeasured endpoint.
+        latency = self.ewma_latency if self.ewma_latency is not None else prior_latency
+        return latency * (self.in_flight + 1) / max(1.0 - self.error_rate, 0.05)
+
+
+class HedgeBudget:
+    """
+    Caps hedged requests to a fraction of primary requests. Every primary request
+    deposits `ratio` credits and every hedge spends one, so hedges can never exceed
+    ratio * primaries (plus the small `max_balance` burst).
+    """
+
+    def __init__(self, ratio: float, max_balance: float = 10.0):
+        self.ratio = ratio
+        self.max_balance = max_balance
+        self.balance = 0.0
+        self.primaries = 0
+        self.hedges = 0
+
+    def deposit(self) -> None:
+        self.primaries += 1
+        self.balance = min(self.balance + self.ratio, self.max_balance)
+
+    def try_spend(self) -> bool:
+        if self.balance < 1.0:
+            return False
+        self.balance -= 1.0
+        self.hedges += 1
+        return True
+
+
+circuit_transitions = metrics.counter(
+    "proxy_circuit_transitions_total",
+    "Circuit breaker state transitions per proxy endpoint",
+    ["endpoint", "from_state", "to_state"],
+)
+circuit_open = metrics.gauge(
+    "proxy_circuit_open",
+    "1 if the endpoint's circuit breaker is open or half-open, 0 if closed",
+    ["endpoint"],
+)
+
+
+def record_circuit_transition(endpoint: str, old_state: CircuitState, new_state: CircuitState) -> None:
+    circuit_transitions.inc(endpoint=endpoint, from_state=old_state.value, to_state=new_state.value)
+    circuit_open.set(0.0 if new_state == CircuitState.CLOSED else 1.0, endpoint=endpoint)
+
+
 class ProxyEndpointManager:
     def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget all health, latency and breaker state, as on a fresh worker."""
         self.endpoints = REGION_ENDPOINTS
         self.endpoint_ids = {
             region: {f"{region}_{i}": url for i, url in enumerate(urls)}
             for region, urls in REGION_ENDPOINTS.items()
         }
 
+        # Latest health probe result per endpoint URL, filled by the background monitor
+        self.health: Dict[str, Dict] = {}
+        # Latency / load / error tracking per endpoint URL used for endpoint selection
+        self.stats: Dict[str, EndpointStats] = {
+            url: EndpointStats() for urls in REGION_ENDPOINTS.values() for url in urls
+        }
+        # Recent successful fetch latencies per region, used to derive the hedge delay
+        self.url_regions = {url: region for region, urls in REGION_ENDPOINTS.items() for url in urls}
+        self.latencies: Dict[str, deque] = {
+            region: deque(maxlen=settings.PROXY_HEDGE_WINDOW) for region in REGION_ENDPOINTS
+        }
+        self.hedge_budget = HedgeBudget(settings.PROXY_HEDGE_BUDGET_RATIO)
+        self.breakers: Dict[str, CircuitBreaker] = {
+            url: CircuitBreaker(
+                name=self.get_endpoint_id(region, url) or url,
+                failure_threshold=settings.PROXY_CIRCUIT_FAILURE_THRESHOLD,
+                error_rate_threshold=settings.PROXY_CIRCUIT_ERROR_RATE,
+                window_size=settings.PROXY_CIRCUIT_WINDOW,
+                min_requests=settings.PROXY_CIRCUIT_MIN_REQUESTS,
+                open_duration=settings.PROXY_CIRCUIT_OPEN_SECONDS,
+                half_open_max_calls=settings.PROXY_CIRCUIT_HALF_OPEN_CALLS,
+                on_transition=record_circuit_transition,
+            )
+            for region, urls in REGION_ENDPOINTS.items()
+            for url in urls
+        }
+
     def get_endpoints(self, region: str) -> List[str]:
         return self.endpoints.get(region, [])
 
+    def record_health(self, result: Dict) -> None:
+        # Probe times stay out of the fetch latency average: a /health round trip is much
+        # cheaper than a fetch and would make idle endpoints look faster than busy ones
+        self.health[result["endpoint"]] = result
+
+    def get_health(self, region: str) -> List[Dict]:
+        # Endpoints that have not been probed yet are assumed healthy so a fresh worker can serve traffic
+        return [
+            self.health.get(url) or {"region": region, "is_healthy": True, "response_time": 0.0, "last_checked": None, "endpoint": url}
+            for url in self.get_endpoints(region)
+        ]
+
+    def get_healthy_endpoints(self, region: str) -> List[str]:
+        # Healthy per the monitor and not short-circuited by the endpoint's breaker
+        return [
+            r["endpoint"] for r in self.get_health(region)
+            if r["is_healthy"] and self.breakers[r["endpoint"]].allow_request()
+        ]
+
+    def start_request(self, url: str) -> bool:
+        if not self.breakers[url].acquire():
+            return False
+        stats = self.stats[url]
+        stats.in_flight += 1
+        stats.requests += 1
+        return True
+
+    def finish_request(self, url: str, latency: float, ok: bool) -> None:
+        stats = self.stats[url]
+        stats.in_flight = max(stats.in_flight - 1, 0)
+        if ok:
+            self.latencies[self.url_regions[url]].append(latency)
+            self.breakers[url].record_success()
+        else:
+            stats.failures += 1
+            self.breakers[url].record_failure()
+        stats.observe(latency, ok, settings.PROXY_EWMA_ALPHA)
+
+    def cancel_request(self, url: str) -> None:
+        # A cancelled hedge loser says nothing about the endpoint's health
+        stats = self.stats[url]
+        stats.in_flight = max(stats.in_flight - 1, 0)
+        self.breakers[url].release()
+
+    def hedge_delay(self, region: str) -> float:
+        samples = sorted(self.latencies.get(region, ()))
+        if len(samples) < settings.PROXY_HEDGE_MIN_SAMPLES:
+            return settings.PROXY_HEDGE_DEFAULT_DELAY
+        index = min(int(len(samples) * settings.PROXY_HEDGE_PERCENTILE), len(samples) - 1)
+        return samples[index]
+
+    def prior_latency(self, region: str) -> float:
+        # Median fetch latency of the region's measured endpoints
+        measured = [
+            self.stats[url].ewma_latency
+            for url in self.get_endpoints(region)
+            if self.stats[url].ewma_latency is not None
+        ]
+        return statistics.median(measured) if measured else settings.PROXY_PRIOR_LATENCY
+
+    def score(self, url: str) -> float:
+        return self.stats[url].score(self.prior_latency(self.url_regions[url]))
+
+    def choose_endpoint(self, candidates: List[str]) -> str:
+        # Power of two choices: sample two candidates and keep the one with the better score
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        return first if self.score(first) <= self.score(second) else second
+
+    def region_latency(self, region: str) -> Optional[float]:
+        latencies = [
+            self.stats[url].ewma_latency
+            for url in self.get_healthy_endpoints(region)
+            if self.stats[url].ewma_latency is not None
+        ]
+        return min(latencies) if latencies else None
+
+    def rank_regions(self, preferred: str) -> List[str]:
+        # Preferred region first, then fallbacks from fastest to slowest; unmeasured regions go last
+        def sort_key(region: str):
+            latency = self.region_latency(region)
+            return (latency is None, latency or 0.0, random.random())
+
+        fallbacks = sorted((r for r in self.endpoints if r != preferred), key=sort_key)
+        return [preferred] + fallbacks
+
     def get_endpoint_id(self, region: str, url: str) -> Optional[str]:
         for endpoint_id, endpoint_url in self.endpoint_ids.get(region, {}).items():
             if endpoint_url == url:
@@ -107,110 +317,156 @@ class ProxyEndpointManager:
 endpoint_manager = ProxyEndpointManager()
 
 
+# Opt-in cache of successful fetches, consulted when a request passes max_age
+response_cache = TieredCache(
+    "proxy_fetch",
+    max_bytes=settings.PROXY_CACHE_MAX_BYTES,
+    disk_dir=settings.PROXY_CACHE_DIR,
+    disk_max_age=settings.PROXY_CACHE_MAX_AGE,
+)
+
+# Concurrent identical fetches share one upstream request
+fetch_flights = SingleFlight("proxy_fetch")
+
+
 router = APIRouter(tags=["proxy"], prefix="/proxy")
 
 # Model definitions... (keep as is)
 class APIToken(SQLModel, table=True):
     __tablename__ = "apitoken"
     id: UUID = Field(default_factory=uuid4, primary_key=True)
-    token: str = Field(unique=True)
+    # Keys are found by prefix and checked against the hash; the key itself is never stored
+    key_prefix: str = Field(unique=True, index=True, max_length=32)
+    key_hash: str = Field(max_length=64)
+    # Full key of legacy JWT keys, kept only to show their preview
+    token: Optional[str] = Field(default=None, unique=True)
     user_id: UUID = Field(foreign_key="user.id", index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     expires_at: datetime
     is_active: bool = Field(default=True)
     request_count: int = Field(default=0)
 
+def write_token_usage(counts: Dict[UUID, int]) -> None:
+    # One atomic increment per key in a single transaction; ordered by id so
+    # concurrent flushes from other workers lock rows in the same order
+    statement = (
+        update(APIToken)
+        .where(APIToken.id == bindparam("token_id"))
+        .values(request_count=APIToken.request_count + bindparam("count"))
+    )
+    with Session(engine) as session:
+        session.connection().execute(
+            statement,
+            [{"token_id": token_id, "count": count} for token_id, count in sorted(counts.items())],
+        )
+        session.commit()
+
+# Successful fetches are counted here and written to APIToken.request_count in batches
+token_usage = UsageAggregator("api_token_requests", write_token_usage)
+
 class RegionsResponse(BaseModel): regions: List[str]
 class APIKeyResponse(BaseModel): key_preview: str; created_at: str; expires_at: str; is_active: bool; request_count: int
 class ProxyStatus(BaseModel): region: str; is_healthy: bool; avg_response_time: float; healthy_endpoints: int; total_endpoints: int; last_checked: datetime
 class ProxyStatusResponse(BaseModel): statuses: List[ProxyStatus]
 class ProxyRequest(BaseModel): url: HttpUrl
 class ProxyResponse(BaseModel): result: str; public_ip: str; device_id: str; region_used: str
-class SerpResult(BaseModel): position: int; title: str; link: str; snippet: str
-class SerpResponse(BaseModel): search_engine: str; search_query: str; region_used: str; organic_results: List[SerpResult]
+class BatchFetchRequest(BaseModel): urls: List[HttpUrl]
+class BatchFetchResult(BaseModel): index: int; url: str; ok: bool; result: Optional[str] = None; public_ip: Optional[str] = None; device_id: Optional[str] = None; region_used: Optional[str] = None; error: Optional[str] = None
+class EndpointScore(BaseModel): endpoint_id: str; region: str; url: str; is_healthy: bool; circuit_state: str; ewma_latency: Optional[float]; error_rate: float; in_flight: int; requests: int; failures: int; score: float
+class RegionScore(BaseModel): region: str; latency: Optional[float]; endpoints: List[EndpointScore]
+class EndpointScoresResponse(BaseModel): regions: List[RegionScore]
+class SerpCachePurgeResponse(BaseModel): purged: int
+class MergedSerpResult(BaseModel): position: int; title: str; link: str; snippet: str; engines: List[str]
+class MultiEngineSerpResponse(BaseModel): search_engines: List[str]; search_query: str; results: Dict[str, SerpResponse]; errors: Dict[str, str]; merged_results: List[MergedSerpResult]
 
 # Health check, SERP parsers, SUPPORTED_ENGINES... (keep as is)
 async def check_proxy_health(endpoint: str, region: str) -> Dict:
     start_time = time.time()
     endpoint_id = endpoint_manager.get_endpoint_id(region, endpoint) or "unknown"
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(f"{endpoint}/health")
-            response.raise_for_status()
-            response_time = time.time() - start_time
-            logger.debug(f"Health check succeeded for proxy {endpoint_id} in {region}")
-            return {"region": region, "is_healthy": True, "response_time": response_time, "last_checked": datetime.utcnow(), "endpoint": endpoint}
+        client = upstream_clients.get(region)
+        response = await client.get(f"{endpoint}/health", timeout=settings.PROXY_HEALTH_TIMEOUT)
+        response.raise_for_status()
+        response_time = time.time() - start_time
+        logger.debug(f"Health check succeeded for proxy {endpoint_id} in {region}")
+        return {"region": region, "is_healthy": True, "response_time": response_time, "last_checked": datetime.utcnow(), "endpoint": endpoint}
     except Exception as e:
         logger.error(f"Health check failed for proxy {endpoint_id} in {region}: {str(e)}")
         return {"region": region, "is_healthy": False, "response_time": time.time() - start_time, "last_checked": datetime.utcnow(), "endpoint": endpoint}
 
-def parse_google_serp(html: str) -> List[SerpResult]:
-    soup = BeautifulSoup(html, "lxml")
-    results = []
-    for i, el in enumerate(soup.select("div.g"), start=1):
-        title_tag = el.select_one("h3")
-        link_tag = el.select_one("a")
-        snippet_tag = el.select_one("div[data-sncf='1']") or el.select_one(".VwiC3b")
-        if title_tag and link_tag and link_tag.get("href"):
-            results.append(SerpResult(position=i, title=title_tag.text, link=link_tag.get("href"), snippet=snippet_tag.text if snippet_tag else ""))
-    return results
-
-def parse_bing_serp(html: str) -> List[SerpResult]:
-    soup = BeautifulSoup(html, "lxml")
-    results = []
-    for i, el in enumerate(soup.select("li.b_algo"), start=1):
-        title_tag = el.select_one("h2 a")
-        snippet_tag = el.select_one(".b_caption p")
-        if title_tag and title_tag.get("href"):
-            results.append(SerpResult(position=i, title=title_tag.text, link=title_tag.get("href"), snippet=snippet_tag.text if snippet_tag else ""))
-    return results
-
-def parse_duckduckgo_serp(html: str) -> List[SerpResult]:
-    soup = BeautifulSoup(html, "lxml")
-    results = []
-    for i, el in enumerate(soup.select(".result"), start=1):
-        title_tag = el.select_one(".result__a")
-        snippet_tag = el.select_one(".result__snippet")
-        link = ""
-        if title_tag and title_tag.get("href"):
-            raw_href = title_tag.get("href")
-            if raw_href and "uddg=" in raw_href:
-                try:
-                    parsed_url = parse_qs(raw_href.split("?", 1)[1])
-                    link = unquote(parsed_url.get("uddg", [""])[0])
-                except (IndexError, KeyError): link = raw_href
-            else: link = raw_href
-            results.append(SerpResult(position=i, title=title_tag.text, link=link, snippet=snippet_tag.text.strip() if snippet_tag else ""))
-    return results
+async def refresh_endpoint_health() -> None:
+    tasks = [
+        check_proxy_health(endpoint, region)
+        for region in endpoint_manager.endpoints
+        for endpoint in endpoint_manager.get_endpoints(region)
+    ]
+    results = await asyncio.gather(*tasks)
+    for result in results:
+        endpoint_manager.record_health(result)
+    healthy_count = sum(1 for r in results if r["is_healthy"])
+    logger.debug(f"Health monitor probed {len(results)} endpoints, {healthy_count} healthy")
 
+# page_param is appended for pages after the first; {offset} counts results skipped, {first} is offset + 1
 SUPPORTED_ENGINES = {
-    "google": {"base_url": "https://www.google.com/search?q={query}&hl=en&gl=us", "parser": parse_google_serp},
-    "bing": {"base_url": "https://www.bing.com/search?q={query}&cc=US", "parser": parse_bing_serp},
-    "duckduckgo": {"base_url": "https://html.duckduckgo.com/html/?q={query}", "parser": parse_duckduckgo_serp},
+    "google": {"base_url": "https://www.google.com/search?q={query}&hl=en&gl=us", "page_param": "&start={offset}", "page_size": 10},
+    "bing": {"base_url": "https://www.bing.com/search?q={query}&cc=US", "page_param": "&first={first}", "page_size": 10},
+    "duckduckgo": {"base_url": "https://html.duckduckgo.com/html/?q={query}", "page_param": "&s={offset}&dc={first}", "page_size": 30},
 }
 
+# Damping constant of reciprocal rank fusion in multi-engine rankings
+SERP_RRF_K = 60
+
+def serp_page_url(engine: str, q: str, page: int = 1) -> str:
+    engine_config = SUPPORTED_ENGINES[engine]
+    url = engine_config["base_url"].format(query=quote_plus(q))
+    if page > 1:
+        offset = (page - 1) * engine_config["page_size"]
+        url += engine_config["page_param"].format(offset=offset, first=offset + 1)
+    return url
+
 
 # --- THIS IS THE CORRECTED FUNCTION ---
+async def lookup_api_key(session: AsyncSessionDep, x_api_key: str) -> Optional[tuple[APIToken, User]]:
+    """Find an active, unexpired API key and its owner with one indexed query."""
+    row = (await session.exec(
+        select(APIToken, User)
+        .join(User, User.id == APIToken.user_id)
+        .where(APIToken.key_prefix == api_key_lookup_prefix(x_api_key))
+    )).first()
+    if not row:
+        return None
+    token, user = row
+    if not hmac.compare_digest(token.key_hash, hash_api_key(x_api_key)):
+        return None
+    if not token.is_active or token.expires_at <= datetime.utcnow():
+        return None
+    return token, user
+
+
 async def verify_api_token(
-    session: SessionDep,
+    session: AsyncSessionDep,
     x_api_key: Annotated[str, Header()],
 ) -> User:
     logger.debug(f"Verifying API key: {x_api_key[:8]}...")
-    
-    token_data = verify_api_key(x_api_key)
-    if not token_data or "user_id" not in token_data:
-        logger.warning(f"Invalid API key provided: {x_api_key[:8]}...")
-        raise HTTPException(status_code=401, detail="Invalid API key")
-    
-    user_id_from_token = token_data["user_id"]
-    
-    # Perform the database lookup directly right here.
-    user = session.get(User, user_id_from_token)
-    
-    if not user or not user.is_active:
-        logger.warning(f"API key valid, but user is invalid or inactive. User ID: {user_id_from_token}")
-        raise HTTPException(status_code=401, detail="Invalid or inactive user")
-    
+
+    # Steady state is a cache hit: no hashing and no queries
+    cached = api_key_cache.get(x_api_key)
+    cache_requests.inc(cache="api_key", result="hit" if cached else "miss")
+    if cached:
+        user = cached.user
+    else:
+        found = await lookup_api_key(session, x_api_key)
+        if not found:
+            logger.warning(f"Invalid API key provided: {x_api_key[:8]}...")
+            raise HTTPException(status_code=401, detail="Invalid API key")
+
+        token, user = found
+        if not user.is_active:
+            logger.warning(f"API key valid, but user is inactive. User ID: {user.id}")
+            raise HTTPException(status_code=401, detail="Invalid or inactive user")
+
+        api_key_cache.set(x_api_key, user, token.id)
+
     is_in_trial = user.is_trial and user.expiry_date and user.expiry_date > datetime.utcnow()
     if not user.has_subscription and not is_in_trial:
         logger.warning(f"User {user.email} lacks active subscription or trial.")
@@ -222,7 +478,7 @@ async def verify_api_token(
 
 # --- All other API endpoints can remain the same ---
 @router.post("/generate-api-key", response_model=dict)
-async def generate_user_api_key(session: SessionDep, current_user: CurrentUser):
+async def generate_user_api_key(session: AsyncSessionDep, current_user: AsyncCurrentUser):
     # ... (no changes needed)
     logger.debug(f"Generating API key for user: {current_user.email}")
     is_in_trial = current_user.is_trial and current_user.expiry_date and current_user.expiry_date > datetime.utcnow()
@@ -230,11 +486,15 @@ async def generate_user_api_key(session: SessionDep, current_user: CurrentUser):
         logger.info(f"User {current_user.email} lacks active subscription or trial")
         raise HTTPException(status_code=403, detail="Active subscription or trial required")
     try:
-        api_key = generate_api_key(user_id=str(current_user.id))
-        token = APIToken(user_id=current_user.id, token=api_key, expires_at=datetime.utcnow() + timedelta(days=365))
+        api_key, key_prefix, key_hash = generate_api_key()
+        token = APIToken(
+            user_id=current_user.id,
+            key_prefix=key_prefix,
+            key_hash=key_hash,
+            expires_at=datetime.utcnow() + timedelta(days=365),
+        )
         session.add(token)
-        session.commit()
-        session.refresh(token)
+        await session.commit()
         logger.info(f"API key generated for user: {current_user.email}")
         return {"api_key": api_key}
     except Exception as e:
@@ -254,12 +514,11 @@ async def get_proxy_status(region: str, user: Annotated[User, Depends(verify_api
         logger.info(f"Invalid region: {region}")
         raise HTTPException(status_code=400, detail="Invalid region. Use /regions to list available regions")
     
-    endpoints = endpoint_manager.get_endpoints(region)
-    status_tasks = [check_proxy_health(endpoint, region) for endpoint in endpoints]
-    results = await asyncio.gather(*status_tasks)
+    results = endpoint_manager.get_health(region)
+    checked_times = [r["last_checked"] for r in results if r["last_checked"]]
     
     healthy_count = sum(1 for r in results if r["is_healthy"])
-    total_count = len(endpoints)
+    total_count = len(results)
     avg_response_time = sum(r["response_time"] for r in results) / total_count if total_count > 0 else 0.0
     
     status = ProxyStatus(
@@ -268,128 +527,391 @@ async def get_proxy_status(region: str, user: Annotated[User, Depends(verify_api
         avg_response_time=avg_response_time,
         healthy_endpoints=healthy_count,
         total_endpoints=total_count,
-        last_checked=results[0]["last_checked"] if results else datetime.utcnow()
+        last_checked=min(checked_times) if checked_times else datetime.utcnow()
     )
     return ProxyStatusResponse(statuses=[status])
 
+async def get_request_token_id(session: AsyncSessionDep, user: User, x_api_key: str) -> UUID:
+    # verify_api_token has normally just cached the key for this request
+    cached = api_key_cache.get(x_api_key)
+    if cached:
+        return cached.token_id
+    found = await lookup_api_key(session, x_api_key)
+    if not found:
+        logger.warning(f"API key for user {user.id} is not in the database or was deactivated.")
+        raise HTTPException(status_code=401, detail="API key is invalid or has been deactivated.")
+    return found[0].id
+
+async def check_rate_limit(session: AsyncSessionDep, user: User, x_api_key: str, cost: int = 1) -> None:
+    """Apply the key/user rate limits and the monthly quota of the user's plan; raises 429 when exceeded."""
+    if not settings.RATE_LIMIT_ENABLED:
+        return
+    token_id = await get_request_token_id(session, user, x_api_key)
+    limits = await get_plan_limits(user.id)
+    decision = await rate_limiter.check(token_id, user.id, limits, cost=cost)
+    if not decision.allowed:
+        logger.info(f"Rate limit '{decision.limit}' exceeded for user {user.email}")
+        detail = "Monthly request quota exceeded" if decision.limit == "quota" else "Rate limit exceeded"
+        raise HTTPException(status_code=429, detail=detail, headers=decision.headers)
+
+async def refund_quota(user: User, amount: int) -> None:
+    """Give back monthly quota charged by check_rate_limit for work that was not done."""
+    if not settings.RATE_LIMIT_ENABLED or amount <= 0:
+        return
+    await rate_limiter.refund(user.id, await get_plan_limits(user.id), amount)
+
+async def enforce_rate_limit(
+    session: AsyncSessionDep,
+    user: Annotated[User, Depends(verify_api_token)],
+    x_api_key: Annotated[str, Header()],
+) -> None:
+    await check_rate_limit(session, user, x_api_key)
+
+UpstreamCall = Callable[[httpx.AsyncClient, str], Awaitable[T]]
+
+async def call_endpoint(endpoint: str, region: str, call: UpstreamCall[T]) -> Optional[T]:
+    """
+    Run `call` with one endpoint's client and URL, keeping its circuit breaker and score up
+    to date. Returns None when the endpoint failed; errors that are the target's own
+    (UpstreamTargetError, UpstreamTooLarge) are raised instead.
+    """
+    endpoint_id = endpoint_manager.get_endpoint_id(region, endpoint) or "unknown"
+    start_time = time.monotonic()
+    if not endpoint_manager.start_request(endpoint):
+        logger.debug(f"Circuit open for {endpoint_id} in {region}, skipping")
+        return None
+    try:
+        result = await call(upstream_clients.get(region), endpoint)
+    except asyncio.CancelledError:
+        endpoint_manager.cancel_request(endpoint)
+        raise
+    except (UpstreamTargetError, UpstreamTooLarge) as e:
+        # The endpoint did its job, so its breaker and error rate are left alone
+        endpoint_manager.finish_request(endpoint, time.monotonic() - start_time, ok=True)
+        logger.warning(f"Proxy fetch via {region} (endpoint: {endpoint_id}) got an unusable answer: {e}")
+        raise
+    except Exception as e:
+        endpoint_manager.finish_request(endpoint, time.monotonic() - start_time, ok=False)
+        logger.error(f"Proxy fetch failed in {region} (endpoint: {endpoint_id}): {e}")
+        return None
+    endpoint_manager.finish_request(endpoint, time.monotonic() - start_time, ok=True)
+    logger.info(f"Proxy fetch successful in {region} (endpoint: {endpoint_id})")
+    return result
+
+async def call_hedged(endpoint: str, region: str, backups: List[str], call: UpstreamCall[T]) -> Optional[T]:
+    # Give the primary until the region's latency percentile, then race a second endpoint against it
+    endpoint_manager.hedge_budget.deposit()
+    primary = asyncio.create_task(call_endpoint(endpoint, region, call))
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=endpoint_manager.hedge_delay(region))
+        if done or not backups or not endpoint_manager.hedge_budget.try_spend():
+            return await primary
+
+        backup_endpoint = endpoint_manager.choose_endpoint(backups)
+        backups.remove(backup_endpoint)
+        logger.debug(f"Hedging slow fetch in {region} with endpoint {endpoint_manager.get_endpoint_id(region, backup_endpoint)}")
+        tasks.add(asyncio.create_task(call_endpoint(backup_endpoint, region, call)))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.result() is not None:
+                    return task.result()
+        return None
+    finally:
+        # Also reached when the caller is cancelled, so no request outlives it
+        for task in tasks:
+            task.cancel()
+
+async def call_with_fallback(region: str, call: UpstreamCall[T], hedge: bool = False) -> Optional[tuple[T, str]]:
+    """
+    Run `call` on the best available endpoint, falling back across endpoints and regions.
+    Returns its result with the region that served it, or None when every endpoint failed.
+    """
+    for current_region in endpoint_manager.rank_regions(region):
+        healthy_endpoints = endpoint_manager.get_healthy_endpoints(current_region)
+        
+        if not healthy_endpoints:
+            logger.warning(f"No healthy endpoints in region: {current_region}. Trying next region.")
+            continue
+            
+        while healthy_endpoints:
+            endpoint = endpoint_manager.choose_endpoint(healthy_endpoints)
+            healthy_endpoints.remove(endpoint)
+            if hedge:
+                result = await call_hedged(endpoint, current_region, healthy_endpoints, call)
+            else:
+                result = await call_endpoint(endpoint, current_region, call)
+            if result is not None:
+                return result, current_region
+    return None
+
+async def fetch_upstream(url: str, region: str, user_agent: str, hedge: bool = False) -> Optional[ProxyResponse]:
+    """
+    Fetch `url` through the best available endpoint, falling back across endpoints and regions.
+    Returns None when every endpoint failed, and raises UpstreamTargetError when the target
+    site itself answered with an error.
+    """
+    async def call(client: httpx.AsyncClient, endpoint: str) -> Dict:
+        response = await client.post(
+            f"{endpoint}/fetch",
+            json={"url": url},
+            headers={"User-Agent": user_agent}
+        )
+        raise_for_upstream_status(response)
+        return response.json()
+
+    fetched = await call_with_fallback(region, call, hedge=hedge)
+    if fetched is None:
+        return None
+    data, region_used = fetched
+    return ProxyResponse(
+        result=data.get("result", ""),
+        public_ip=data.get("public_ip", "unknown"),
+        device_id=data.get("device_id", "unknown"),
+        region_used=region_used,
+    )
+
+def coalesce_key(url: str, region: str, user_agent: str, hedge: bool) -> str:
+    fields = {"url": url, "region": region, "user_agent": user_agent, "hedge": str(hedge)}
+    return make_cache_key(*(f"{name}={fields[name]}" for name in settings.PROXY_COALESCE_KEY))
+
+async def fetch_upstream_coalesced(url: str, region: str, user_agent: str, hedge: bool = False) -> Optional[ProxyResponse]:
+    """`fetch_upstream`, sharing the upstream request with identical concurrent fetches."""
+    if not settings.PROXY_COALESCE:
+        return await fetch_upstream(url, region, user_agent, hedge=hedge)
+    return await fetch_flights.do(
+        coalesce_key(url, region, user_agent, hedge),
+        lambda: fetch_upstream(url, region, user_agent, hedge=hedge),
+    )
+
 async def proxy_fetch_logic(
     request: Request,
-    session: SessionDep,
+    session: AsyncSessionDep,
     region: str,
     proxy_request: ProxyRequest,
     user: User,
     x_api_key: str,
+    hedge: bool = False,
+    max_age: Optional[int] = None,
+    response: Optional[Response] = None,
 ) -> ProxyResponse:
     logger.debug(f"Proxy fetch request for URL '{proxy_request.url}' in region: {region}, user: {user.email}")
     if region not in endpoint_manager.endpoints:
         raise HTTPException(status_code=400, detail="Invalid region. Use /regions to list available regions")
     
-    token = session.query(APIToken).filter(APIToken.token == x_api_key).first()
-    if not token:
-        logger.error(f"API key passed verification but not found in DB for user {user.id}. Possible data inconsistency.")
-        raise HTTPException(status_code=401, detail="API key is invalid or has been deactivated.")
-    
-    async def try_endpoint(endpoint: str, attempt_region: str) -> Optional[Dict]:
-        endpoint_id = endpoint_manager.get_endpoint_id(attempt_region, endpoint) or "unknown"
-        try:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                response = await client.post(
-                    f"{endpoint}/fetch",
-                    json={"url": str(proxy_request.url)},
-                    headers={"User-Agent": request.headers.get("user-agent", "tradevault-Internal-Fetcher/1.0")}
-                )
-                response.raise_for_status()
-                data = response.json()
-                logger.info(f"Proxy fetch successful in {attempt_region} (endpoint: {endpoint_id})")
-                return data
-        except Exception as e:
-            logger.error(f"Proxy fetch failed in {attempt_region} (endpoint: {endpoint_id}): {e}")
-            return None
+    token_id = await get_request_token_id(session, user, x_api_key)
+    user_agent = request.headers.get("user-agent", "tradevault-Internal-Fetcher/1.0")
 
-    regions_to_try = [region] + [r for r in random.sample(list(endpoint_manager.endpoints.keys()), len(endpoint_manager.endpoints)) if r != region]
+    # The User-Agent is forwarded upstream and can change the page, so it is part of the key
+    cache_key = make_cache_key(str(proxy_request.url), region, user_agent) if max_age else None
+    if cache_key:
+        cached = await response_cache.get(cache_key, min(max_age, settings.PROXY_CACHE_MAX_AGE))
+        if cached:
+            token_usage.add(token_id)
+            if response is not None:
+                response.headers["X-Cache"] = "HIT"
+            return ProxyResponse.model_validate_json(cached)
 
-    for current_region in regions_to_try:
-        endpoints = endpoint_manager.get_endpoints(current_region)
-        health_tasks = [check_proxy_health(endpoint, current_region) for endpoint in endpoints]
-        health_results = await asyncio.gather(*health_tasks)
-        healthy_endpoints = [r["endpoint"] for r in health_results if r["is_healthy"]]
-        
-        if not healthy_endpoints:
-            logger.warning(f"No healthy endpoints in region: {current_region}. Trying next region.")
-            continue
-            
-        random.shuffle(healthy_endpoints)
-        for endpoint in healthy_endpoints:
-            data = await try_endpoint(endpoint, current_region)
-            if data:
-                token.request_count += 1
-                session.commit()
-                return ProxyResponse(
-                    result=data.get("result", ""),
-                    public_ip=data.get("public_ip", "unknown"),
-                    device_id=data.get("device_id", "unknown"),
-                    region_used=current_region,
-                )
+    try:
+        proxy_response = await fetch_upstream_coalesced(str(proxy_request.url), region, user_agent, hedge=hedge)
+    except UpstreamTargetError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    if proxy_response:
+        if cache_key:
+            await response_cache.set(cache_key, proxy_response.model_dump_json().encode())
+        token_usage.add(token_id)
+        if response is not None:
+            response.headers["X-Cache"] = "MISS"
+        return proxy_response
     
     logger.error(f"All proxy fetch attempts failed for user {user.email} across all available regions.")
     raise HTTPException(status_code=503, detail="No healthy proxy endpoints available across all regions.")
 
-@router.post("/fetch", response_model=ProxyResponse)
+async def proxy_raw_logic(
+    request: Request,
+    session: AsyncSessionDep,
+    region: str,
+    proxy_request: ProxyRequest,
+    user: User,
+    x_api_key: str,
+) -> Response:
+    """
+    Like proxy_fetch_logic, but the fetched page itself is the response body. The page is
+    streamed out of the cloud function's JSON envelope as it arrives, so it is never held
+    whole; an envelope that does not start like one counts against the endpoint and falls
+    back, and a page over PROXY_STREAM_MAX_BYTES is cut off.
+    """
+    logger.debug(f"Proxy raw request for URL '{proxy_request.url}' in region: {region}, user: {user.email}")
+    if region not in endpoint_manager.endpoints:
+        raise HTTPException(status_code=400, detail="Invalid region. Use /regions to list available regions")
+
+    token_id = await get_request_token_id(session, user, x_api_key)
+    max_bytes = settings.PROXY_STREAM_MAX_BYTES
+    user_agent = request.headers.get("user-agent", "tradevault-Internal-Fetcher/1.0")
+
+    async def call(client: httpx.AsyncClient, endpoint: str) -> tuple[httpx.Response, EnvelopeStream]:
+        upstream = await client.send(
+            client.build_request("POST", f"{endpoint}/fetch", json={"url": str(proxy_request.url)}, headers={"User-Agent": user_agent}),
+            stream=True,
+        )
+        try:
+            raise_for_upstream_status(upstream)
+            content_length = upstream.headers.get("content-length")
+            if content_length is not None and int(content_length) > max_bytes:
+                raise UpstreamTooLarge(max_bytes)
+            envelope = EnvelopeStream(
+                limit_bytes(upstream.aiter_bytes(settings.PROXY_STREAM_CHUNK_SIZE), max_bytes),
+                settings.PROXY_STREAM_CHUNK_SIZE,
+            )
+            await envelope.start()
+            return upstream, envelope
+        except BaseException:
+            await upstream.aclose()
+            raise
+
+    try:
+        fetched = await call_with_fallback(region, call)
+    except UpstreamTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UpstreamTargetError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    if fetched is None:
+        logger.error(f"All proxy raw fetch attempts failed for user {user.email} across all available regions.")
+        raise HTTPException(status_code=503, detail="No healthy proxy endpoints available across all regions.")
+
+    (upstream, envelope), region_used = fetched
+    token_usage.add(token_id)
+
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            async for chunk in envelope.result():
+                yield chunk
+        except UpstreamTooLarge as e:
+            # The status is already sent; all that is left is to end the body early
+            logger.warning(f"Raw fetch of {proxy_request.url} cut off: {e}")
+        finally:
+            await upstream.aclose()
+
+    # text/plain so a fetched page is never rendered as HTML on the API's origin
+    return StreamingResponse(
+        body(),
+        media_type="text/plain",
+        headers={
+            "X-Region-Used": region_used,
+            "X-Public-IP": envelope.metadata.get("public_ip", "unknown"),
+            "X-Device-ID": envelope.metadata.get("device_id", "unknown"),
+        },
+    )
+
+@router.post("/fetch", response_model=ProxyResponse, dependencies=[Depends(enforce_rate_limit)])
 async def proxy_fetch(
     request: Request,
-    session: SessionDep,
+    session: AsyncSessionDep,
     region: str,
     proxy_request: ProxyRequest,
     user: Annotated[User, Depends(verify_api_token)],
     x_api_key: Annotated[str, Header()],
+    response: Response,
+    hedge: bool = False,
+    mode: Literal["json", "raw"] = "json",
+    max_age: Annotated[Optional[int], Query(ge=1)] = None,
 ):
-    return await proxy_fetch_logic(request, session, region, proxy_request, user, x_api_key)
+    """
+    Fetch a URL through the proxy network. With `hedge=true`, a request that is slower than
+    the region's usual latency is also sent to a second endpoint and the first answer wins.
 
-@router.get("/serp", response_model=SerpResponse)
-async def serp_fetch(
+    With `max_age` (seconds), a cached copy of the same URL fetched in the same region with the
+    same User-Agent is returned if it is at most that old; `X-Cache` reports HIT or MISS.
+
+    With `mode=raw` the response body is the fetched page itself rather than a JSON object, and
+    the fetch metadata is returned in the `X-Region-Used`, `X-Public-IP` and `X-Device-ID` headers.
+    """
+    if mode == "raw":
+        return await proxy_raw_logic(request, session, region, proxy_request, user, x_api_key)
+    return await proxy_fetch_logic(
+        request, session, region, proxy_request, user, x_api_key,
+        hedge=hedge, max_age=max_age, response=response,
+    )
+
+@router.post("/fetch/batch")
+async def proxy_fetch_batch(
     request: Request,
-    session: SessionDep,
-    q: str,
+    session: AsyncSessionDep,
     region: str,
+    batch: BatchFetchRequest,
     user: Annotated[User, Depends(verify_api_token)],
     x_api_key: Annotated[str, Header()],
-    engine: str = "google",
 ):
     """
-    Fetches a search engine results page (SERP), parses it, and returns structured data.
+    Fetch many URLs in one call. URLs are spread over the healthy endpoints with at most
+    PROXY_BATCH_CONCURRENCY in flight, and each result is streamed back as one NDJSON line
+    as soon as it completes (so lines are not in request order; use `index` to match them).
+    Usage is recorded once for the whole batch, counting successful fetches only.
     """
-    logger.debug(f"SERP request for query '{q}' via {engine} in {region} for user {user.email}")
-    if engine not in SUPPORTED_ENGINES:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Unsupported engine '{engine}'. Supported: {list(SUPPORTED_ENGINES.keys())}",
-        )
-    
-    engine_config = SUPPORTED_ENGINES[engine]
-    search_url = engine_config["base_url"].format(query=quote_plus(q))
-    proxy_request = ProxyRequest(url=search_url)
+    logger.debug(f"Batch fetch of {len(batch.urls)} URLs in region: {region}, user: {user.email}")
+    if region not in endpoint_manager.endpoints:
+        raise HTTPException(status_code=400, detail="Invalid region. Use /regions to list available regions")
+    if not batch.urls:
+        raise HTTPException(status_code=400, detail="At least one URL is required")
+    if len(batch.urls) > settings.PROXY_BATCH_MAX_URLS:
+        raise HTTPException(status_code=400, detail=f"A batch can contain at most {settings.PROXY_BATCH_MAX_URLS} URLs")
+    # One call against the rate limits, but every URL counts against the monthly quota
+    await check_rate_limit(session, user, x_api_key, cost=len(batch.urls))
 
+    token_id = await get_request_token_id(session, user, x_api_key)
+    user_agent = request.headers.get("user-agent", "tradevault-Internal-Fetcher/1.0")
+    semaphore = asyncio.Semaphore(settings.PROXY_BATCH_CONCURRENCY)
+
+    async def fetch_one(index: int, url: str) -> BatchFetchResult:
+        async with semaphore:
+            try:
+                proxy_response = await fetch_upstream_coalesced(url, region, user_agent)
+            except UpstreamTargetError as e:
+                return BatchFetchResult(index=index, url=url, ok=False, error=str(e))
+        if not proxy_response:
+            return BatchFetchResult(index=index, url=url, ok=False, error="No healthy proxy endpoints available across all regions.")
+        return BatchFetchResult(index=index, url=url, ok=True, **proxy_response.model_dump())
+
+    async def results() -> AsyncIterator[bytes]:
+        tasks = [asyncio.create_task(fetch_one(i, str(url))) for i, url in enumerate(batch.urls)]
+        succeeded = 0
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                succeeded += result.ok
+                yield (result.model_dump_json() + "\n").encode()
+        finally:
+            # Runs on completion and on client disconnect; unfinished fetches are abandoned
+            for task in tasks:
+                task.cancel()
+            token_usage.add(token_id, succeeded)
+            logger.info(f"Batch fetch for user {user.email}: {succeeded}/{len(tasks)} succeeded")
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+async def fetch_serp(q: str, engine: str, region: str, user_agent: str, page: int = 1) -> SerpResponse:
+    """Fetch one results page through the proxy network and parse it."""
     try:
-        proxy_response = await proxy_fetch_logic(
-            request=request, session=session, region=region,
-            proxy_request=proxy_request, user=user, x_api_key=x_api_key,
-        )
-    except HTTPException as e:
-        logger.error(f"Proxy fetch logic failed during SERP request: {e.detail}")
-        raise e
+        proxy_response = await fetch_upstream_coalesced(serp_page_url(engine, q, page), region, user_agent)
+    except UpstreamTargetError as e:
+        logger.error(f"Search engine {engine} refused query '{q}' (page {page}): {e}")
+        raise HTTPException(status_code=502, detail=str(e))
+    if not proxy_response:
+        logger.error(f"All proxy fetch attempts failed for SERP query '{q}' via {engine} (page {page})")
+        raise HTTPException(status_code=503, detail="No healthy proxy endpoints available across all regions.")
 
-    html_content = proxy_response.result
-    parser_func = engine_config["parser"]
     try:
-        organic_results = parser_func(html_content)
+        organic_results = await serp_parser_pool.parse(engine, proxy_response.result)
         if not organic_results:
-             logger.warning(f"Parser for '{engine}' found 0 results for query '{q}'. HTML may have changed.")
+             logger.warning(f"Parser for '{engine}' found 0 results for query '{q}' (page {page}). HTML may have changed.")
         else:
-             logger.info(f"Successfully parsed {len(organic_results)} results for query '{q}'")
+             logger.info(f"Successfully parsed {len(organic_results)} results for query '{q}' (page {page})")
     except Exception as e:
         logger.error(f"Failed to parse SERP HTML for query '{q}': {e}")
         raise HTTPException(status_code=500, detail="Failed to parse search engine response.")
-    
+
     return SerpResponse(
         search_engine=engine,
         search_query=q,
@@ -397,20 +919,292 @@ async def serp_fetch(
         organic_results=organic_results,
     )
 
-FRONT_PREVIEW_LENGTH = 8
-END_PREVIEW_LENGTH = 8
+async def fetch_serp_pages(
+    q: str, engine: str, region: str, user_agent: str, pages: int
+) -> tuple[List[SerpResponse], str]:
+    """
+    Fetch result pages 1..`pages` concurrently, each through the SERP cache; busy endpoints
+    score worse, so the pages spread over the region's endpoints. Returns the pages up to
+    the first one that failed or came back empty, and the combined X-Cache status.
+    """
+    results = await asyncio.gather(
+        *(
+            serp_cache.get(q, engine, region, lambda page=page: fetch_serp(q, engine, region, user_agent, page), page=page)
+            for page in range(1, pages + 1)
+        ),
+        return_exceptions=True,
+    )
+    served: List[SerpResponse] = []
+    statuses: List[str] = []
+    for page, result in enumerate(results, start=1):
+        if isinstance(result, BaseException):
+            if page == 1 or not isinstance(result, Exception):
+                raise result
+            logger.warning(f"SERP page {page} for query '{q}' via {engine} failed, returning {len(served)} pages: {result!r}")
+            break
+        serp_response, status = result
+        served.append(serp_response)
+        statuses.append(status)
+        if not serp_response.organic_results:
+            break
+    cache_status = next((s for s in ("MISS", "STALE") if s in statuses), "HIT")
+    return served, cache_status
+
+def merge_serp_pages(pages: List[SerpResponse], limit: Optional[int] = None) -> SerpResponse:
+    """Concatenate result pages in order, dropping links seen on an earlier page and renumbering positions."""
+    seen = set()
+    merged: List[SerpResult] = []
+    for serp_response in pages:
+        for result in serp_response.organic_results:
+            if result.link in seen:
+                continue
+            seen.add(result.link)
+            merged.append(result.model_copy(update={"position": len(merged) + 1}))
+    return SerpResponse(
+        search_engine=pages[0].search_engine,
+        search_query=pages[0].search_query,
+        region_used=pages[0].region_used,
+        organic_results=merged[:limit],
+    )
+
+async def fetch_engine_serp(
+    q: str, engine: str, region: str, user_agent: str, pages: int, num: Optional[int]
+) -> tuple[SerpResponse, str, int]:
+    """One engine's (merged) results, the X-Cache status and the number of pages served."""
+    served, cache_status = await fetch_serp_pages(q, engine, region, user_agent, pages)
+    if pages == 1 and num is None:
+        return served[0], cache_status, 1
+    return merge_serp_pages(served, limit=num), cache_status, len(served)
+
+def serp_link_key(link: str) -> str:
+    # The same page is often linked with another scheme, host case, fragment or trailing slash
+    parts = urlsplit(link)
+    host = parts.netloc.lower().removeprefix("www.")
+    return f"{host}{parts.path.rstrip('/')}" + (f"?{parts.query}" if parts.query else "")
+
+def rank_serp_results(responses: Dict[str, SerpResponse]) -> List[MergedSerpResult]:
+    """
+    Merge several engines' results into one ranking with reciprocal rank fusion: every
+    engine adds 1 / (SERP_RRF_K + rank) to each link it returned, so links ranked high
+    by several engines come first. Title and snippet come from the engine ranking it highest.
+    """
+    scores: Dict[str, float] = {}
+    best: Dict[str, tuple[int, SerpResult]] = {}
+    engines: Dict[str, List[str]] = {}
+    for engine_name, serp_response in responses.items():
+        for rank, result in enumerate(serp_response.organic_results, start=1):
+            key = serp_link_key(result.link)
+            if engine_name in engines.setdefault(key, []):
+                continue
+            engines[key].append(engine_name)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (SERP_RRF_K + rank)
+            if key not in best or rank < best[key][0]:
+                best[key] = (rank, result)
+    ranked = sorted(scores, key=lambda key: (-scores[key], best[key][0]))
+    return [
+        MergedSerpResult(
+            position=position,
+            title=best[key][1].title,
+            link=best[key][1].link,
+            snippet=best[key][1].snippet,
+            engines=engines[key],
+        )
+        for position, key in enumerate(ranked, start=1)
+    ]
+
+async def fetch_multi_engine_serp(
+    q: str,
+    engines: List[str],
+    region: str,
+    user_agent: str,
+    page_counts: Dict[str, int],
+    num: Optional[int],
+    timeout: float,
+) -> tuple[MultiEngineSerpResponse, str, int]:
+    """
+    Query every engine concurrently under one deadline and merge what came back. Engines
+    that fail or are still running at the deadline are reported in `errors`; only when
+    none answered is an error raised. Also returns the X-Cache status and pages served.
+    """
+    tasks = {
+        name: asyncio.ensure_future(fetch_engine_serp(q, name, region, user_agent, page_counts[name], num))
+        for name in engines
+    }
+    try:
+        _, pending = await asyncio.wait(tasks.values(), timeout=timeout)
+    finally:
+        # Page fetches are shared through the SERP cache, so they still finish and fill it
+        for task in tasks.values():
+            task.cancel()
+
+    results: Dict[str, SerpResponse] = {}
+    errors: Dict[str, str] = {}
+    statuses: List[str] = []
+    served = 0
+    for name, task in tasks.items():
+        if task in pending:
+            errors[name] = f"No response within {timeout:g}s"
+        elif task.exception() is not None:
+            error = task.exception()
+            logger.warning(f"SERP query '{q}' via {name} failed: {error!r}")
+            errors[name] = error.detail if isinstance(error, HTTPException) else "Failed to fetch search engine results."
+        else:
+            results[name], cache_status, engine_served = task.result()
+            statuses.append(cache_status)
+            served += engine_served
+    if not results:
+        if pending:
+            raise HTTPException(status_code=504, detail="No search engine answered in time.")
+        raise next(task.exception() for task in tasks.values())
+
+    multi_response = MultiEngineSerpResponse(
+        search_engines=engines,
+        search_query=q,
+        results=results,
+        errors=errors,
+        merged_results=rank_serp_results(results),
+    )
+    return multi_response, next((s for s in ("MISS", "STALE") if s in statuses), "HIT"), served
+
+def parse_engines(values: Optional[List[str]]) -> List[str]:
+    """
+    Engines from repeated and/or comma-separated `engine` values; `all` selects every engine
+    and no value at all selects google.
+    """
+    if values is None:
+        return ["google"]
+    names = [name.strip().lower() for value in values for name in value.split(",") if name.strip()]
+    if "all" in names:
+        return list(SUPPORTED_ENGINES)
+    unsupported = [name for name in names if name not in SUPPORTED_ENGINES]
+    if not names or unsupported:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported engine '{','.join(unsupported)}'. Supported: {list(SUPPORTED_ENGINES.keys())} or 'all'",
+        )
+    return list(dict.fromkeys(names))
+
+@router.get(
+    "/serp",
+    response_model=Union[SerpResponse, MultiEngineSerpResponse],
+)
+async def serp_fetch(
+    request: Request,
+    session: AsyncSessionDep,
+    q: str,
+    region: str,
+    user: Annotated[User, Depends(verify_api_token)],
+    x_api_key: Annotated[str, Header()],
+    response: Response,
+    engine: Annotated[Optional[List[str]], Query()] = None,
+    pages: Annotated[int, Query(ge=1, le=settings.SERP_MAX_PAGES)] = 1,
+    num: Annotated[Optional[int], Query(ge=1)] = None,
+):
+    """
+    Fetches a search engine results page (SERP), parses it, and returns structured data.
+
+    `pages` fetches that many result pages concurrently; `num` asks for that many results
+    instead and fetches the pages needed for them (up to SERP_MAX_PAGES). Pages are merged
+    into one list with continuous positions and without repeated links. A call counts once
+    against the rate limits, and every page served counts as one request against the
+    monthly quota and usage. The quota for all requested pages is reserved up front, so a
+    call that could exceed it is rejected, and pages that were not served are given back.
+
+    Several engines (`engine=all`, `engine=google,bing` or a repeated `engine`) are queried
+    concurrently and answered with a MultiEngineSerpResponse: each engine's results, a
+    merged ranking of the distinct links, and an error for every engine that failed or
+    missed the SERP_FANOUT_TIMEOUT deadline.
+
+    Responses are cached per normalized query, engine, region and page. `X-Cache` reports HIT,
+    STALE (served from cache while it is refreshed in the background) or MISS.
+    """
+    engines = parse_engines(engine)
+    logger.debug(f"SERP request for query '{q}' via {','.join(engines)} in {region} for user {user.email}")
+    if region not in endpoint_manager.endpoints:
+        raise HTTPException(status_code=400, detail="Invalid region. Use /regions to list available regions")
+
+    page_counts = {
+        name: min(-(-num // SUPPORTED_ENGINES[name]["page_size"]), settings.SERP_MAX_PAGES) if num else pages
+        for name in engines
+    }
+    requested = sum(page_counts.values())
+    await check_rate_limit(session, user, x_api_key, cost=requested)
+
+    token_id = await get_request_token_id(session, user, x_api_key)
+    user_agent = request.headers.get("user-agent", "tradevault-Internal-Fetcher/1.0")
+    serp_response: Union[SerpResponse, MultiEngineSerpResponse]
+    served = 0
+    try:
+        if len(engines) == 1:
+            serp_response, cache_status, served = await fetch_engine_serp(
+                q, engines[0], region, user_agent, page_counts[engines[0]], num
+            )
+        else:
+            serp_response, cache_status, served = await fetch_multi_engine_serp(
+                q, engines, region, user_agent, page_counts, num, settings.SERP_FANOUT_TIMEOUT
+            )
+    finally:
+        # A failed call still counts as one request, like a failed /fetch
+        await refund_quota(user, requested - max(served, 1))
+    token_usage.add(token_id, served)
+    response.headers["X-Cache"] = cache_status
+    return serp_response
+
+@router.get(
+    "/admin/endpoints",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=EndpointScoresResponse,
+)
+async def get_endpoint_scores():
+    """
+    Show the selection scores the proxy engine uses to route traffic, per region and endpoint.
+    Regions are listed in the fallback order they would get for a request without a preference.
+    """
+    regions = []
+    for region in sorted(endpoint_manager.endpoints, key=lambda r: (endpoint_manager.region_latency(r) is None, endpoint_manager.region_latency(r) or 0.0)):
+        healthy = set(endpoint_manager.get_healthy_endpoints(region))
+        endpoints = []
+        for url in endpoint_manager.get_endpoints(region):
+            stats = endpoint_manager.stats[url]
+            endpoints.append(EndpointScore(
+                endpoint_id=endpoint_manager.get_endpoint_id(region, url) or "unknown",
+                region=region,
+                url=url,
+                is_healthy=url in healthy,
+                circuit_state=endpoint_manager.breakers[url].state.value,
+                ewma_latency=stats.ewma_latency,
+                error_rate=stats.error_rate,
+                in_flight=stats.in_flight,
+                requests=stats.requests,
+                failures=stats.failures,
+                score=endpoint_manager.score(url),
+            ))
+        regions.append(RegionScore(region=region, latency=endpoint_manager.region_latency(region), endpoints=endpoints))
+    return EndpointScoresResponse(regions=regions)
+
+@router.delete(
+    "/admin/serp-cache",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=SerpCachePurgeResponse,
+)
+async def purge_serp_cache(q: Optional[str] = None, engine: Optional[str] = None, region: Optional[str] = None):
+    """
+    Drop cached SERP responses in this worker. Without filters the whole cache is purged;
+    `q`, `engine` and `region` narrow it to the matching entries.
+    """
+    return SerpCachePurgeResponse(purged=serp_cache.purge(q=q, engine=engine, region=region))
 
 @router.get("/api-keys", response_model=List[APIKeyResponse])
-async def list_user_api_keys(session: SessionDep, current_user: CurrentUser):
+async def list_user_api_keys(session: AsyncSessionDep, current_user: AsyncCurrentUser):
     logger.debug(f"Listing API keys for user: {current_user.email}")
-    api_tokens = session.query(APIToken).filter(
+    api_tokens = (await session.exec(select(APIToken).where(
         APIToken.user_id == current_user.id,
         APIToken.is_active == True
-    ).all()
+    ))).all()
     
     return [
         APIKeyResponse(
-            key_preview=f"{token.token[:FRONT_PREVIEW_LENGTH]}...{token.token[-END_PREVIEW_LENGTH:]}",
+            key_preview=f"{token.key_prefix}...",
             created_at=token.created_at.isoformat(),
             expires_at=token.expires_at.isoformat(),
             is_active=token.is_active,
@@ -422,33 +1216,34 @@ async def list_user_api_keys(session: SessionDep, current_user: CurrentUser):
 @router.delete("/api-keys/{key_preview}", status_code=204)
 async def delete_api_key(
     key_preview: str,
-    session: SessionDep,
-    current_user: CurrentUser,
+    session: AsyncSessionDep,
+    current_user: AsyncCurrentUser,
     background_tasks: BackgroundTasks
 ):
     logger.debug(f"Deleting API key with preview: {key_preview}, user: {current_user.email}")
     
     if '...' not in key_preview:
-        raise HTTPException(status_code=400, detail="Invalid key_preview format. Expected 'start...end'")
-    key_start = key_preview.split('...')[0]
+        raise HTTPException(status_code=400, detail="Invalid key_preview format. Expected '<key prefix>...'")
+    key_prefix = key_preview.split('...')[0]
     
-    token = session.query(APIToken).filter(
+    token = (await session.exec(select(APIToken).where(
+        APIToken.key_prefix == key_prefix,
         APIToken.user_id == current_user.id,
-        APIToken.token.like(f"{key_start}%"),
         APIToken.is_active == True
-    ).first()
+    ))).first()
 
     if not token:
         logger.info(f"API key deletion attempted but not found. User: {current_user.id}, Preview: {key_preview}")
         raise HTTPException(status_code=404, detail="API key not found")
 
     token_data = {
-        "token_preview": f"{token.token[:FRONT_PREVIEW_LENGTH]}...{token.token[-END_PREVIEW_LENGTH:]}",
+        "token_preview": f"{token.key_prefix}...",
         "request_count": token.request_count
     }
     
-    session.delete(token)
-    session.commit()
+    await session.delete(token)
+    await session.commit()
+    api_key_cache.invalidate_token(token.id)
 
     def send_deletion_notification():
         try:
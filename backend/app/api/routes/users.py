@@ -3,7 +3,7 @@ from typing import Any
 from datetime import datetime, timedelta
 import logging
 
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException
 from sqlmodel import col, delete, func, select
 
 from app import crud
@@ -12,6 +12,7 @@ from app.api.deps import (
     SessionDep,
     get_current_active_superuser,
 )
+from app.core.api_key_cache import api_key_cache
 from app.core.config import settings
 from app.core.security import get_password_hash, verify_password
 from app.models import (
@@ -33,19 +34,6 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/users", tags=["users"])
 
-# Background task to check subscription expirations
-def check_subscription_expirations(session: SessionDep):
-    logger.debug("Starting check_subscription_expirations")
-    users = session.exec(select(User)).all()
-    for user in users:
-        if user.has_subscription and user.expiry_date:
-            if datetime.utcnow() > user.expiry_date:
-                user.has_subscription = False
-                user.expiry_date = None
-                session.add(user)
-    session.commit()
-    logger.debug("Completed check_subscription_expirations")
-
 @router.get(
     "/",
     dependencies=[Depends(get_current_active_superuser)],
@@ -68,7 +56,6 @@ def create_user(
     *, 
     session: SessionDep, 
     user_in: UserCreate,
-    background_tasks: BackgroundTasks
 ) -> Any:
     logger.debug(f"Creating user: {user_in.email}")
     user = crud.get_user_by_email(session=session, email=user_in.email)
@@ -92,8 +79,6 @@ def create_user(
             subject=email_data.subject, 
             html_content=email_data.html_content,
         )
-    
-    background_tasks.add_task(check_subscription_expirations, session)
     logger.debug(f"User created: {user.id}")
     return user
 
@@ -163,6 +148,7 @@ def delete_user_me(session: SessionDep, current_user: CurrentUser) -> Any:
     session.exec(statement)
     session.delete(current_user)
     session.commit()
+    api_key_cache.invalidate_user(current_user.id)
     logger.debug("User deleted")
     return Message(message="User deleted successfully")
 
@@ -170,7 +156,6 @@ def delete_user_me(session: SessionDep, current_user: CurrentUser) -> Any:
 def register_user(
     session: SessionDep, 
     user_in: UserRegister,
-    background_tasks: BackgroundTasks
 ) -> Any:
     logger.debug(f"Signup request received: {user_in.dict()}")
     user = crud.get_user_by_email(session=session, email=user_in.email)
@@ -185,8 +170,6 @@ def register_user(
     logger.debug(f"Creating user: {user_create.dict()}")
     user = crud.create_user(session=session, user_create=user_create, is_trial=True)
     logger.debug(f"User created: {user.id}")
-    background_tasks.add_task(check_subscription_expirations, session)
-    logger.debug("Background task scheduled")
     return user
 
 @router.get("/{user_id}", response_model=UserPublic)
@@ -217,7 +200,6 @@ def update_user(
     session: SessionDep,
     user_id: uuid.UUID,
     user_in: UserUpdate,
-    background_tasks: BackgroundTasks
 ) -> Any:
     logger.debug(f"Starting update_user for user_id: {user_id}, input: {user_in.dict()}")
     db_user = session.get(User, user_id)
@@ -247,9 +229,8 @@ def update_user(
 
     logger.debug("Calling crud.update_user")
     db_user = crud.update_user(session=session, db_user=db_user, user_in=user_in)
+    api_key_cache.invalidate_user(db_user.id)
     logger.debug("crud.update_user completed")
-    
-    background_tasks.add_task(check_subscription_expirations, session)
     return db_user
 
 @router.delete("/{user_id}", dependencies=[Depends(get_current_active_superuser)])
@@ -273,5 +254,6 @@ def delete_user(
     session.exec(statement)
     session.delete(user)
     session.commit()
+    api_key_cache.invalidate_user(user_id)
     logger.debug("User deleted")
     return Message(message="User deleted successfully")
\ No newline at end of file
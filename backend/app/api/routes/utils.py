@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
 from pydantic.networks import EmailStr
 from jinja2 import Environment, FileSystemLoader
 from app.api.deps import get_current_active_superuser
 from app.models import Message
 from app.utils import generate_test_email, send_email
 from app.core.config import settings
+from app.core.metrics import metrics
 
 from fastapi import APIRouter, Depends, HTTPException, Request, BackgroundTasks
 import logging
@@ -34,6 +36,17 @@ def test_email(email_to: EmailStr) -> Message:
 async def health_check() -> bool:
     return True
 
+@router.get(
+    "/metrics",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_class=PlainTextResponse,
+)
+async def get_metrics() -> str:
+    """
+    In-process metrics of the worker serving this request, in Prometheus text format.
+    """
+    return metrics.render()
+
 class EmailData:
     def __init__(self, html_content: str, subject: str):
         self.html_content = html_content
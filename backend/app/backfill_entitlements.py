@@ -0,0 +1,35 @@
+import logging
+import os
+
+import stripe
+from sqlmodel import Session
+
+from app.core.db import engine
+from app.core.stripe_sync import backfill_entitlements, needs_entitlement_backfill
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+
+
+def main() -> None:
+    if not stripe.api_key:
+        logger.info("Stripe is not configured; skipping the entitlement backfill")
+        return
+    with Session(engine) as session:
+        if not needs_entitlement_backfill(session):
+            logger.info("Entitlements are populated; nothing to backfill")
+            return
+    logger.info("Backfilling entitlements from Stripe")
+    try:
+        users = backfill_entitlements()
+    except stripe.error.StripeError as e:
+        # Not fatal for the deploy: the next start retries, and the reconciler fills them in too
+        logger.error(f"Entitlement backfill failed: {e}")
+        return
+    logger.info(f"Entitlement backfill finished: {users} users written")
+
+
+if __name__ == "__main__":
+    main()
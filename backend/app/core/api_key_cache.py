@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass
+from uuid import UUID
+
+from app.core.config import settings
+from app.models import User
+
+
+@dataclass(frozen=True)
+class CachedAPIKey:
+    # Detached snapshot of the key's owner; subscription/trial checks run against it on every hit
+    user: User
+    token_id: UUID
+
+
+class APIKeyCache:
+    """
+    TTL cache of verified API keys, so steady-state key verification needs no
+    database round trip.
+
+    Only successful verifications are cached. Entries must be invalidated when the
+    key is deleted or the owner loses access (subscription change, deactivation,
+    deletion); the TTL bounds how long other workers, which do not see the
+    invalidation, can keep serving a stale entry.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: OrderedDict[str, tuple[float, CachedAPIKey]] = OrderedDict()
+        self._keys_by_user: dict[UUID, set[str]] = {}
+        self._key_by_token: dict[UUID, str] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, api_key: str) -> CachedAPIKey | None:
+        with self._lock:
+            item = self._entries.get(api_key)
+            if item is not None and item[0] <= self.clock():
+                self._remove(api_key)
+                item = None
+        return item[1] if item else None
+
+    def set(self, api_key: str, user: User, token_id: UUID) -> None:
+        entry = CachedAPIKey(user=User(**user.model_dump()), token_id=token_id)
+        with self._lock:
+            self._remove(api_key)
+            self._entries[api_key] = (self.clock() + self.ttl, entry)
+            self._keys_by_user.setdefault(entry.user.id, set()).add(api_key)
+            self._key_by_token[token_id] = api_key
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, api_key: str) -> None:
+        item = self._entries.pop(api_key, None)
+        if item is None:
+            return
+        self._key_by_token.pop(item[1].token_id, None)
+        user_keys = self._keys_by_user.get(item[1].user.id)
+        if user_keys is not None:
+            user_keys.discard(api_key)
+            if not user_keys:
+                del self._keys_by_user[item[1].user.id]
+
+    def invalidate_token(self, token_id: UUID) -> None:
+        with self._lock:
+            api_key = self._key_by_token.get(token_id)
+            if api_key is not None:
+                self._remove(api_key)
+
+    def invalidate_user(self, user_id: UUID) -> None:
+        with self._lock:
+            for api_key in list(self._keys_by_user.get(user_id, ())):
+                self._remove(api_key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+            self._key_by_token.clear()
+
+
+api_key_cache = APIKeyCache(settings.API_KEY_CACHE_TTL, settings.API_KEY_CACHE_MAX_ENTRIES)
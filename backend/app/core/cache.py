@@ -0,0 +1,197 @@
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+cache_requests = metrics.counter(
+    "cache_requests_total", "Cache lookups by cache and result (hit/miss)", ["cache", "result"]
+)
+cache_hit_ratio = metrics.gauge(
+    "cache_hit_ratio", "Fraction of lookups served from the cache since startup", ["cache"]
+)
+cache_size_bytes = metrics.gauge(
+    "cache_size_bytes", "Bytes held by the in-memory tier of the cache", ["cache"]
+)
+
+
+def make_cache_key(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    value: bytes
+    stored_at: float
+
+    def age(self) -> float:
+        return time.time() - self.stored_at
+
+
+class LRUCache:
+    """In-memory LRU cache bounded by the total size of the stored values."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> CacheEntry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        if len(entry.value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size_bytes -= len(old.value)
+            self._entries[key] = entry
+            self.size_bytes += len(entry.value)
+            while self.size_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= len(evicted.value)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size_bytes -= len(old.value)
+
+    def keys(self) -> list[str]:
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+
+class DiskCache:
+    """
+    zlib-compressed on-disk cache tier, one file per key. Survives restarts and is
+    shared by all workers on the host. Files older than `max_age` are pruned.
+    """
+
+    _header = struct.Struct("!d")
+
+    def __init__(self, directory: str, max_age: float):
+        self.directory = Path(directory)
+        self.max_age = max_age
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.z"
+
+    def get(self, key: str) -> CacheEntry | None:
+        try:
+            raw = self._path(key).read_bytes()
+            (stored_at,) = self._header.unpack_from(raw)
+            return CacheEntry(value=zlib.decompress(raw[self._header.size :]), stored_at=stored_at)
+        except FileNotFoundError:
+            return None
+        except (struct.error, zlib.error) as e:
+            logger.warning(f"Dropping corrupt disk cache entry {key}: {e}")
+            self._path(key).unlink(missing_ok=True)
+            return None
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        data = self._header.pack(entry.stored_at) + zlib.compress(entry.value)
+        # Write to a temp file and rename so readers in other workers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            # prune() only looks at *.z files, so a leftover temp file would never be removed
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def prune(self) -> int:
+        cutoff = time.time() - self.max_age
+        removed = 0
+        for path in self.directory.glob("*.z"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
+
+
+class TieredCache:
+    """
+    Byte-value cache with an in-memory LRU tier and an optional disk tier.
+    Freshness is decided per lookup: callers pass the maximum age they accept.
+    """
+
+    def __init__(self, name: str, max_bytes: int, disk_dir: str | None = None, disk_max_age: float = 3600.0):
+        self.name = name
+        self.memory = LRUCache(max_bytes)
+        self.disk = DiskCache(disk_dir, disk_max_age) if disk_dir else None
+        self.hits = 0
+        self.misses = 0
+
+    def _record(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        cache_requests.inc(cache=self.name, result="hit" if hit else "miss")
+        cache_hit_ratio.set(self.hits / (self.hits + self.misses), cache=self.name)
+
+    async def get(self, key: str, max_age: float) -> bytes | None:
+        entry = self.memory.get(key)
+        if entry is None and self.disk is not None:
+            entry = await run_in_threadpool(self.disk.get, key)
+            if entry is not None:
+                self.memory.set(key, entry)
+                cache_size_bytes.set(self.memory.size_bytes, cache=self.name)
+        hit = entry is not None and entry.age() <= max_age
+        self._record(hit)
+        return entry.value if hit and entry is not None else None
+
+    async def set(self, key: str, value: bytes) -> None:
+        entry = CacheEntry(value=value, stored_at=time.time())
+        self.memory.set(key, entry)
+        cache_size_bytes.set(self.memory.size_bytes, cache=self.name)
+        if self.disk is not None:
+            try:
+                await run_in_threadpool(self.disk.set, key, entry)
+            except OSError as e:
+                logger.error(f"Failed to write {self.name} disk cache entry: {e}")
+
+    async def prune(self) -> None:
+        if self.disk is not None:
+            removed = await run_in_threadpool(self.disk.prune)
+            logger.debug(f"Pruned {removed} expired entries from {self.name} disk cache")
+
+    def clear(self) -> None:
+        self.memory.clear()
+        cache_size_bytes.set(0, cache=self.name)
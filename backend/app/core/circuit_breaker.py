@@ -0,0 +1,122 @@
+import logging
+import time
+from collections import deque
+from collections.abc import Callable
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open circuit breaker for a single upstream endpoint.
+
+    The circuit opens after `failure_threshold` consecutive failures, or when the
+    error rate over the last `window_size` calls reaches `error_rate_threshold`
+    (once at least `min_requests` calls were seen). After `open_duration` seconds
+    it goes half-open and lets up to `half_open_max_calls` trial requests through:
+    a success closes it again, a failure re-opens it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        error_rate_threshold: float = 0.5,
+        window_size: int = 20,
+        min_requests: int = 10,
+        open_duration: float = 30.0,
+        half_open_max_calls: int = 1,
+        on_transition: Callable[[str, CircuitState, CircuitState], None] | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_requests = min_requests
+        self.open_duration = open_duration
+        self.half_open_max_calls = half_open_max_calls
+        self.on_transition = on_transition
+        self.clock = clock
+
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._consecutive_failures = 0
+        self._half_open_calls = 0
+        self._outcomes: deque[bool] = deque(maxlen=window_size)
+
+    def _transition(self, new_state: CircuitState) -> None:
+        old_state = self._state
+        if old_state == new_state:
+            return
+        self._state = new_state
+        self._half_open_calls = 0
+        if new_state == CircuitState.OPEN:
+            self._opened_at = self.clock()
+        elif new_state == CircuitState.CLOSED:
+            self._consecutive_failures = 0
+            self._outcomes.clear()
+        logger.info(f"Circuit {self.name}: {old_state.value} -> {new_state.value}")
+        if self.on_transition:
+            self.on_transition(self.name, old_state, new_state)
+
+    @property
+    def state(self) -> CircuitState:
+        if self._state == CircuitState.OPEN and self.clock() - self._opened_at >= self.open_duration:
+            self._transition(CircuitState.HALF_OPEN)
+        return self._state
+
+    @property
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def allow_request(self) -> bool:
+        """Whether a request would currently be let through, without reserving a slot."""
+        state = self.state
+        if state == CircuitState.CLOSED:
+            return True
+        if state == CircuitState.HALF_OPEN:
+            return self._half_open_calls < self.half_open_max_calls
+        return False
+
+    def acquire(self) -> bool:
+        """Reserve permission for one request; half-open trial slots are limited."""
+        if not self.allow_request():
+            return False
+        if self._state == CircuitState.HALF_OPEN:
+            self._half_open_calls += 1
+        return True
+
+    def release(self) -> None:
+        """Give back a slot for a request that finished without a usable outcome."""
+        if self._state == CircuitState.HALF_OPEN and self._half_open_calls > 0:
+            self._half_open_calls -= 1
+
+    def record_success(self) -> None:
+        if self._state == CircuitState.HALF_OPEN:
+            self._transition(CircuitState.CLOSED)
+            return
+        self._consecutive_failures = 0
+        self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        if self._state == CircuitState.HALF_OPEN:
+            self._transition(CircuitState.OPEN)
+            return
+        if self._state == CircuitState.OPEN:
+            return
+        self._consecutive_failures += 1
+        self._outcomes.append(False)
+        if self._consecutive_failures >= self.failure_threshold or (
+            len(self._outcomes) >= self.min_requests
+            and self.error_rate >= self.error_rate_threshold
+        ):
+            self._transition(CircuitState.OPEN)
@@ -91,6 +91,109 @@ class Settings(BaseSettings):
     FIRST_SUPERUSER: str
     FIRST_SUPERUSER_PASSWORD: str
 
+    # Upstream proxy endpoint connection pools
+    PROXY_HTTP2: bool = True
+    PROXY_POOL_MAX_CONNECTIONS: int = 100
+    PROXY_POOL_MAX_KEEPALIVE: int = 20
+    PROXY_POOL_KEEPALIVE_EXPIRY: float = 30.0
+    PROXY_CONNECT_TIMEOUT: float = 5.0
+    PROXY_FETCH_TIMEOUT: float = 15.0
+    PROXY_HEALTH_TIMEOUT: float = 5.0
+    PROXY_HEALTH_CHECK_INTERVAL: float = 30.0
+    # Smoothing factor for per-endpoint latency / error-rate averages
+    PROXY_EWMA_ALPHA: float = 0.3
+    # Assumed fetch latency of endpoints in a region where none has been measured yet
+    PROXY_PRIOR_LATENCY: float = 1.0
+    # Hedged fetches: delay is this percentile of recent latencies in the region
+    PROXY_HEDGE_PERCENTILE: float = 0.95
+    PROXY_HEDGE_WINDOW: int = 200
+    PROXY_HEDGE_MIN_SAMPLES: int = 20
+    PROXY_HEDGE_DEFAULT_DELAY: float = 2.0
+    # Maximum extra upstream traffic from hedging, as a fraction of hedged requests
+    PROXY_HEDGE_BUDGET_RATIO: float = 0.1
+    # Per-endpoint circuit breakers
+    PROXY_CIRCUIT_FAILURE_THRESHOLD: int = 5
+    PROXY_CIRCUIT_ERROR_RATE: float = 0.5
+    PROXY_CIRCUIT_WINDOW: int = 20
+    PROXY_CIRCUIT_MIN_REQUESTS: int = 10
+    PROXY_CIRCUIT_OPEN_SECONDS: float = 30.0
+    PROXY_CIRCUIT_HALF_OPEN_CALLS: int = 1
+    # Raw page mode (/proxy/fetch?mode=raw): read size and envelope size limit
+    PROXY_STREAM_CHUNK_SIZE: int = 64 * 1024
+    PROXY_STREAM_MAX_BYTES: int = 20 * 1024 * 1024
+    # Batch fetch (/proxy/fetch/batch)
+    PROXY_BATCH_MAX_URLS: int = 500
+    PROXY_BATCH_CONCURRENCY: int = 20
+    # Response cache for /proxy/fetch?max_age=...; the disk tier is enabled by setting a directory
+    PROXY_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    PROXY_CACHE_DIR: str | None = None
+    PROXY_CACHE_MAX_AGE: int = 3600
+    # Coalesce identical concurrent fetches into one upstream request; the key is built
+    # from these request fields
+    PROXY_COALESCE: bool = True
+    PROXY_COALESCE_KEY: list[Literal["url", "region", "user_agent", "hedge"]] = [
+        "url",
+        "region",
+        "user_agent",
+    ]
+    # HTML parser behind /proxy/serp; both backends produce identical results
+    SERP_PARSER_BACKEND: Literal["bs4", "lxml"] = "lxml"
+    # App worker processes; uvicorn reads the same variable when --workers is not given
+    WEB_CONCURRENCY: int = 1
+    # SERP pages are parsed in a process pool per app worker, sized to that worker's share
+    # of the available cores unless set (0 parses inline); pages shorter than this are
+    # parsed inline
+    SERP_PARSE_WORKERS: int | None = None
+    SERP_PARSE_INLINE_MAX_CHARS: int = 20_000
+    # Parsed /proxy/serp responses, keyed by normalized query, engine and region. Entries
+    # are fresh for their engine's TTL, then served stale for SERP_CACHE_STALE_TTL more
+    # seconds while a background request refreshes them
+    SERP_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    SERP_CACHE_TTL: dict[str, float] = {"google": 900.0, "bing": 1800.0, "duckduckgo": 1800.0}
+    SERP_CACHE_DEFAULT_TTL: float = 900.0
+    SERP_CACHE_STALE_TTL: float = 3600.0
+    # Most result pages one /proxy/serp call may fetch (pages or num)
+    SERP_MAX_PAGES: int = 10
+    # Overall deadline of a multi-engine /proxy/serp call; engines still running are
+    # reported as errors and the others are returned
+    SERP_FANOUT_TIMEOUT: float = 20.0
+
+    # How often buffered API key usage counts are written to the database
+    USAGE_FLUSH_INTERVAL: float = 5.0
+    # Verified API keys are cached per worker; invalidation is local, so the TTL
+    # bounds how stale other workers can be after a key or subscription change
+    API_KEY_CACHE_TTL: float = 60.0
+    API_KEY_CACHE_MAX_ENTRIES: int = 100_000
+
+    # Token-bucket limits (requests/second and burst) per API key and per user, and an
+    # optional monthly quota; a plan's product metadata can override each of them
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: Literal["memory", "postgres"] = "memory"
+    RATE_LIMIT_KEY_PER_SECOND: float = 10.0
+    RATE_LIMIT_KEY_BURST: int = 20
+    RATE_LIMIT_USER_PER_SECOND: float = 20.0
+    RATE_LIMIT_USER_BURST: int = 40
+    RATE_LIMIT_MONTHLY_QUOTA: int | None = None
+    # Per-worker cache of entitlement rows; other workers see webhook changes after this long
+    ENTITLEMENT_CACHE_TTL: float = 60.0
+    # Stored Stripe webhook events are processed right after they are acknowledged; the
+    # poller picks up retries and events left behind by a worker that stopped
+    WEBHOOK_INBOX_POLL_INTERVAL: float = 10.0
+    WEBHOOK_INBOX_BATCH_SIZE: int = 100
+    WEBHOOK_INBOX_MAX_ATTEMPTS: int = 10
+    # Full reload of the in-memory Stripe product/price catalog; product and price
+    # webhooks update it in between, in the worker that processes them
+    STRIPE_CATALOG_REFRESH_INTERVAL: float = 900.0
+    # How often every worker replays catalog webhooks processed by the others
+    STRIPE_CATALOG_SYNC_INTERVAL: float = 10.0
+    # How often workers look for product resync jobs queued by product.updated webhooks
+    SUBSCRIPTION_RESYNC_POLL_INTERVAL: float = 30.0
+    # Full Stripe-to-database reconciliation; one worker runs it per interval
+    STRIPE_RECONCILE_INTERVAL: float = 6 * 3600
+    # Expired subscriptions are switched off by a sweeper, this many rows per transaction
+    SUBSCRIPTION_EXPIRY_INTERVAL: float = 300.0
+    SUBSCRIPTION_EXPIRY_BATCH_SIZE: int = 1000
+
     def _check_default_secret(self, var_name: str, value: str | None) -> None:
         if value == "changethis":
             message = (
@@ -1,3 +1,9 @@
+import hashlib
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import Session, create_engine, select
 
 from app import crud
@@ -5,6 +11,27 @@ from app.core.config import settings
 from app.models import User, UserCreate
 
 engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
+# Same database through psycopg's async driver, for routes on the request hot path
+async_engine = create_async_engine(str(settings.SQLALCHEMY_DATABASE_URI))
+
+
+@contextmanager
+def advisory_lock(name: str) -> Iterator[bool]:
+    """
+    Hold a session-level Postgres advisory lock for the block, without waiting for it.
+    Yields whether it was acquired, so exactly one of several workers runs the block;
+    the lock is released on exit or when the holder's connection dies.
+    """
+    key = int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], "big", signed=True)
+    with engine.connect() as conn:
+        acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key}).scalar()
+        conn.commit()
+        try:
+            yield bool(acquired)
+        finally:
+            if acquired:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+                conn.commit()
 
 
 def init_db(session: Session) -> None:
@@ -0,0 +1,198 @@
+import logging
+import time
+from collections.abc import Iterable, Mapping
+from datetime import datetime
+from typing import Any
+from uuid import UUID
+
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.cache import cache_requests
+from app.core.config import settings
+from app.core.db import async_engine
+from app.core.rate_limit import PlanLimits
+from app.core.singleflight import SingleFlight
+from app.models import Entitlement
+
+logger = logging.getLogger(__name__)
+
+# Subscription statuses that grant access to paid features
+ACCESS_STATUSES = frozenset({"active", "trialing", "past_due"})
+
+
+def enabled_features(metadata: Mapping[str, str] | None) -> list[str]:
+    """Feature tags are product metadata keys set to "true"."""
+    return [key for key, value in (metadata or {}).items() if value == "true"]
+
+
+def _get(obj: Any, key: str) -> Any:
+    return obj.get(key) if obj is not None else None
+
+
+def stripe_id(obj: Any) -> str | None:
+    # Stripe references are ids, or full objects when expanded
+    return obj if obj is None or isinstance(obj, str) else obj.get("id")
+
+
+def subscription_flags(status: str) -> dict[str, bool]:
+    """The User columns mirroring a subscription status."""
+    return {
+        "has_subscription": status in ACCESS_STATUSES,
+        "is_trial": status == "trialing",
+        "is_deactivated": status in ("canceled", "unpaid", "incomplete_expired"),
+    }
+
+
+def entitlement_values(
+    user_id: UUID,
+    subscription: Mapping[str, Any],
+    product: Mapping[str, Any] | None,
+    event_created: int | None = None,
+) -> dict[str, Any]:
+    """Column values of the entitlement row for a Stripe subscription."""
+    plan = subscription.get("plan")
+    metadata = dict(_get(product, "metadata") or {})
+    return {
+        "subscription_id": subscription["id"],
+        "user_id": user_id,
+        "stripe_customer_id": stripe_id(subscription.get("customer")),
+        "status": subscription.get("status") or "unknown",
+        "plan_id": stripe_id(plan),
+        "plan_name": _get(plan, "nickname"),
+        "product_id": _get(product, "id"),
+        "product_name": _get(product, "name"),
+        "product_metadata": metadata,
+        "features": enabled_features(metadata),
+        "created": subscription.get("created"),
+        "current_period_start": subscription.get("current_period_start"),
+        "current_period_end": subscription.get("current_period_end"),
+        "trial_start": subscription.get("trial_start"),
+        "trial_end": subscription.get("trial_end"),
+        "cancel_at_period_end": bool(subscription.get("cancel_at_period_end")),
+        "event_created": event_created,
+        "updated_at": datetime.utcnow(),
+    }
+
+
+def upsert_entitlements(session: Session, rows: list[dict[str, Any]]) -> set[str]:
+    """
+    Insert or update entitlement rows built by `entitlement_values` in one statement;
+    the caller commits. Stripe events can arrive out of order, so a row last written
+    from a newer event is left alone. Returns the subscription ids that were written.
+    """
+    if not rows:
+        return set()
+    statement = insert(Entitlement).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[Entitlement.subscription_id],
+        set_={key: statement.excluded[key] for key in rows[0] if key != "subscription_id"},
+        where=(
+            (statement.excluded.event_created.is_(None))
+            | (Entitlement.event_created.is_(None))  # type: ignore[union-attr]
+            | (Entitlement.event_created <= statement.excluded.event_created)  # type: ignore[operator]
+        ),
+    )
+    return set(session.execute(statement.returning(Entitlement.subscription_id)).scalars())
+
+
+def upsert_entitlement(
+    session: Session,
+    user_id: UUID,
+    subscription: Mapping[str, Any],
+    product: Mapping[str, Any] | None,
+    event_created: int | None = None,
+) -> bool:
+    """
+    Insert or update the entitlement row for a Stripe subscription. `product` is the
+    subscription's product (or None when unknown) and `event_created` the creation
+    time of the Stripe event carrying the subscription; the caller commits. Returns
+    False when the stored row came from a newer event and was left alone.
+    """
+    return bool(upsert_entitlements(session, [entitlement_values(user_id, subscription, product, event_created)]))
+
+
+def newest_subscription_statuses(session: Session, user_ids: Iterable[UUID]) -> dict[UUID, str]:
+    """
+    Status of each user's most recently created subscription across all products, read
+    from the entitlement rows; users without any are left out.
+    """
+    statement = (
+        select(Entitlement.user_id, Entitlement.status)
+        .where(col(Entitlement.user_id).in_(list(user_ids)))
+        .distinct(col(Entitlement.user_id))
+        .order_by(col(Entitlement.user_id), col(Entitlement.created).desc().nulls_last())
+    )
+    return {user_id: status for user_id, status in session.exec(statement)}
+
+
+def cancel_customer_entitlements(session: Session, stripe_customer_id: str) -> None:
+    """Mark every entitlement of a deleted Stripe customer canceled; the caller commits."""
+    session.execute(
+        update(Entitlement)
+        .where(Entitlement.stripe_customer_id == stripe_customer_id)  # type: ignore[arg-type]
+        .values(status="canceled", updated_at=datetime.utcnow())
+    )
+
+
+def plan_metadata(entitlements: list[Entitlement]) -> dict[str, str]:
+    """Product metadata of the subscriptions that grant access, merged."""
+    metadata: dict[str, str] = {}
+    for entitlement in entitlements:
+        if entitlement.status in ACCESS_STATUSES:
+            metadata.update(entitlement.product_metadata)
+    return metadata
+
+
+async def get_plan_limits(user_id: UUID) -> PlanLimits:
+    """Rate limits and quota of the user's plan, from the cached entitlements."""
+    return PlanLimits.from_metadata(plan_metadata(await entitlement_cache.get(user_id)))
+
+
+def has_feature(entitlements: list[Entitlement], feature: str, statuses: frozenset[str] = ACCESS_STATUSES) -> bool:
+    return any(e.status in statuses and feature in e.features for e in entitlements)
+
+
+class EntitlementCache:
+    """
+    Per-user entitlement rows with a TTL in front of the entitlement table.
+
+    The webhook invalidates a user's entry in the worker that processed it; other
+    workers pick the change up when their entry expires.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: dict[UUID, tuple[float, list[Entitlement]]] = {}
+        self._flights = SingleFlight("entitlements")
+
+    async def _load(self, user_id: UUID) -> list[Entitlement]:
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            rows = await session.exec(
+                select(Entitlement)
+                .where(Entitlement.user_id == user_id)
+                .order_by(Entitlement.created.desc().nulls_last())  # type: ignore[union-attr]
+            )
+            return list(rows.all())
+
+    async def get(self, user_id: UUID) -> list[Entitlement]:
+        """The user's subscriptions, most recently created first."""
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            cache_requests.inc(cache="entitlements", result="hit")
+            return entry[1]
+        cache_requests.inc(cache="entitlements", result="miss")
+        entitlements = await self._flights.do(str(user_id), lambda: self._load(user_id))
+        self._entries[user_id] = (time.monotonic() + self.ttl, entitlements)
+        return entitlements
+
+    def invalidate(self, user_id: UUID) -> None:
+        self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+entitlement_cache = EntitlementCache(settings.ENTITLEMENT_CACHE_TTL)
@@ -0,0 +1,60 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.api_key_cache import api_key_cache
+from app.core.config import settings
+from app.core.db import engine
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+subscriptions_expired = metrics.counter(
+    "subscriptions_expired_total", "Subscriptions switched off by the expiration sweeper"
+)
+
+# Backed by the partial index ix_user_expiry_date_subscribed, so only subscribed
+# users with an expiry date are ever scanned
+_expire_batch = text(
+    """
+    UPDATE "user" SET has_subscription = false, expiry_date = NULL
+    WHERE id IN (
+        SELECT id FROM "user"
+        WHERE has_subscription AND expiry_date < :now
+        ORDER BY expiry_date
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id
+    """
+)
+
+
+def expire_subscriptions(batch_size: int, max_batches: int | None = None) -> int:
+    """
+    Switch off subscriptions whose expiry date has passed, `batch_size` rows per
+    transaction, until none is left or `max_batches` ran. Returns the rows touched.
+    """
+    now = datetime.utcnow()
+    touched = batches = 0
+    while max_batches is None or batches < max_batches:
+        with Session(engine) as session:
+            expired = session.execute(_expire_batch, {"now": now, "batch_size": batch_size}).scalars().all()
+            session.commit()
+        batches += 1
+        touched += len(expired)
+        for user_id in expired:
+            api_key_cache.invalidate_user(user_id)
+        if len(expired) < batch_size:
+            break
+    subscriptions_expired.inc(touched)
+    if touched:
+        logger.info(f"Expired {touched} subscriptions in {batches} batches")
+    return touched
+
+
+async def sweep_expired_subscriptions() -> None:
+    await run_in_threadpool(expire_subscriptions, settings.SUBSCRIPTION_EXPIRY_BATCH_SIZE)
@@ -0,0 +1,171 @@
+import logging
+import threading
+import time
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+from typing import Any
+
+import stripe
+from sqlmodel import Session, col, select
+from starlette.concurrency import run_in_threadpool
+
+from app.core.cache import cache_requests
+from app.core.db import engine
+from app.models import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+CATALOG_EVENT_TYPES = ("product.created", "product.updated", "price.created")
+
+
+def _product_entry(product: Mapping[str, Any]) -> dict[str, Any]:
+    return {
+        "id": product["id"],
+        "name": product.get("name"),
+        "active": product.get("active", True),
+        "metadata": dict(product.get("metadata") or {}),
+        "updated": product.get("updated") or 0,
+    }
+
+
+def _price_entry(price: Mapping[str, Any]) -> dict[str, Any]:
+    product = price.get("product")
+    recurring = price.get("recurring") or {}
+    return {
+        "id": price["id"],
+        "product": product if product is None or isinstance(product, str) else product.get("id"),
+        "nickname": price.get("nickname"),
+        "active": price.get("active", True),
+        "unit_amount": price.get("unit_amount"),
+        "currency": price.get("currency"),
+        "interval": recurring.get("interval"),
+    }
+
+
+class ProductCatalog:
+    """
+    Stripe products and prices held in process memory, keyed by id.
+
+    The whole catalog is loaded at startup and reloaded every
+    STRIPE_CATALOG_REFRESH_INTERVAL seconds; product and price webhooks update
+    single entries in between. Only the worker that drains a webhook applies it
+    directly, so every worker also replays the processed catalog events from the
+    webhook inbox every STRIPE_CATALOG_SYNC_INTERVAL seconds. Each object remembers
+    the creation time of the newest event applied to it, so replays and events
+    delivered out of order are skipped. Lookups of unknown ids fall back to one
+    Stripe call and remember the result. Methods are synchronous because the
+    callers (webhook handlers) already run off the event loop.
+    """
+
+    # Events are marked processed when claimed, which can be a while before the
+    # drain commits them, so each replay also re-reads this much of the past
+    event_overlap = timedelta(minutes=5)
+
+    def __init__(self) -> None:
+        self._products: dict[str, dict[str, Any]] = {}
+        self._prices: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        # Object id -> `created` of the newest webhook event applied to it
+        self._event_created: dict[str, int] = {}
+        self.loaded_at: float | None = None
+        # Webhooks before startup are covered by the initial load
+        self._events_applied_at = datetime.utcnow()
+
+    def load(self) -> None:
+        products = {
+            p["id"]: _product_entry(p)
+            for p in stripe.Product.list(limit=100).auto_paging_iter()
+        }
+        prices = {
+            p["id"]: _price_entry(p) for p in stripe.Price.list(limit=100).auto_paging_iter()
+        }
+        with self._lock:
+            # Keep products a webhook updated while the listing was running
+            for product_id, current in self._products.items():
+                if current["updated"] > products.get(product_id, current)["updated"]:
+                    products[product_id] = current
+            self._products = products
+            self._prices = prices
+            self.loaded_at = time.time()
+        logger.info(f"Loaded Stripe catalog: {len(products)} products, {len(prices)} prices")
+
+    async def refresh(self) -> None:
+        if not stripe.api_key:
+            logger.debug("Stripe is not configured; skipping catalog refresh")
+            return
+        await run_in_threadpool(self.load)
+
+    def apply_events(self) -> int:
+        """
+        Apply the product and price webhooks processed since the last call, by
+        whichever worker drained them; returns how many were applied, not counting
+        events that were already applied or are older than one that was.
+        """
+        since, self._events_applied_at = self._events_applied_at, datetime.utcnow()
+        with Session(engine) as session:
+            events = session.exec(
+                select(WebhookEvent.type, WebhookEvent.created, WebhookEvent.payload)
+                .where(
+                    col(WebhookEvent.processed_at) >= since - self.event_overlap,
+                    col(WebhookEvent.type).in_(CATALOG_EVENT_TYPES),
+                )
+                .order_by(col(WebhookEvent.created))
+            ).all()
+        return sum(self.apply_event(event_type, payload["data"]["object"], created) for event_type, created, payload in events)
+
+    async def sync(self) -> None:
+        applied = await run_in_threadpool(self.apply_events)
+        logger.debug(f"Applied {applied} catalog webhook events from the inbox")
+
+    def get_product(self, product_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            product = self._products.get(product_id)
+        cache_requests.inc(cache="stripe_catalog", result="hit" if product else "miss")
+        if product is None:
+            try:
+                product = self.set_product(stripe.Product.retrieve(product_id))
+            except stripe.error.InvalidRequestError as e:
+                logger.warning(f"Unknown Stripe product {product_id}: {e}")
+        return product
+
+    def apply_event(self, event_type: str, obj: Mapping[str, Any], created: int) -> bool:
+        """
+        Apply a product or price webhook event created at `created`; returns False, and
+        leaves the catalog alone, when it is not newer than the last event applied to
+        the same object.
+        """
+        with self._lock:
+            if self._event_created.get(obj["id"], -1) >= created:
+                return False
+            self._event_created[obj["id"]] = created
+        if event_type == "price.created":
+            self.set_price(obj)
+        else:
+            self.set_product(obj)
+        return True
+
+    def set_product(self, product: Mapping[str, Any]) -> dict[str, Any]:
+        """Store a product object, e.g. from a webhook; an older copy never replaces a newer one."""
+        entry = _product_entry(product)
+        with self._lock:
+            current = self._products.get(entry["id"])
+            if current is not None and current["updated"] > entry["updated"]:
+                return current
+            self._products[entry["id"]] = entry
+        return entry
+
+    def set_price(self, price: Mapping[str, Any]) -> dict[str, Any]:
+        entry = _price_entry(price)
+        with self._lock:
+            self._prices[entry["id"]] = entry
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._products.clear()
+            self._prices.clear()
+            self._event_created.clear()
+            self.loaded_at = None
+
+
+product_catalog = ProductCatalog()
@@ -0,0 +1,295 @@
+import logging
+import math
+import threading
+import time
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from typing import Protocol
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.core.config import settings
+from app.core.db import async_engine
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+rate_limited_requests = metrics.counter(
+    "rate_limited_requests_total", "Requests rejected by rate limits or quotas", ["limit"]
+)
+
+
+@dataclass(frozen=True)
+class PlanLimits:
+    """Token-bucket rates (requests/second) and bursts per API key and per user, plus a monthly quota."""
+
+    key_rate: float
+    key_burst: int
+    user_rate: float
+    user_burst: int
+    monthly_quota: int | None = None
+
+    # Product metadata keys that override the defaults, e.g. "rate-limit-key-per-second": "5"
+    metadata_fields = {
+        "rate-limit-key-per-second": ("key_rate", float),
+        "rate-limit-key-burst": ("key_burst", int),
+        "rate-limit-user-per-second": ("user_rate", float),
+        "rate-limit-user-burst": ("user_burst", int),
+        "monthly-quota": ("monthly_quota", int),
+    }
+
+    @classmethod
+    def default(cls) -> "PlanLimits":
+        return cls(
+            key_rate=settings.RATE_LIMIT_KEY_PER_SECOND,
+            key_burst=settings.RATE_LIMIT_KEY_BURST,
+            user_rate=settings.RATE_LIMIT_USER_PER_SECOND,
+            user_burst=settings.RATE_LIMIT_USER_BURST,
+            monthly_quota=settings.RATE_LIMIT_MONTHLY_QUOTA,
+        )
+
+    @classmethod
+    def from_metadata(cls, metadata: Mapping[str, str]) -> "PlanLimits":
+        limits = cls.default()
+        for key, (field, cast) in cls.metadata_fields.items():
+            if key not in metadata:
+                continue
+            try:
+                value = cast(metadata[key])
+            except ValueError:
+                value = 0
+            if value <= 0:
+                logger.warning(f"Ignoring invalid plan metadata {key}={metadata[key]!r}")
+                continue
+            limits = replace(limits, **{field: value})
+        return limits
+
+
+@dataclass(frozen=True)
+class RateLimitDecision:
+    allowed: bool
+    limit: str | None = None  # "key", "user" or "quota" when rejected
+    limit_value: int = 0
+    remaining: int = 0
+    retry_after: float = 0.0
+
+    @property
+    def headers(self) -> dict[str, str]:
+        retry_after = str(max(1, math.ceil(self.retry_after)))
+        return {
+            "Retry-After": retry_after,
+            "X-RateLimit-Limit": str(self.limit_value),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": retry_after,
+            "X-RateLimit-Scope": self.limit or "",
+        }
+
+
+def quota_period(now: datetime) -> str:
+    return now.strftime("%Y-%m")
+
+
+def seconds_until_next_period(now: datetime) -> float:
+    year, month = (now.year + 1, 1) if now.month == 12 else (now.year, now.month + 1)
+    return (datetime(year, month, 1, tzinfo=timezone.utc) - now).total_seconds()
+
+
+class RateLimitBackend(Protocol):
+    async def take(self, key: str, rate: float, burst: int, now: float) -> tuple[bool, float]:
+        """Take one token from the bucket; returns (allowed, tokens left after the call)."""
+        ...
+
+    async def give_back(self, key: str, burst: int) -> None:
+        """Return a token taken by `take`, for a call that a later limit rejected."""
+        ...
+
+    async def add_usage(self, key: str, period: str, amount: int, limit: int) -> tuple[bool, int]:
+        """Count `amount` against the period's quota unless it would exceed `limit`; returns (allowed, used)."""
+        ...
+
+    async def prune(self, idle_before: float, period_before: str) -> None:
+        """Drop buckets untouched since `idle_before` and quota counters of earlier periods."""
+        ...
+
+
+class MemoryRateLimitBackend:
+    """Buckets and quota counters in process memory; limits apply per worker."""
+
+    def __init__(self) -> None:
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._usage: dict[tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, rate: float, burst: int, now: float) -> tuple[bool, float]:
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (float(burst), now))
+            tokens = min(float(burst), tokens + (now - updated_at) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            return allowed, tokens
+
+    async def give_back(self, key: str, burst: int) -> None:
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated_at = self._buckets[key]
+                self._buckets[key] = (min(float(burst), tokens + 1), updated_at)
+
+    async def add_usage(self, key: str, period: str, amount: int, limit: int) -> tuple[bool, int]:
+        with self._lock:
+            used = self._usage.get((key, period), 0)
+            if used + amount > limit:
+                return False, used
+            self._usage[(key, period)] = used + amount
+            return True, used + amount
+
+    async def prune(self, idle_before: float, period_before: str) -> None:
+        with self._lock:
+            self._buckets = {k: v for k, v in self._buckets.items() if v[1] >= idle_before}
+            self._usage = {k: v for k, v in self._usage.items() if k[1] >= period_before}
+
+
+class PostgresRateLimitBackend:
+    """
+    Buckets and quota counters in Postgres, so limits hold across all workers.
+    Each check is a single atomic upsert; rows are never read and written separately.
+    """
+
+    _take = text(
+        """
+        INSERT INTO ratelimitbucket (key, tokens, updated_at)
+        VALUES (:key, :burst - 1, :now)
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = LEAST(:burst, ratelimitbucket.tokens + (:now - ratelimitbucket.updated_at) * :rate) - 1,
+            updated_at = :now
+        WHERE LEAST(:burst, ratelimitbucket.tokens + (:now - ratelimitbucket.updated_at) * :rate) >= 1
+        RETURNING tokens
+        """
+    )
+    _peek = text(
+        "SELECT LEAST(:burst, tokens + (:now - updated_at) * :rate) FROM ratelimitbucket WHERE key = :key"
+    )
+    _give_back = text("UPDATE ratelimitbucket SET tokens = LEAST(:burst, tokens + 1) WHERE key = :key")
+    _add_usage = text(
+        """
+        INSERT INTO quotausage (key, period, used)
+        VALUES (:key, :period, :amount)
+        ON CONFLICT (key, period) DO UPDATE SET used = quotausage.used + :amount
+        WHERE quotausage.used + :amount <= :limit
+        RETURNING used
+        """
+    )
+    _used = text("SELECT used FROM quotausage WHERE key = :key AND period = :period")
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+
+    async def take(self, key: str, rate: float, burst: int, now: float) -> tuple[bool, float]:
+        params = {"key": key, "rate": rate, "burst": float(burst), "now": now}
+        async with self.engine.begin() as conn:
+            tokens = (await conn.execute(self._take, params)).scalar()
+            if tokens is not None:
+                return True, tokens
+            return False, (await conn.execute(self._peek, params)).scalar() or 0.0
+
+    async def give_back(self, key: str, burst: int) -> None:
+        async with self.engine.begin() as conn:
+            await conn.execute(self._give_back, {"key": key, "burst": float(burst)})
+
+    async def add_usage(self, key: str, period: str, amount: int, limit: int) -> tuple[bool, int]:
+        if amount > limit:
+            return False, 0
+        params = {"key": key, "period": period, "amount": amount, "limit": limit}
+        async with self.engine.begin() as conn:
+            used = (await conn.execute(self._add_usage, params)).scalar()
+            if used is not None:
+                return True, used
+            return False, (await conn.execute(self._used, params)).scalar() or 0
+
+    async def prune(self, idle_before: float, period_before: str) -> None:
+        async with self.engine.begin() as conn:
+            await conn.execute(text("DELETE FROM ratelimitbucket WHERE updated_at < :t"), {"t": idle_before})
+            await conn.execute(text("DELETE FROM quotausage WHERE period < :p"), {"p": period_before})
+
+
+class RateLimiter:
+    """
+    Checks a call against the API key's bucket, the user's bucket and the user's
+    monthly quota, in that order. A call rejected by one limit consumes none of
+    them: tokens already taken from earlier buckets are given back. `cost` only
+    applies to the quota.
+    """
+
+    def __init__(
+        self,
+        backend: RateLimitBackend,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.backend = backend
+        self.clock = clock
+
+    async def check(self, token_id: UUID, user_id: UUID, limits: PlanLimits, cost: int = 1) -> RateLimitDecision:
+        now = self.clock()
+        taken: list[tuple[str, int]] = []
+        for scope, key, rate, burst in (
+            ("key", f"key:{token_id}", limits.key_rate, limits.key_burst),
+            ("user", f"user:{user_id}", limits.user_rate, limits.user_burst),
+        ):
+            allowed, tokens = await self.backend.take(key, rate, burst, now)
+            if not allowed:
+                await self._give_back(taken)
+                rate_limited_requests.inc(limit=scope)
+                return RateLimitDecision(
+                    allowed=False,
+                    limit=scope,
+                    limit_value=burst,
+                    remaining=0,
+                    retry_after=(1 - tokens) / rate,
+                )
+            taken.append((key, burst))
+
+        if limits.monthly_quota is not None:
+            today = datetime.fromtimestamp(now, timezone.utc)
+            allowed, used = await self.backend.add_usage(
+                f"user:{user_id}", quota_period(today), cost, limits.monthly_quota
+            )
+            if not allowed:
+                await self._give_back(taken)
+                rate_limited_requests.inc(limit="quota")
+                return RateLimitDecision(
+                    allowed=False,
+                    limit="quota",
+                    limit_value=limits.monthly_quota,
+                    remaining=max(0, limits.monthly_quota - used),
+                    retry_after=seconds_until_next_period(today),
+                )
+        return RateLimitDecision(allowed=True)
+
+    async def _give_back(self, taken: list[tuple[str, int]]) -> None:
+        for key, burst in taken:
+            await self.backend.give_back(key, burst)
+
+    async def refund(self, user_id: UUID, limits: PlanLimits, amount: int) -> None:
+        """Give back `amount` of the monthly quota charged for work that was not done."""
+        if limits.monthly_quota is None or amount <= 0:
+            return
+        today = datetime.fromtimestamp(self.clock(), timezone.utc)
+        await self.backend.add_usage(f"user:{user_id}", quota_period(today), -amount, limits.monthly_quota)
+
+    async def prune(self) -> None:
+        # A bucket idle for a day is full again, so dropping it changes nothing
+        now = self.clock()
+        await self.backend.prune(now - 86400, quota_period(datetime.fromtimestamp(now, timezone.utc)))
+
+
+def build_rate_limiter() -> RateLimiter:
+    if settings.RATE_LIMIT_BACKEND == "postgres":
+        return RateLimiter(PostgresRateLimitBackend(async_engine))
+    return RateLimiter(MemoryRateLimitBackend())
+
+
+rate_limiter = build_rate_limiter()
@@ -0,0 +1,49 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[None]]
+
+
+class Scheduler:
+    """
+    Minimal in-process scheduler for periodic background jobs.
+
+    Jobs are registered before startup and run on the event loop of the worker
+    that owns the app lifespan. A failing run is logged and retried on the next
+    tick; it never stops the job.
+    """
+
+    def __init__(self) -> None:
+        self._jobs: dict[str, tuple[float, Job]] = {}
+        self._tasks: list[asyncio.Task[None]] = []
+
+    def add_job(self, name: str, interval: float, func: Job) -> None:
+        self._jobs[name] = (interval, func)
+
+    async def _run(self, name: str, interval: float, func: Job) -> None:
+        while True:
+            try:
+                await func()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Scheduled job '{name}' failed: {e}", exc_info=True)
+            await asyncio.sleep(interval)
+
+    def start(self) -> None:
+        for name, (interval, func) in self._jobs.items():
+            task = asyncio.create_task(self._run(name, interval, func), name=name)
+            self._tasks.append(task)
+        logger.info(f"Started {len(self._tasks)} scheduled jobs")
+
+    async def shutdown(self) -> None:
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+scheduler = Scheduler()
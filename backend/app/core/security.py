@@ -1,4 +1,6 @@
 from datetime import datetime, timedelta, timezone
+import hashlib
+import secrets
 from typing import Any, Optional, Dict
 import jwt
 from passlib.context import CryptContext
@@ -35,22 +37,28 @@ def get_password_hash(password: str) -> str:
     """Generate a password hash"""
     return pwd_context.hash(password)
 
-def generate_api_key(user_id: str) -> str:
-    """Generate a secure API key tied to a user"""
-    to_encode = {
-        "user_id": user_id,
-        "iat": datetime.now(timezone.utc).timestamp(),
-        "exp": (datetime.now(timezone.utc) + timedelta(days=365)).timestamp()
-    }
-    return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
+API_KEY_PREFIX = "tvk"
+API_KEY_ID_BYTES = 8
+LEGACY_API_KEY_PREFIX = "legacy"
 
-def verify_api_key(api_key: str) -> Optional[Dict]:
-    """Verify an API key and return its payload"""
-    try:
-        payload = jwt.decode(api_key, settings.SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except JWTError:
-        return None
+def hash_api_key(api_key: str) -> str:
+    """Hash an API key for storage; keys are high-entropy, so a fast hash is enough"""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+def api_key_lookup_prefix(api_key: str) -> str:
+    """
+    Return the indexed prefix an API key is stored under. New keys carry it in clear
+    (`tvk_<id>_<secret>`); legacy JWT keys are looked up by a prefix derived from their hash.
+    """
+    if api_key.startswith(f"{API_KEY_PREFIX}_"):
+        return api_key[: len(API_KEY_PREFIX) + 1 + 2 * API_KEY_ID_BYTES]
+    return f"{LEGACY_API_KEY_PREFIX}_{hash_api_key(api_key)[:16]}"
+
+def generate_api_key() -> tuple[str, str, str]:
+    """Generate an opaque API key and return (api_key, key_prefix, key_hash)"""
+    key_prefix = f"{API_KEY_PREFIX}_{secrets.token_hex(API_KEY_ID_BYTES)}"
+    api_key = f"{key_prefix}_{secrets.token_urlsafe(32)}"
+    return api_key, key_prefix, hash_api_key(api_key)
 
 def create_session_token(user_id: str) -> str:
     """Create a session token for a user"""
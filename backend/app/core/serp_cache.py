@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable, Mapping
+
+from app.core.cache import CacheEntry, LRUCache, cache_requests, cache_size_bytes
+from app.core.config import settings
+from app.core.serp_parser import SerpResponse
+from app.core.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+SerpLoader = Callable[[], Awaitable[SerpResponse]]
+
+
+def normalize_query(q: str) -> str:
+    # Search engines ignore case and repeated whitespace, so these are the same search
+    return " ".join(q.split()).casefold()
+
+
+class SerpCache:
+    """
+    Parsed SERP responses in process memory, keyed by the normalized (q, engine, region)
+    and the result page.
+
+    An entry is fresh for its engine's TTL. For `stale_ttl` seconds after that it
+    is still served at once, and a background task fetches a replacement
+    (stale-while-revalidate); older entries are refetched inline. Loads of the
+    same key are coalesced, and the total size of the stored JSON is bounded by
+    `max_bytes` with LRU eviction. Pages without organic results (blocks,
+    captchas) are never cached.
+    """
+
+    name = "serp"
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl: Mapping[str, float],
+        default_ttl: float,
+        stale_ttl: float,
+    ):
+        self.memory = LRUCache(max_bytes)
+        self.ttl = dict(ttl)
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self._flights = SingleFlight("serp")
+        self._refreshing: dict[str, asyncio.Task[SerpResponse]] = {}
+
+    @staticmethod
+    def key(q: str, engine: str, region: str, page: int = 1) -> str:
+        return "\x1f".join((engine.lower(), region, str(page), normalize_query(q)))
+
+    def ttl_for(self, engine: str) -> float:
+        return self.ttl.get(engine, self.default_ttl)
+
+    async def _load(self, key: str, load: SerpLoader) -> SerpResponse:
+        serp_response = await load()
+        if serp_response.organic_results:
+            value = serp_response.model_dump_json().encode()
+            self.memory.set(key, CacheEntry(value=value, stored_at=time.time()))
+            cache_size_bytes.set(self.memory.size_bytes, cache=self.name)
+        return serp_response
+
+    def _refreshed(self, key: str, task: asyncio.Task[SerpResponse]) -> None:
+        self._refreshing.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            # The stale entry stays in place and the next request retries
+            logger.warning(f"Background SERP refresh failed: {task.exception()!r}")
+
+    def _revalidate(self, key: str, load: SerpLoader) -> None:
+        if key in self._refreshing:
+            return
+        task = asyncio.ensure_future(self._flights.do(key, lambda: self._load(key, load)))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda t: self._refreshed(key, t))
+
+    async def get(
+        self, q: str, engine: str, region: str, load: SerpLoader, page: int = 1
+    ) -> tuple[SerpResponse, str]:
+        """
+        Return the response for a search and how it was served: HIT, STALE (served
+        from cache while a refresh runs in the background) or MISS (loaded inline).
+        """
+        key = self.key(q, engine, region, page)
+        entry = self.memory.get(key)
+        if entry is not None:
+            age, ttl = entry.age(), self.ttl_for(engine)
+            if age <= ttl + self.stale_ttl:
+                status = "HIT" if age <= ttl else "STALE"
+                cache_requests.inc(cache=self.name, result=status.lower())
+                if status == "STALE":
+                    self._revalidate(key, load)
+                cached = SerpResponse.model_validate_json(entry.value)
+                return cached.model_copy(update={"search_query": q}), status
+        cache_requests.inc(cache=self.name, result="miss")
+        # Concurrent misses share one load, which carries the spelling of whoever started it
+        loaded = await self._flights.do(key, lambda: self._load(key, load))
+        return loaded.model_copy(update={"search_query": q}), "MISS"
+
+    def purge(self, q: str | None = None, engine: str | None = None, region: str | None = None) -> int:
+        """
+        Drop the entries (all pages) matching every given field, or all entries without
+        any; returns how many.
+        """
+        wanted = (engine.lower() if engine else None, region, None, normalize_query(q) if q else None)
+        purged = 0
+        for key in self.memory.keys():
+            if all(want is None or want == part for want, part in zip(wanted, key.split("\x1f", 3))):
+                self.memory.delete(key)
+                purged += 1
+        cache_size_bytes.set(self.memory.size_bytes, cache=self.name)
+        logger.info(f"Purged {purged} SERP cache entries")
+        return purged
+
+
+serp_cache = SerpCache(
+    max_bytes=settings.SERP_CACHE_MAX_BYTES,
+    ttl=settings.SERP_CACHE_TTL,
+    default_ttl=settings.SERP_CACHE_DEFAULT_TTL,
+    stale_ttl=settings.SERP_CACHE_STALE_TTL,
+)
@@ -0,0 +1,214 @@
+"""
+SERP HTML parsers, one per search engine, in two interchangeable backends:
+
+- "bs4": BeautifulSoup trees queried with CSS selectors (the original parsers)
+- "lxml": the same selectors as XPath over a plain lxml tree, several times faster
+
+Both backends return identical SerpResult lists; the golden corpus in
+app/tests/fixtures/serp holds them to that. This module only depends on the
+parsing libraries so it stays cheap to import in parser worker processes.
+"""
+
+import time
+from collections.abc import Callable
+from typing import List, Literal
+from urllib.parse import parse_qs, unquote
+
+import lxml.html
+from bs4 import BeautifulSoup
+from lxml import etree
+from pydantic import BaseModel
+
+
+class SerpResult(BaseModel): position: int; title: str; link: str; snippet: str
+class SerpResponse(BaseModel): search_engine: str; search_query: str; region_used: str; organic_results: List[SerpResult]
+
+SerpParser = Callable[[str], List[SerpResult]]
+ParserBackend = Literal["bs4", "lxml"]
+
+
+def decode_duckduckgo_link(raw_href: str) -> str:
+    # Result links go through a redirect that carries the target in `uddg`
+    if raw_href and "uddg=" in raw_href:
+        try:
+            parsed_url = parse_qs(raw_href.split("?", 1)[1])
+            return unquote(parsed_url.get("uddg", [""])[0])
+        except (IndexError, KeyError):
+            return raw_href
+    return raw_href
+
+
+# BeautifulSoup backend
+
+def parse_google_serp(html: str) -> List[SerpResult]:
+    soup = BeautifulSoup(html, "lxml")
+    results = []
+    for i, el in enumerate(soup.select("div.g"), start=1):
+        title_tag = el.select_one("h3")
+        link_tag = el.select_one("a")
+        snippet_tag = el.select_one("div[data-sncf='1']") or el.select_one(".VwiC3b")
+        if title_tag and link_tag and link_tag.get("href"):
+            results.append(SerpResult(position=i, title=title_tag.text, link=link_tag.get("href"), snippet=snippet_tag.text if snippet_tag else ""))
+    return results
+
+def parse_bing_serp(html: str) -> List[SerpResult]:
+    soup = BeautifulSoup(html, "lxml")
+    results = []
+    for i, el in enumerate(soup.select("li.b_algo"), start=1):
+        title_tag = el.select_one("h2 a")
+        snippet_tag = el.select_one(".b_caption p")
+        if title_tag and title_tag.get("href"):
+            results.append(SerpResult(position=i, title=title_tag.text, link=title_tag.get("href"), snippet=snippet_tag.text if snippet_tag else ""))
+    return results
+
+def parse_duckduckgo_serp(html: str) -> List[SerpResult]:
+    soup = BeautifulSoup(html, "lxml")
+    results = []
+    for i, el in enumerate(soup.select(".result"), start=1):
+        title_tag = el.select_one(".result__a")
+        snippet_tag = el.select_one(".result__snippet")
+        if title_tag and title_tag.get("href"):
+            link = decode_duckduckgo_link(title_tag.get("href"))
+            results.append(SerpResult(position=i, title=title_tag.text, link=link, snippet=snippet_tag.text.strip() if snippet_tag else ""))
+    return results
+
+
+# lxml backend. The XPath mirrors the CSS selectors above, including the quirk that
+# a CSS descendant combinator also matches ancestors outside the element it is called on.
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+_GOOGLE_RESULTS = etree.XPath(f"//div[{_has_class('g')}]")
+_GOOGLE_TITLE = etree.XPath("(.//h3)[1]")
+_GOOGLE_LINK = etree.XPath("(.//a)[1]")
+_GOOGLE_SNIPPET = etree.XPath("(.//div[@data-sncf='1'])[1]")
+_GOOGLE_SNIPPET_FALLBACK = etree.XPath(f"(.//*[{_has_class('VwiC3b')}])[1]")
+_BING_RESULTS = etree.XPath(f"//li[{_has_class('b_algo')}]")
+_BING_TITLE = etree.XPath("(.//a[ancestor::h2])[1]")
+_BING_SNIPPET = etree.XPath(f"(.//p[ancestor::*[{_has_class('b_caption')}]])[1]")
+_DUCKDUCKGO_RESULTS = etree.XPath(f"//*[{_has_class('result')}]")
+_DUCKDUCKGO_TITLE = etree.XPath(f"(.//*[{_has_class('result__a')}])[1]")
+_DUCKDUCKGO_SNIPPET = etree.XPath(f"(.//*[{_has_class('result__snippet')}])[1]")
+
+
+def _parse_tree(html: str) -> etree._Element | None:
+    if not html.strip():
+        return None
+    try:
+        return lxml.html.document_fromstring(html)
+    except ValueError:
+        # Unicode strings with an XML encoding declaration must be parsed as bytes
+        return lxml.html.document_fromstring(html.encode("utf-8"))
+    except etree.ParserError:
+        return None
+
+
+def _first(xpath: etree.XPath, el: etree._Element) -> etree._Element | None:
+    found = xpath(el)
+    return found[0] if found else None
+
+
+# BeautifulSoup leaves strings inside these tags out of .text, and keeps whitespace
+# inside the preserving ones; everywhere else a whitespace-only string becomes
+# a single newline or space
+_HIDDEN_STRING_TAGS = frozenset({"script", "style", "template", "rt", "rp"})
+_PRESERVE_WHITESPACE_TAGS = frozenset({"pre", "textarea"})
+_ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+
+def _bs4_string(value: str, preserve: bool) -> str:
+    if preserve or value.strip(_ASCII_SPACES):
+        return value
+    return "\n" if "\n" in value else " "
+
+
+def _collect_text(el: etree._Element, parts: list[str], hidden: bool, preserve: bool) -> None:
+    hidden = hidden or el.tag in _HIDDEN_STRING_TAGS
+    preserve = preserve or el.tag in _PRESERVE_WHITESPACE_TAGS
+    if el.text and not hidden:
+        parts.append(_bs4_string(el.text, preserve))
+    for child in el:
+        if isinstance(child.tag, str):
+            _collect_text(child, parts, hidden, preserve)
+        if child.tail and not hidden:
+            parts.append(_bs4_string(child.tail, preserve))
+
+
+def _text(el: etree._Element) -> str:
+    """The element's text exactly as BeautifulSoup's Tag.text would return it."""
+    ancestors = {a.tag for a in el.iterancestors()}
+    parts: list[str] = []
+    _collect_text(
+        el,
+        parts,
+        hidden=not ancestors.isdisjoint(_HIDDEN_STRING_TAGS),
+        preserve=not ancestors.isdisjoint(_PRESERVE_WHITESPACE_TAGS),
+    )
+    return "".join(parts)
+
+
+def parse_google_serp_lxml(html: str) -> List[SerpResult]:
+    tree = _parse_tree(html)
+    if tree is None:
+        return []
+    results = []
+    for i, el in enumerate(_GOOGLE_RESULTS(tree), start=1):
+        title_tag = _first(_GOOGLE_TITLE, el)
+        link_tag = _first(_GOOGLE_LINK, el)
+        snippet_tag = _first(_GOOGLE_SNIPPET, el)
+        if snippet_tag is None:
+            snippet_tag = _first(_GOOGLE_SNIPPET_FALLBACK, el)
+        if title_tag is not None and link_tag is not None and link_tag.get("href"):
+            results.append(SerpResult(position=i, title=_text(title_tag), link=link_tag.get("href"), snippet=_text(snippet_tag) if snippet_tag is not None else ""))
+    return results
+
+def parse_bing_serp_lxml(html: str) -> List[SerpResult]:
+    tree = _parse_tree(html)
+    if tree is None:
+        return []
+    results = []
+    for i, el in enumerate(_BING_RESULTS(tree), start=1):
+        title_tag = _first(_BING_TITLE, el)
+        snippet_tag = _first(_BING_SNIPPET, el)
+        if title_tag is not None and title_tag.get("href"):
+            results.append(SerpResult(position=i, title=_text(title_tag), link=title_tag.get("href"), snippet=_text(snippet_tag) if snippet_tag is not None else ""))
+    return results
+
+def parse_duckduckgo_serp_lxml(html: str) -> List[SerpResult]:
+    tree = _parse_tree(html)
+    if tree is None:
+        return []
+    results = []
+    for i, el in enumerate(_DUCKDUCKGO_RESULTS(tree), start=1):
+        title_tag = _first(_DUCKDUCKGO_TITLE, el)
+        snippet_tag = _first(_DUCKDUCKGO_SNIPPET, el)
+        if title_tag is not None and title_tag.get("href"):
+            link = decode_duckduckgo_link(title_tag.get("href"))
+            results.append(SerpResult(position=i, title=_text(title_tag), link=link, snippet=_text(snippet_tag).strip() if snippet_tag is not None else ""))
+    return results
+
+
+SERP_PARSERS: dict[str, dict[str, SerpParser]] = {
+    "bs4": {
+        "google": parse_google_serp,
+        "bing": parse_bing_serp,
+        "duckduckgo": parse_duckduckgo_serp,
+    },
+    "lxml": {
+        "google": parse_google_serp_lxml,
+        "bing": parse_bing_serp_lxml,
+        "duckduckgo": parse_duckduckgo_serp_lxml,
+    },
+}
+
+
+def parse_serp(engine: str, html: str, backend: ParserBackend = "lxml") -> List[SerpResult]:
+    return SERP_PARSERS[backend][engine](html)
+
+
+def timed_parse_serp(engine: str, html: str, backend: ParserBackend = "lxml") -> tuple[List[SerpResult], float]:
+    """parse_serp plus the seconds it took; this is what parser worker processes run."""
+    start = time.perf_counter()
+    results = parse_serp(engine, html, backend)
+    return results, time.perf_counter() - start
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.serp_parser import ParserBackend, SerpResult, timed_parse_serp
+
+logger = logging.getLogger(__name__)
+
+serp_parses = metrics.counter(
+    "serp_parses_total", "SERP pages parsed by engine and where (inline/pool)", ["engine", "mode"]
+)
+serp_parse_seconds = metrics.counter(
+    "serp_parse_seconds_total", "CPU time spent parsing SERP pages", ["engine", "mode"]
+)
+serp_parse_wait_seconds = metrics.counter(
+    "serp_parse_wait_seconds_total",
+    "Time SERP pages spent queued for and in transit to the parser pool",
+    ["engine"],
+)
+serp_parse_queue_depth = metrics.gauge(
+    "serp_parse_queue_depth", "SERP pages submitted to the parser pool and not parsed yet"
+)
+
+
+def available_cores() -> int:
+    # Respects CPU affinity (taskset, cgroup cpusets) where the platform exposes it
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class SerpParserPool:
+    """
+    Process pool that parses SERP pages off the event loop.
+
+    Parsing is pure CPU work and holds the GIL, so running it in the request
+    handler (or a thread) stalls every other request on the worker. Pages of at
+    least `inline_max_chars` go to a pool of `workers` processes, by default the
+    available cores split evenly between the `app_workers`; smaller ones
+    (error pages, empty result sets) are cheaper to parse inline than to ship to
+    another process. Without an open pool, e.g. in tests, everything is parsed
+    inline. The pool is opened and closed in the app lifespan.
+    """
+
+    def __init__(self, backend: ParserBackend, workers: int | None, inline_max_chars: int, app_workers: int = 1):
+        self.backend = backend
+        # Every app worker opens its own pool, so together they use each core once
+        self.workers = max(1, available_cores() // max(1, app_workers)) if workers is None else workers
+        self.inline_max_chars = inline_max_chars
+        self._executor: ProcessPoolExecutor | None = None
+
+    def _build_executor(self) -> ProcessPoolExecutor:
+        # Forking a process that runs an event loop and holds open sockets is unsafe
+        return ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def open(self) -> None:
+        if self.workers <= 0:
+            logger.info("SERP parser pool disabled; parsing inline")
+            return
+        self._executor = self._build_executor()
+        logger.info(f"Opened SERP parser pool with {self.workers} processes")
+
+    def _parse_inline(self, engine: str, html: str) -> list[SerpResult]:
+        results, elapsed = timed_parse_serp(engine, html, self.backend)
+        serp_parses.inc(engine=engine, mode="inline")
+        serp_parse_seconds.inc(elapsed, engine=engine, mode="inline")
+        return results
+
+    async def parse(self, engine: str, html: str) -> list[SerpResult]:
+        executor = self._executor
+        if executor is None or len(html) < self.inline_max_chars:
+            return self._parse_inline(engine, html)
+
+        serp_parse_queue_depth.inc()
+        start = time.perf_counter()
+        try:
+            results, elapsed = await asyncio.get_running_loop().run_in_executor(
+                executor, timed_parse_serp, engine, html, self.backend
+            )
+        except BrokenProcessPool:
+            # A worker died (OOM kill, segfault); replace the pool and serve this page inline
+            logger.error("SERP parser pool is broken; restarting it")
+            if self._executor is executor:
+                self._executor = self._build_executor()
+                executor.shutdown(wait=False, cancel_futures=True)
+            return self._parse_inline(engine, html)
+        finally:
+            serp_parse_queue_depth.dec()
+        serp_parses.inc(engine=engine, mode="pool")
+        serp_parse_seconds.inc(elapsed, engine=engine, mode="pool")
+        serp_parse_wait_seconds.inc(max(time.perf_counter() - start - elapsed, 0.0), engine=engine)
+        return results
+
+    async def aclose(self) -> None:
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            await run_in_threadpool(executor.shutdown, wait=True, cancel_futures=True)
+            logger.info("Closed SERP parser pool")
+
+
+serp_parser_pool = SerpParserPool(
+    backend=settings.SERP_PARSER_BACKEND,
+    workers=settings.SERP_PARSE_WORKERS,
+    inline_max_chars=settings.SERP_PARSE_INLINE_MAX_CHARS,
+    app_workers=settings.WEB_CONCURRENCY,
+)
@@ -0,0 +1,52 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Any, TypeVar
+
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+deduplicated_requests = metrics.counter(
+    "singleflight_deduplicated_total",
+    "Calls that joined an identical in-flight call instead of running their own",
+    ["group"],
+)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the call and
+    every duplicate that arrives while it is in flight awaits the same result
+    (or exception). Nothing is cached once the call has finished.
+
+    The shared call runs as its own task, so one caller being cancelled (e.g. a client
+    disconnect) does not cancel it for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight: dict[str, asyncio.Task[Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    def _forget(self, key: str, task: asyncio.Task[Any]) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Mark the exception as retrieved when every caller went away before it was raised
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            deduplicated_requests.inc(group=self.name)
+            logger.debug(f"Joined in-flight {self.name} call for key {key}")
+        return await asyncio.shield(task)
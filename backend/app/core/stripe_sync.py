@@ -0,0 +1,489 @@
+import logging
+import time
+from collections.abc import Iterable, Iterator, Mapping
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Any
+from uuid import UUID
+
+import stripe
+from sqlalchemy import column, update, values
+from sqlmodel import Session, col, select
+from starlette.concurrency import run_in_threadpool
+
+from app.core.api_key_cache import api_key_cache
+from app.core.config import settings
+from app.core.db import advisory_lock, engine
+from app.core.entitlements import (
+    entitlement_cache,
+    entitlement_values,
+    newest_subscription_statuses,
+    stripe_id,
+    subscription_flags,
+    upsert_entitlements,
+)
+from app.core.metrics import metrics
+from app.core.product_catalog import product_catalog
+from app.models import Entitlement, StripeReconciliationRun, SubscriptionResyncJob, User
+
+logger = logging.getLogger(__name__)
+
+stripe_sync_changes = metrics.counter(
+    "stripe_sync_changes_total", "Local rows corrected from Stripe by sync job and table", ["job", "table"]
+)
+
+# Entitlement columns that reflect Stripe state, compared to decide whether a row changed
+SYNCED_ENTITLEMENT_FIELDS = (
+    "user_id",
+    "stripe_customer_id",
+    "status",
+    "plan_id",
+    "plan_name",
+    "product_id",
+    "product_name",
+    "product_metadata",
+    "features",
+    "current_period_start",
+    "current_period_end",
+    "trial_start",
+    "trial_end",
+    "cancel_at_period_end",
+)
+
+
+def chunked(items: Iterable[Any], size: int) -> Iterator[list[Any]]:
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def synced_flags(status: str, expiry_date: datetime | None, now: datetime) -> dict[str, bool] | None:
+    """
+    The user flags for the status of a user's newest Stripe subscription, or None when
+    they would revoke access that a local trial or admin grant still gives until
+    `expiry_date`; the expiry sweeper ends those.
+    """
+    flags = subscription_flags(status)
+    if not flags["has_subscription"] and expiry_date is not None and expiry_date > now:
+        return None
+    return flags
+
+
+def apply_subscriptions(
+    session: Session,
+    subscriptions: list[Mapping[str, Any]],
+    job: str,
+    update_flags: bool = True,
+) -> set[UUID]:
+    """
+    Diff a page of Stripe subscriptions against the local entitlement rows (and, with
+    `update_flags`, the users' subscription flags) and write only what differs, as one
+    bulk upsert and one batched update. Products come from the catalog. A user's flags
+    follow their newest subscription across all products, not whichever of their
+    subscriptions the page happens to hold, per `synced_flags`. Returns the ids of the
+    users that changed; the caller commits.
+    """
+    customer_ids = {stripe_id(sub.get("customer")) for sub in subscriptions}
+    users = {
+        user.stripe_customer_id: user
+        for user in session.exec(select(User).where(col(User.stripe_customer_id).in_(customer_ids)))
+    }
+    existing = {
+        e.subscription_id: e
+        for e in session.exec(
+            select(Entitlement).where(col(Entitlement.subscription_id).in_([sub["id"] for sub in subscriptions]))
+        )
+    }
+    # Fetched just now, so the state is newer than any event created before this page
+    observed_at = int(time.time())
+    rows: list[dict[str, Any]] = []
+    flag_updates: dict[UUID, dict[str, Any]] = {}
+    for sub in subscriptions:
+        user = users.get(stripe_id(sub.get("customer")))
+        if user is None:
+            continue
+        product_id = stripe_id((sub.get("plan") or {}).get("product"))
+        product = product_catalog.get_product(product_id) if product_id else None
+        values = entitlement_values(user.id, sub, product, observed_at)
+        current = existing.get(sub["id"])
+        if current is None or any(getattr(current, f) != values[f] for f in SYNCED_ENTITLEMENT_FIELDS):
+            rows.append(values)
+
+    written = upsert_entitlements(session, rows)
+    if update_flags:
+        page_users = {user.id: user for user in users.values()}
+        now = datetime.utcnow()
+        for user_id, status in newest_subscription_statuses(session, page_users).items():
+            user = page_users[user_id]
+            flags = synced_flags(status, user.expiry_date, now)
+            if flags is not None and any(getattr(user, f) != v for f, v in flags.items()):
+                flag_updates[user_id] = {"id": user_id, **flags}
+    if flag_updates:
+        # ORM bulk update by primary key: one executemany UPDATE
+        session.execute(update(User), list(flag_updates.values()))
+    stripe_sync_changes.inc(len(written), job=job, table="entitlement")
+    stripe_sync_changes.inc(len(flag_updates), job=job, table="user")
+    return {row["user_id"] for row in rows if row["subscription_id"] in written} | set(flag_updates)
+
+
+def needs_entitlement_backfill(session: Session) -> bool:
+    """True while no entitlement row exists yet although users are linked to Stripe customers."""
+    if session.exec(select(Entitlement.subscription_id).limit(1)).first() is not None:
+        return False
+    return session.exec(select(User.id).where(col(User.stripe_customer_id).is_not(None)).limit(1)).first() is not None
+
+
+def backfill_entitlements(page_size: int = 100) -> int:
+    """
+    Write the entitlement rows of every Stripe subscription, for data that predates the
+    entitlement table; user flags are left to the webhook and the reconciler. Pages are
+    committed as they are applied, so an interrupted run can simply be started again.
+    Returns the number of users whose entitlements were written.
+    """
+    product_catalog.load()
+    changed_users: set[UUID] = set()
+    subscriptions = stripe.Subscription.list(status="all", limit=page_size).auto_paging_iter()
+    for page in chunked(subscriptions, page_size):
+        with Session(engine) as session:
+            changed = apply_subscriptions(session, page, job="backfill", update_flags=False)
+            session.commit()
+        invalidate_users(changed)
+        changed_users |= changed
+        logger.info(f"Entitlement backfill: {len(changed_users)} users written so far")
+    return len(changed_users)
+
+
+def invalidate_users(user_ids: Iterable[UUID]) -> None:
+    for user_id in user_ids:
+        api_key_cache.invalidate_user(user_id)
+        entitlement_cache.invalidate(user_id)
+
+
+class SubscriptionResync:
+    """
+    Re-applies every subscription of a product after the product changes, e.g. when
+    its metadata (features, rate limits) is edited in Stripe.
+
+    Jobs live in the subscriptionresyncjob table. A worker leases a job, walks the
+    product's prices and their subscriptions with Stripe auto-pagination, and after
+    each page commits the changes together with the job's cursor and counters, so a
+    job interrupted by a restart resumes after the last applied page.
+    """
+
+    def __init__(self, page_size: int = 100, lease: float = 300.0):
+        self.page_size = page_size
+        self.lease = timedelta(seconds=lease)
+
+    def enqueue(self, session: Session, product_id: str) -> None:
+        """
+        Queue a resync of `product_id`; the caller commits. An unfinished job for the
+        product is superseded, since pages it already applied used the old product.
+        """
+        session.execute(
+            update(SubscriptionResyncJob)
+            .where(
+                col(SubscriptionResyncJob.product_id) == product_id,
+                col(SubscriptionResyncJob.status).in_(["pending", "running"]),
+            )
+            .values(status="superseded", finished_at=datetime.utcnow())
+        )
+        session.add(SubscriptionResyncJob(product_id=product_id))
+
+    def _claim(self) -> SubscriptionResyncJob | None:
+        with Session(engine, expire_on_commit=False) as session:
+            job = session.exec(
+                select(SubscriptionResyncJob)
+                .where(
+                    col(SubscriptionResyncJob.status).in_(["pending", "running"]),
+                    (col(SubscriptionResyncJob.locked_until).is_(None))
+                    | (col(SubscriptionResyncJob.locked_until) < datetime.utcnow()),
+                )
+                .order_by(col(SubscriptionResyncJob.created_at))
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            ).first()
+            if job is None:
+                return None
+            job.status = "running"
+            job.locked_until = datetime.utcnow() + self.lease
+            session.add(job)
+            session.commit()
+            return job
+
+    def _checkpoint(self, session: Session, job: SubscriptionResyncJob, **values: Any) -> bool:
+        """Save progress and renew the lease; False when the job was superseded meanwhile."""
+        result = session.execute(
+            update(SubscriptionResyncJob)
+            .where(
+                col(SubscriptionResyncJob.id) == job.id,
+                col(SubscriptionResyncJob.status) == "running",
+            )
+            .values({"updated_at": datetime.utcnow(), "locked_until": datetime.utcnow() + self.lease, **values})
+        )
+        return result.rowcount == 1
+
+    def _prices(self, product_id: str) -> list[str]:
+        # Sorted so the cursor stays meaningful across runs
+        return sorted(p["id"] for p in stripe.Price.list(product=product_id, limit=100).auto_paging_iter())
+
+    def run_job(self, job: SubscriptionResyncJob) -> None:
+        # Fetched rather than read from the catalog: this worker may not have seen the webhook
+        product_catalog.set_product(stripe.Product.retrieve(job.product_id))
+        prices = self._prices(job.product_id)
+        if job.cursor_price in prices:
+            prices = prices[prices.index(job.cursor_price) :]
+        starting_after = job.cursor_subscription
+        processed, changed = job.processed, job.changed
+
+        for price_id in prices:
+            params: dict[str, Any] = {"price": price_id, "status": "all", "limit": self.page_size}
+            if starting_after and price_id == job.cursor_price:
+                params["starting_after"] = starting_after
+            pages = chunked(stripe.Subscription.list(**params).auto_paging_iter(), self.page_size)
+            for page in pages:
+                with Session(engine) as session:
+                    changed_users = apply_subscriptions(session, page, job="product_resync")
+                    processed += len(page)
+                    changed += len(changed_users)
+                    if not self._checkpoint(
+                        session,
+                        job,
+                        cursor_price=price_id,
+                        cursor_subscription=page[-1]["id"],
+                        processed=processed,
+                        changed=changed,
+                    ):
+                        session.rollback()
+                        logger.info(f"Resync job {job.id} for {job.product_id} was superseded")
+                        return
+                    session.commit()
+                invalidate_users(changed_users)
+                logger.info(
+                    f"Resync job {job.id} for {job.product_id}: {processed} subscriptions checked, "
+                    f"{changed} users updated (price {price_id})"
+                )
+
+        with Session(engine) as session:
+            self._checkpoint(session, job, status="done", locked_until=None, finished_at=datetime.utcnow())
+            session.commit()
+        logger.info(f"Resync job {job.id} for {job.product_id} finished: {processed} checked, {changed} updated")
+
+    def process_pending(self) -> int:
+        """Run due jobs until none is left; returns how many were run."""
+        ran = 0
+        while (job := self._claim()) is not None:
+            ran += 1
+            try:
+                self.run_job(job)
+            except stripe.error.InvalidRequestError as e:
+                # E.g. the product was deleted; retrying will not help
+                logger.error(f"Resync job {job.id} for {job.product_id} failed: {e}")
+                with Session(engine) as session:
+                    self._checkpoint(
+                        session, job, status="failed", error=str(e)[:1000], locked_until=None, finished_at=datetime.utcnow()
+                    )
+                    session.commit()
+            except Exception as e:
+                # The lease expires and another run resumes from the last checkpoint
+                logger.error(f"Resync job {job.id} for {job.product_id} failed: {e}", exc_info=True)
+                with Session(engine) as session:
+                    self._checkpoint(session, job, error=str(e)[:1000])
+                    session.commit()
+                break
+        return ran
+
+    async def run(self) -> None:
+        if not stripe.api_key:
+            return
+        await run_in_threadpool(self.process_pending)
+
+
+subscription_resync = SubscriptionResync()
+
+
+FLAG_FIELDS = ("has_subscription", "is_trial", "is_deactivated")
+
+
+@dataclass
+class DriftReport:
+    """What a reconciliation run scanned and which local values it corrected."""
+
+    customers: int = 0
+    subscriptions: int = 0
+    users: int = 0
+    linked_customers: int = 0
+    entitlement_users: int = 0
+    flags: dict[str, int] = field(default_factory=lambda: dict.fromkeys(FLAG_FIELDS, 0))
+    examples: list[str] = field(default_factory=list)
+    seconds: float = 0.0
+
+    def format(self) -> str:
+        lines = [
+            f"Stripe reconciliation: scanned {self.customers} customers, {self.subscriptions} subscriptions "
+            f"and {self.users} users in {self.seconds:.1f}s",
+            f"  stripe_customer_id linked: {self.linked_customers}",
+            *(f"  {name} corrected: {count}" for name, count in self.flags.items()),
+            f"  users with entitlements corrected: {self.entitlement_users}",
+        ]
+        return "\n".join(lines + [f"    {example}" for example in self.examples])
+
+
+class StripeReconciler:
+    """
+    Periodically corrects local subscription state that drifted from Stripe, e.g.
+    after a missed webhook.
+
+    A run streams every Stripe customer and subscription page by page, keeping only
+    a few fields per customer in memory, and diffs them against the user table:
+    users without a stripe_customer_id are linked by email, the flags of users with
+    Stripe subscriptions follow their newest one, and entitlement rows are corrected
+    page by page. Users without subscriptions, and access still granted locally
+    until an expiry_date, are left alone.
+    Corrections are applied as set-based UPDATE ... FROM (VALUES ...) statements in
+    batches; a row changed by a webhook since it was read is left alone.
+
+    Every worker ticks the job, but a run happens only in the worker that gets the
+    advisory lock, and only once `interval` has passed since the last run started.
+    """
+
+    lock_name = "stripe-reconciliation"
+
+    def __init__(self, interval: float, page_size: int = 100, batch_size: int = 1000, max_examples: int = 20):
+        self.interval = timedelta(seconds=interval)
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.max_examples = max_examples
+
+    def _update_users(self, session: Session, rows: list[dict[str, Any]], fields: tuple[str, ...]) -> int:
+        """
+        Set `fields` from each row where the user still has the row's `old_<field>`
+        values; returns the number of users updated.
+        """
+        table = User.__table__  # type: ignore[attr-defined]
+        names = ("id", *fields, *(f"old_{f}" for f in fields))
+        types = (table.c.id.type, *(table.c[f].type for f in fields), *(table.c[f].type for f in fields))
+        updated = 0
+        for chunk in chunked(rows, self.batch_size):
+            v = values(*(column(n, t) for n, t in zip(names, types)), name="v").data(
+                [tuple(row[n] for n in names) for row in chunk]
+            )
+            statement = (
+                update(table)
+                .where(table.c.id == v.c.id, *(table.c[f].is_not_distinct_from(v.c[f"old_{f}"]) for f in fields))
+                .values({f: v.c[f] for f in fields})
+            )
+            updated += session.execute(statement).rowcount
+        return updated
+
+    def _example(self, report: DriftReport, line: str) -> None:
+        if len(report.examples) < self.max_examples:
+            report.examples.append(line)
+
+    def reconcile(self) -> DriftReport:
+        started = time.monotonic()
+        report = DriftReport()
+        product_catalog.load()
+
+        # Newest Stripe customer per email
+        customers: dict[str, tuple[int, str]] = {}
+        for customer in stripe.Customer.list(limit=self.page_size).auto_paging_iter():
+            report.customers += 1
+            email = (customer.get("email") or "").lower()
+            created = customer.get("created") or 0
+            if email and (email not in customers or created > customers[email][0]):
+                customers[email] = (created, customer["id"])
+
+        with Session(engine) as session:
+            users = session.exec(
+                select(User.id, User.email, User.stripe_customer_id, User.expiry_date, *(getattr(User, f) for f in FLAG_FIELDS))
+            ).all()
+        report.users = len(users)
+
+        customer_of: dict[UUID, str] = {}
+        links: list[dict[str, Any]] = []
+        for user in users:
+            if user.stripe_customer_id:
+                customer_of[user.id] = user.stripe_customer_id
+            elif (match := customers.get(user.email.lower())) is not None:
+                customer_of[user.id] = match[1]
+                links.append({"id": user.id, "stripe_customer_id": match[1], "old_stripe_customer_id": None})
+                self._example(report, f"{user.email}: linked to {match[1]}")
+        with Session(engine) as session:
+            report.linked_customers = self._update_users(session, links, ("stripe_customer_id",))
+            session.commit()
+        customers.clear()
+
+        # Newest subscription status per customer; entitlements are corrected page by page
+        newest: dict[str, tuple[int, str]] = {}
+        changed_users: set[UUID] = set()
+        subscriptions = stripe.Subscription.list(status="all", limit=self.page_size).auto_paging_iter()
+        for page in chunked(subscriptions, self.page_size):
+            report.subscriptions += len(page)
+            for sub in page:
+                customer_id, created = stripe_id(sub.get("customer")), sub.get("created") or 0
+                if customer_id and (customer_id not in newest or created > newest[customer_id][0]):
+                    newest[customer_id] = (created, sub.get("status") or "unknown")
+            with Session(engine) as session:
+                changed = apply_subscriptions(session, page, job="reconciliation", update_flags=False)
+                session.commit()
+            report.entitlement_users += len(changed - changed_users)
+            changed_users |= changed
+
+        flag_updates: list[dict[str, Any]] = []
+        now = datetime.utcnow()
+        for user in users:
+            customer_id = customer_of.get(user.id)
+            # Without a Stripe subscription the flags are local state (trials, admin grants)
+            if customer_id is None or customer_id not in newest:
+                continue
+            current = {f: getattr(user, f) for f in FLAG_FIELDS}
+            desired = synced_flags(newest[customer_id][1], user.expiry_date, now)
+            if desired is None or desired == current:
+                continue
+            flag_updates.append({"id": user.id, **desired, **{f"old_{f}": v for f, v in current.items()}})
+            for name in FLAG_FIELDS:
+                if desired[name] != current[name]:
+                    report.flags[name] += 1
+                    self._example(report, f"{user.email}: {name} {current[name]} -> {desired[name]}")
+        with Session(engine) as session:
+            updated = self._update_users(session, flag_updates, FLAG_FIELDS)
+            session.commit()
+        if updated < len(flag_updates):
+            logger.info(f"{len(flag_updates) - updated} users changed during reconciliation and were left alone")
+        stripe_sync_changes.inc(updated + report.linked_customers, job="reconciliation", table="user")
+
+        invalidate_users(changed_users | {row["id"] for row in flag_updates} | {row["id"] for row in links})
+        report.seconds = time.monotonic() - started
+        return report
+
+    def run_once(self, force: bool = False) -> DriftReport | None:
+        """Reconcile if this worker is the leader and a run is due; returns the report of a run."""
+        with advisory_lock(self.lock_name) as leader:
+            if not leader:
+                return None
+            with Session(engine, expire_on_commit=False) as session:
+                last = session.exec(
+                    select(StripeReconciliationRun).order_by(col(StripeReconciliationRun.started_at).desc()).limit(1)
+                ).first()
+                if not force and last is not None and last.started_at > datetime.utcnow() - self.interval:
+                    return None
+                run = StripeReconciliationRun()
+                session.add(run)
+                session.commit()
+            report = self.reconcile()
+            logger.info(report.format())
+            with Session(engine) as session:
+                run.finished_at = datetime.utcnow()
+                run.report = asdict(report)
+                session.add(run)
+                session.commit()
+            return report
+
+    async def run(self) -> None:
+        if not stripe.api_key:
+            return
+        await run_in_threadpool(self.run_once)
+
+
+stripe_reconciler = StripeReconciler(settings.STRIPE_RECONCILE_INTERVAL)
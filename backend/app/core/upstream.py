@@ -0,0 +1,272 @@
+import codecs
+import logging
+import re
+from collections.abc import AsyncIterator, Iterable
+from typing import Any
+
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# What an endpoint answers with when it is itself overloaded or unreachable behind its
+# gateway. Any other error status is the target site's own answer relayed by the function.
+ENDPOINT_FAULT_STATUSES = frozenset({429, 502, 503, 504})
+
+
+def is_endpoint_fault(status_code: int) -> bool:
+    return status_code in ENDPOINT_FAULT_STATUSES
+
+
+class UpstreamTargetError(Exception):
+    """
+    The endpoint reached the target site, which answered with an error status.
+    Every other endpoint would get the same answer, so this is not retried.
+    """
+
+    def __init__(self, status_code: int):
+        super().__init__(f"Target site responded with HTTP {status_code}")
+        self.status_code = status_code
+
+
+class UpstreamTooLarge(Exception):
+    """
+    The target's page is bigger than the caller accepts. Like UpstreamTargetError,
+    every endpoint would fetch the same page, so this is not retried.
+    """
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Upstream response exceeds the {max_bytes} byte limit.")
+        self.max_bytes = max_bytes
+
+
+def raise_for_upstream_status(response: httpx.Response) -> None:
+    """Raise UpstreamTargetError for the target's error answers, httpx's error for the endpoint's."""
+    if response.is_error and not is_endpoint_fault(response.status_code):
+        raise UpstreamTargetError(response.status_code)
+    response.raise_for_status()
+
+
+async def limit_bytes(chunks: AsyncIterator[bytes], max_bytes: int) -> AsyncIterator[bytes]:
+    """Pass `chunks` through, raising UpstreamTooLarge once more than `max_bytes` went by."""
+    total = 0
+    async for chunk in chunks:
+        total += len(chunk)
+        if total > max_bytes:
+            raise UpstreamTooLarge(max_bytes)
+        yield chunk
+
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_STRING_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class EnvelopeStream:
+    """
+    Incremental reader for the cloud function's /fetch answer, a JSON object
+    {"result": "<page>", "public_ip": ..., "device_id": ...} in any key order.
+
+    `start()` reads up to the start of the result string, collecting the other fields on
+    the way, and `result()` then yields the page as UTF-8 while it arrives, so the page is
+    never held whole. Only if the metadata comes after the result is the result read
+    ahead, since the metadata has to be known before the response starts.
+    """
+
+    METADATA = ("public_ip", "device_id")
+
+    def __init__(self, chunks: AsyncIterator[bytes], chunk_size: int = 64 * 1024):
+        self._chunks = aiter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._chunk_size = chunk_size
+        self._text = ""
+        self._pos = 0
+        self._ahead: str | None = None
+        self.metadata: dict[str, Any] = {}
+
+    async def _fill(self) -> None:
+        self._text, self._pos = self._text[self._pos:], 0
+        while True:
+            try:
+                chunk = await anext(self._chunks)
+            except StopAsyncIteration:
+                text = self._decoder.decode(b"", final=True)
+                if not text:
+                    raise ValueError("upstream envelope ended early")
+            else:
+                text = self._decoder.decode(chunk)
+            if text:
+                self._text += text
+                return
+
+    async def _need(self, count: int = 1) -> None:
+        while len(self._text) - self._pos < count:
+            await self._fill()
+
+    async def _peek(self) -> str:
+        # The next character that is not whitespace, left unconsumed
+        while True:
+            await self._need()
+            char = self._text[self._pos]
+            if char not in " \t\r\n":
+                return char
+            self._pos += 1
+
+    async def _expect(self, chars: str) -> str:
+        char = await self._peek()
+        if char not in chars:
+            raise ValueError(f"unexpected {char!r} in upstream envelope")
+        self._pos += 1
+        return char
+
+    async def _string(self) -> AsyncIterator[str]:
+        # The unescaped pieces of a string whose opening quote has been consumed
+        while True:
+            await self._need()
+            match = _STRING_SPECIAL.search(self._text, self._pos)
+            end = match.start() if match else len(self._text)
+            if end > self._pos:
+                yield self._text[self._pos:end]
+            self._pos = end
+            if match is None:
+                continue
+            self._pos += 1
+            if match.group() == '"':
+                return
+            yield await self._escape()
+
+    async def _escape(self) -> str:
+        await self._need()
+        char = self._text[self._pos]
+        if char != "u":
+            if char not in _STRING_ESCAPES:
+                raise ValueError(f"invalid escape {char!r} in upstream envelope")
+            self._pos += 1
+            return _STRING_ESCAPES[char]
+        await self._need(5)
+        code = int(self._text[self._pos + 1:self._pos + 5], 16)
+        self._pos += 5
+        if 0xD800 <= code < 0xDC00:
+            # Characters outside the BMP are escaped as a surrogate pair
+            await self._need(6)
+            if self._text.startswith("\\u", self._pos):
+                low = int(self._text[self._pos + 2:self._pos + 6], 16)
+                if 0xDC00 <= low < 0xE000:
+                    self._pos += 6
+                    return chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00))
+        return chr(code)
+
+    async def _skip_value(self) -> None:
+        depth = 0
+        while True:
+            await self._need()
+            char = self._text[self._pos]
+            if char == '"':
+                self._pos += 1
+                async for _ in self._string():
+                    pass
+                if depth == 0:
+                    return
+                continue
+            if depth == 0 and char in ",}]":
+                return
+            self._pos += 1
+            if char in "{[":
+                depth += 1
+            elif char in "}]":
+                depth -= 1
+                if depth == 0:
+                    return
+
+    async def _member_value(self, key: str) -> None:
+        if key in self.METADATA and await self._peek() == '"':
+            self._pos += 1
+            self.metadata[key] = "".join([piece async for piece in self._string()])
+        else:
+            await self._skip_value()
+
+    async def start(self) -> None:
+        """Read up to the result string; raises ValueError when the envelope is not one."""
+        await self._expect("{")
+        while True:
+            await self._expect('"')
+            key = "".join([piece async for piece in self._string()])
+            await self._expect(":")
+            if key == "result" and self._ahead is None:
+                await self._expect('"')
+                if all(name in self.metadata for name in self.METADATA):
+                    return
+                self._ahead = "".join([piece async for piece in self._string()])
+            else:
+                await self._member_value(key)
+            if await self._expect(",}") == "}":
+                break
+        if self._ahead is None:
+            raise ValueError("upstream envelope has no result")
+
+    async def result(self) -> AsyncIterator[bytes]:
+        """The page, encoded as UTF-8, in pieces of about `chunk_size` bytes."""
+        if self._ahead is not None:
+            yield self._ahead.encode("utf-8", "replace")
+            return
+        pending: list[str] = []
+        size = 0
+        async for piece in self._string():
+            pending.append(piece)
+            size += len(piece)
+            if size >= self._chunk_size:
+                yield "".join(pending).encode("utf-8", "replace")
+                pending, size = [], 0
+        if pending:
+            yield "".join(pending).encode("utf-8", "replace")
+
+
+class UpstreamClients:
+    """
+    Shared httpx clients for the cloud-function proxy endpoints.
+
+    One client (and therefore one keep-alive pool) is kept per region so a slow
+    region cannot exhaust the connections of the others. Clients are created on
+    first use, warmed up in the app lifespan and closed on shutdown.
+    """
+
+    def __init__(self) -> None:
+        self._clients: dict[str, httpx.AsyncClient] = {}
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=settings.PROXY_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.PROXY_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=settings.PROXY_POOL_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(
+            settings.PROXY_FETCH_TIMEOUT, connect=settings.PROXY_CONNECT_TIMEOUT
+        )
+        return httpx.AsyncClient(
+            http2=settings.PROXY_HTTP2, limits=limits, timeout=timeout
+        )
+
+    def get(self, region: str) -> httpx.AsyncClient:
+        client = self._clients.get(region)
+        if client is None or client.is_closed:
+            client = self._build_client()
+            self._clients[region] = client
+        return client
+
+    def open(self, regions: Iterable[str]) -> None:
+        for region in regions:
+            self.get(region)
+        logger.info(f"Opened upstream client pools for {len(self._clients)} regions")
+
+    def reset(self) -> None:
+        # Drops the clients without closing them, so the next get() builds new ones
+        self._clients.clear()
+
+    async def aclose(self) -> None:
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+        logger.info(f"Closed {len(clients)} upstream client pools")
+
+
+upstream_clients = UpstreamClients()
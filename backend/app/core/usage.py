@@ -0,0 +1,96 @@
+import logging
+import threading
+import time
+from collections.abc import Callable, Hashable
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+usage_flush_lag = metrics.gauge(
+    "usage_flush_lag_seconds",
+    "Age of the oldest increment written by the last usage flush",
+    ["counter"],
+)
+usage_pending = metrics.gauge(
+    "usage_pending_increments", "Increments buffered in memory and not yet flushed", ["counter"]
+)
+usage_flush_failures = metrics.counter(
+    "usage_flush_failures_total", "Usage flushes that failed and were kept for retry", ["counter"]
+)
+
+
+class UsageAggregator:
+    """
+    Buffers counter increments in memory and writes them in batches.
+
+    `add()` is cheap and never touches the database; `flush()` hands the summed
+    increments per key to `write`, which is expected to apply them atomically
+    (`SET count = count + n`). If the write fails, the batch is merged back and
+    retried on the next flush, so increments are applied at least once. Only
+    increments still buffered when the process dies without a shutdown flush are
+    lost.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        write: Callable[[dict[Hashable, int]], None],
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.write = write
+        self.clock = clock
+        self._pending: dict[Hashable, int] = {}
+        self._oldest: float | None = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return sum(self._pending.values())
+
+    def add(self, key: Hashable, count: int = 1) -> None:
+        if count <= 0:
+            return
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + count
+            if self._oldest is None:
+                self._oldest = self.clock()
+        usage_pending.inc(count, counter=self.name)
+
+    def _take(self) -> tuple[dict[Hashable, int], float | None]:
+        with self._lock:
+            batch, oldest = self._pending, self._oldest
+            self._pending, self._oldest = {}, None
+        return batch, oldest
+
+    def _restore(self, batch: dict[Hashable, int], oldest: float | None) -> None:
+        with self._lock:
+            for key, count in batch.items():
+                self._pending[key] = self._pending.get(key, 0) + count
+            if oldest is not None and (self._oldest is None or oldest < self._oldest):
+                self._oldest = oldest
+
+    def flush(self) -> int:
+        """Write all buffered increments; returns the number of keys written."""
+        with self._flush_lock:
+            batch, oldest = self._take()
+            if not batch:
+                return 0
+            try:
+                self.write(batch)
+            except Exception:
+                self._restore(batch, oldest)
+                usage_flush_failures.inc(counter=self.name)
+                raise
+            if oldest is not None:
+                usage_flush_lag.set(self.clock() - oldest, counter=self.name)
+            usage_pending.dec(sum(batch.values()), counter=self.name)
+            logger.debug(f"Flushed {len(batch)} {self.name} counters")
+            return len(batch)
+
+    async def flush_async(self) -> None:
+        await run_in_threadpool(self.flush)
@@ -0,0 +1,176 @@
+import logging
+from collections.abc import Callable, Mapping
+from datetime import datetime, timedelta
+from typing import Any
+
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, col, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from app.core.db import engine
+from app.core.metrics import metrics
+from app.models import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+webhook_events = metrics.counter(
+    "webhook_events_total",
+    "Webhook events by result (received/duplicate/processed/failed)",
+    ["result"],
+)
+webhook_inbox_pending = metrics.gauge(
+    "webhook_inbox_pending", "Unprocessed events in the webhook inbox after the last drain"
+)
+
+Handler = Callable[[Session, Mapping[str, Any]], None]
+
+_AFTER_COMMIT = "webhook_inbox_after_commit"
+
+
+def after_commit(session: Session, callback: Callable[[], None]) -> None:
+    """
+    Run `callback` once the inbox has committed the event being handled, for side effects
+    such as emails and cache invalidation. It is dropped if the event fails.
+    """
+    session.info.setdefault(_AFTER_COMMIT, []).append(callback)
+
+
+class WebhookInbox:
+    """
+    Durable queue of verified webhook events in the webhookevent table.
+
+    The webhook route only stores the event (deduplicated on its id) and
+    acknowledges it; `drain` processes stored events off the request path, in
+    the order Stripe created them. Each event is claimed with FOR UPDATE SKIP
+    LOCKED, so every worker can drain concurrently, and is marked processed in
+    the same transaction as the handler's changes: handlers only flush, and the
+    inbox commits once. Failed events are retried with exponential backoff up
+    to `max_attempts`.
+    """
+
+    def __init__(
+        self,
+        handler: Handler,
+        batch_size: int = 100,
+        max_attempts: int = 10,
+        retry_delay: float = 5.0,
+        retention: timedelta = timedelta(days=30),
+    ):
+        self.handler = handler
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retention = retention
+
+    async def enqueue(self, session: AsyncSession, event: Mapping[str, Any]) -> bool:
+        """Store a verified event; returns False when its id was already received."""
+        statement = (
+            insert(WebhookEvent)
+            .values(
+                id=event["id"],
+                type=event["type"],
+                created=event["created"],
+                payload=dict(event),
+                received_at=datetime.utcnow(),
+                next_attempt_at=datetime.utcnow(),
+                attempts=0,
+            )
+            .on_conflict_do_nothing(index_elements=[WebhookEvent.id])
+            .returning(WebhookEvent.id)
+        )
+        connection = await session.connection()
+        stored = (await connection.execute(statement)).first() is not None
+        await session.commit()
+        webhook_events.inc(result="received" if stored else "duplicate")
+        return stored
+
+    def _claim(self, session: Session) -> WebhookEvent | None:
+        return session.exec(
+            select(WebhookEvent)
+            .where(
+                col(WebhookEvent.processed_at).is_(None),
+                WebhookEvent.next_attempt_at <= datetime.utcnow(),
+                WebhookEvent.attempts < self.max_attempts,
+            )
+            .order_by(col(WebhookEvent.created), col(WebhookEvent.received_at))
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).first()
+
+    def _process_one(self) -> bool:
+        """Process the next due event; returns False when none is due."""
+        with Session(engine) as session:
+            event = self._claim(session)
+            if event is None:
+                return False
+            event_id, attempts = event.id, event.attempts + 1
+            event.attempts = attempts
+            event.processed_at = datetime.utcnow()
+            event.last_error = None
+            session.add(event)
+            try:
+                self.handler(session, event.payload)
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                session.info.pop(_AFTER_COMMIT, None)
+                delay = self.retry_delay * 2 ** (attempts - 1)
+                logger.error(
+                    f"Webhook event {event_id} failed (attempt {attempts}/{self.max_attempts}): {e}",
+                    exc_info=True,
+                )
+                session.execute(
+                    update(WebhookEvent)
+                    .where(col(WebhookEvent.id) == event_id)
+                    .values(
+                        processed_at=None,
+                        attempts=attempts,
+                        last_error=str(e)[:1000],
+                        next_attempt_at=datetime.utcnow() + timedelta(seconds=delay),
+                    )
+                )
+                session.commit()
+                webhook_events.inc(result="failed")
+                return True
+            callbacks = session.info.pop(_AFTER_COMMIT, [])
+        webhook_events.inc(result="processed")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"After-commit action for webhook event {event_id} failed: {e}", exc_info=True)
+        return True
+
+    def process_pending(self) -> int:
+        """Process up to `batch_size` due events; returns how many were attempted."""
+        processed = 0
+        while processed < self.batch_size and self._process_one():
+            processed += 1
+        with Session(engine) as session:
+            pending = session.exec(
+                select(func.count())
+                .select_from(WebhookEvent)
+                .where(col(WebhookEvent.processed_at).is_(None))
+            ).one()
+        webhook_inbox_pending.set(pending)
+        return processed
+
+    async def drain(self) -> None:
+        # Handlers use the sync session and the blocking Stripe client
+        while await run_in_threadpool(self.process_pending) == self.batch_size:
+            pass
+
+    async def prune(self) -> None:
+        """Drop processed events once Stripe can no longer redeliver them."""
+
+        def run() -> None:
+            cutoff = datetime.utcnow() - self.retention
+            with Session(engine) as session:
+                session.execute(
+                    delete(WebhookEvent).where(col(WebhookEvent.processed_at) < cutoff)
+                )
+                session.commit()
+
+        await run_in_threadpool(run)
@@ -1,10 +1,28 @@
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 import sentry_sdk
 from fastapi import FastAPI
 from fastapi.routing import APIRoute
 from starlette.middleware.cors import CORSMiddleware
 
 from app.api.main import api_router
+from app.api.routes.checkout import stripe_inbox
+from app.api.routes.proxy import (
+    REGION_ENDPOINTS,
+    refresh_endpoint_health,
+    response_cache,
+    token_usage,
+)
 from app.core.config import settings
+from app.core.db import async_engine
+from app.core.expiration import sweep_expired_subscriptions
+from app.core.product_catalog import product_catalog
+from app.core.rate_limit import rate_limiter
+from app.core.scheduler import scheduler
+from app.core.serp_pool import serp_parser_pool
+from app.core.stripe_sync import stripe_reconciler, subscription_resync
+from app.core.upstream import upstream_clients
 
 
 def custom_generate_unique_id(route: APIRoute) -> str:
@@ -14,10 +32,48 @@ def custom_generate_unique_id(route: APIRoute) -> str:
 if settings.SENTRY_DSN and settings.ENVIRONMENT != "local":
     sentry_sdk.init(dsn=str(settings.SENTRY_DSN), enable_tracing=True)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    upstream_clients.open(REGION_ENDPOINTS)
+    serp_parser_pool.open()
+    scheduler.add_job(
+        "proxy-health-monitor",
+        settings.PROXY_HEALTH_CHECK_INTERVAL,
+        refresh_endpoint_health,
+    )
+    scheduler.add_job("proxy-cache-prune", 600, response_cache.prune)
+    scheduler.add_job("usage-flush", settings.USAGE_FLUSH_INTERVAL, token_usage.flush_async)
+    scheduler.add_job("rate-limit-prune", 3600, rate_limiter.prune)
+    # Runs immediately, so the catalog is loaded at startup
+    scheduler.add_job(
+        "stripe-catalog-refresh", settings.STRIPE_CATALOG_REFRESH_INTERVAL, product_catalog.refresh
+    )
+    # Catalog webhooks drained by other workers
+    scheduler.add_job("stripe-catalog-sync", settings.STRIPE_CATALOG_SYNC_INTERVAL, product_catalog.sync)
+    scheduler.add_job("webhook-inbox", settings.WEBHOOK_INBOX_POLL_INTERVAL, stripe_inbox.drain)
+    scheduler.add_job("webhook-inbox-prune", 86400, stripe_inbox.prune)
+    scheduler.add_job(
+        "subscription-resync", settings.SUBSCRIPTION_RESYNC_POLL_INTERVAL, subscription_resync.run
+    )
+    # Ticks often; the advisory lock and the last run decide whether this worker reconciles
+    scheduler.add_job("stripe-reconcile", 60, stripe_reconciler.run)
+    scheduler.add_job(
+        "subscription-expiry", settings.SUBSCRIPTION_EXPIRY_INTERVAL, sweep_expired_subscriptions
+    )
+    scheduler.start()
+    yield
+    await scheduler.shutdown()
+    await token_usage.flush_async()
+    await async_engine.dispose()
+    await upstream_clients.aclose()
+    await serp_parser_pool.aclose()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
+    lifespan=lifespan,
 )
 app.add_middleware(
     CORSMiddleware,
@@ -1,6 +1,8 @@
 import uuid
 from typing import Optional
 from pydantic import EmailStr
+from sqlalchemy import Column, Index, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlmodel import Field, Relationship, SQLModel
 from datetime import datetime
 
@@ -40,6 +42,14 @@ class UpdatePassword(SQLModel):
 # Database model
 class User(UserBase, table=True):
     __tablename__ = "user"  # Changed from "users" to "user"
+    # For the expiration sweeper (app.core.expiration): only subscribed users are indexed
+    __table_args__ = (
+        Index(
+            "ix_user_expiry_date_subscribed",
+            "expiry_date",
+            postgresql_where=text("has_subscription"),
+        ),
+    )
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     hashed_password: str
     expiry_date: Optional[datetime] = Field(default=None)
@@ -125,4 +135,93 @@ class TokenPayload(SQLModel):
 
 class NewPassword(SQLModel):
     token: str
-    new_password: str = Field(min_length=8, max_length=40)
\ No newline at end of file
+    new_password: str = Field(min_length=8, max_length=40)
+
+# Stripe subscriptions of each user, kept current by the Stripe webhook so access checks
+# never call Stripe (see app.core.entitlements)
+class Entitlement(SQLModel, table=True):
+    subscription_id: str = Field(primary_key=True, max_length=255)
+    user_id: uuid.UUID = Field(foreign_key="user.id", index=True, ondelete="CASCADE")
+    stripe_customer_id: Optional[str] = Field(default=None, index=True, max_length=255)
+    status: str = Field(max_length=32)
+    plan_id: Optional[str] = Field(default=None, max_length=255)
+    plan_name: Optional[str] = Field(default=None, max_length=255)
+    product_id: Optional[str] = Field(default=None, max_length=255)
+    product_name: Optional[str] = Field(default=None, max_length=255)
+    product_metadata: dict = Field(default_factory=dict, sa_column=Column(JSONB, nullable=False))
+    # Metadata keys whose value is "true", e.g. ["proxy-api", "serp-api"]
+    features: list[str] = Field(default_factory=list, sa_column=Column(JSONB, nullable=False))
+    created: Optional[int] = None
+    current_period_start: Optional[int] = None
+    current_period_end: Optional[int] = None
+    trial_start: Optional[int] = None
+    trial_end: Optional[int] = None
+    cancel_at_period_end: bool = False
+    # Creation time of the Stripe event the row was last written from; older events are ignored
+    event_created: Optional[int] = None
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+# Verified Stripe webhook events, stored before they are processed (see app.core.webhook_inbox)
+class WebhookEvent(SQLModel, table=True):
+    __table_args__ = (
+        Index(
+            "ix_webhookevent_pending",
+            "next_attempt_at",
+            postgresql_where=text("processed_at IS NULL"),
+        ),
+    )
+    id: str = Field(primary_key=True, max_length=255)
+    type: str = Field(max_length=255)
+    created: int
+    payload: dict = Field(sa_column=Column(JSONB, nullable=False))
+    received_at: datetime = Field(default_factory=datetime.utcnow)
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+    attempts: int = 0
+    last_error: Optional[str] = None
+    processed_at: Optional[datetime] = Field(default=None, index=True)
+
+# Background walk over a product's Stripe subscriptions (see app.core.stripe_sync); the
+# cursor is the last price and subscription applied, so an interrupted job resumes there
+class SubscriptionResyncJob(SQLModel, table=True):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    product_id: str = Field(index=True, max_length=255)
+    # pending, running, done, failed, or superseded by a newer job for the same product
+    status: str = Field(default="pending", max_length=32)
+    cursor_price: Optional[str] = Field(default=None, max_length=255)
+    cursor_subscription: Optional[str] = Field(default=None, max_length=255)
+    processed: int = 0
+    changed: int = 0
+    error: Optional[str] = None
+    locked_until: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+class SubscriptionResyncJobPublic(SQLModel):
+    id: uuid.UUID
+    product_id: str
+    status: str
+    processed: int
+    changed: int
+    error: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime]
+
+# One Stripe-to-database reconciliation run and the drift it corrected (see app.core.stripe_sync)
+class StripeReconciliationRun(SQLModel, table=True):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    started_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    finished_at: Optional[datetime] = None
+    report: dict = Field(default_factory=dict, sa_column=Column(JSONB, nullable=False))
+
+# Rate limiting state for the Postgres rate limit backend (see app.core.rate_limit)
+class RateLimitBucket(SQLModel, table=True):
+    key: str = Field(primary_key=True, max_length=64)
+    tokens: float
+    updated_at: float
+
+class QuotaUsage(SQLModel, table=True):
+    key: str = Field(primary_key=True, max_length=64)
+    period: str = Field(primary_key=True, max_length=7)
+    used: int = Field(default=0)
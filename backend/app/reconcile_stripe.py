@@ -0,0 +1,19 @@
+import logging
+
+from app.core.stripe_sync import stripe_reconciler
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    logger.info("Reconciling users with Stripe")
+    report = stripe_reconciler.run_once(force=True)
+    if report is None:
+        logger.info("Another process is reconciling; try again later")
+        return
+    print(report.format())
+
+
+if __name__ == "__main__":
+    main()
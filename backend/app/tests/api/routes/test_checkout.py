@@ -0,0 +1,123 @@
+import hashlib
+import hmac
+import json
+import threading
+import time
+import uuid
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.models import Entitlement, User, WebhookEvent
+from app.tests.utils.user import create_random_user
+
+WEBHOOK_SECRET = "whsec_test"
+
+
+def post_event(client: TestClient, event: dict) -> dict:
+    payload = json.dumps(event)
+    timestamp = int(time.time())
+    signature = hmac.new(
+        WEBHOOK_SECRET.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    with patch("app.api.routes.checkout.webhook_secret", WEBHOOK_SECRET):
+        r = client.post(
+            f"{settings.API_V1_STR}/stripe/webhook",
+            content=payload,
+            headers={"stripe-signature": f"t={timestamp},v1={signature}"},
+        )
+    assert r.status_code == 200
+    return r.json()
+
+
+def subscription_event(customer_id: str, subscription_id: str, status: str, created: int) -> dict:
+    return {
+        "id": f"evt_{uuid.uuid4().hex}",
+        "type": "customer.subscription.updated",
+        "created": created,
+        "data": {
+            "object": {
+                "id": subscription_id,
+                "customer": customer_id,
+                "status": status,
+                "created": 1700000000,
+                "plan": {
+                    "id": "price_pro",
+                    "nickname": "Pro",
+                    "product": {"id": "prod_pro", "name": "Pro", "metadata": {"proxy-api": "true"}},
+                },
+            }
+        },
+    }
+
+
+def test_webhook_rejects_bad_signature(client: TestClient) -> None:
+    with patch("app.api.routes.checkout.webhook_secret", WEBHOOK_SECRET):
+        r = client.post(
+            f"{settings.API_V1_STR}/stripe/webhook",
+            content=b"{}",
+            headers={"stripe-signature": "t=1,v1=bad"},
+        )
+    assert r.status_code == 400
+
+
+def test_webhook_events_are_deduped_and_applied_in_order(client: TestClient, db: Session) -> None:
+    user = create_random_user(db)
+    customer_id = f"cus_{uuid.uuid4().hex}"
+    user.stripe_customer_id = customer_id
+    db.add(user)
+    db.commit()
+    subscription_id = f"sub_{uuid.uuid4().hex}"
+
+    newer = subscription_event(customer_id, subscription_id, "active", created=2000)
+    older = subscription_event(customer_id, subscription_id, "canceled", created=1000)
+    assert post_event(client, newer) == {"status": "success", "event_type": "customer.subscription.updated"}
+    post_event(client, newer)
+    # Delivered late: must not overwrite the newer state
+    post_event(client, older)
+
+    for event in (newer, older):
+        stored = db.get(WebhookEvent, event["id"])
+        assert stored is not None
+        db.refresh(stored)
+        assert stored.processed_at is not None
+        assert stored.attempts == 1
+
+    entitlement = db.exec(
+        select(Entitlement).where(Entitlement.subscription_id == subscription_id)
+    ).one()
+    db.refresh(entitlement)
+    assert entitlement.status == "active"
+    assert entitlement.event_created == 2000
+    assert entitlement.features == ["proxy-api"]
+    db.refresh(user)
+    assert user.has_subscription
+    assert not user.is_deactivated
+
+
+def test_activation_email_does_not_hold_up_the_inbox(client: TestClient, db: Session) -> None:
+    email = f"{uuid.uuid4().hex}@example.com"
+    release, sent = threading.Event(), threading.Event()
+
+    def slow_send(email_to: str, subject: str, html_content: str) -> bool:
+        release.wait(5)
+        sent.set()
+        return True
+
+    event = {
+        "id": f"evt_{uuid.uuid4().hex}",
+        "type": "charge.succeeded",
+        "created": int(time.time()),
+        "data": {"object": {"id": "ch_1", "customer": None, "amount": 500, "currency": "usd", "billing_details": {"email": email}}},
+    }
+    with patch("app.api.routes.checkout.send_email_with_retry", side_effect=slow_send):
+        post_event(client, event)
+        # Processed and committed while the email is still being sent
+        stored = db.get(WebhookEvent, event["id"])
+        assert stored is not None and stored.processed_at is not None
+        assert db.exec(select(User).where(User.email == email)).first() is not None
+        assert not sent.is_set()
+        release.set()
+        assert sent.wait(5)
@@ -0,0 +1,718 @@
+import asyncio
+import json
+from collections.abc import AsyncIterator
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest.mock import patch
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from app.api.routes.proxy import (
+    SUPPORTED_ENGINES,
+    APIToken,
+    HedgeBudget,
+    ProxyEndpointManager,
+    endpoint_manager,
+    fetch_multi_engine_serp,
+    fetch_upstream,
+    parse_engines,
+    rank_serp_results,
+    response_cache,
+    serp_page_url,
+    token_usage,
+)
+from app.core.api_key_cache import api_key_cache
+from app.core.config import settings
+from app.core.rate_limit import PlanLimits
+from app.core.security import api_key_lookup_prefix, hash_api_key
+from app.core.serp_cache import serp_cache
+from app.core.serp_parser import SerpResponse, SerpResult
+from app.core.upstream import UpstreamTargetError
+from app.tests.utils.proxy import create_api_key, mock_upstream
+from app.tests.utils.user import authentication_token_from_email
+from app.tests.utils.utils import random_lower_string
+
+
+def test_choose_endpoint_prefers_lower_score() -> None:
+    manager = ProxyEndpointManager()
+    fast, slow = manager.get_endpoints("us-east")[:2]
+    manager.finish_request(fast, 0.1, ok=True)
+    manager.finish_request(slow, 2.0, ok=True)
+    assert all(manager.choose_endpoint([fast, slow]) == fast for _ in range(10))
+
+
+def test_errors_and_in_flight_raise_score() -> None:
+    manager = ProxyEndpointManager()
+    url = manager.get_endpoints("asia")[0]
+    manager.finish_request(url, 0.5, ok=True)
+    baseline = manager.score(url)
+    manager.start_request(url)
+    assert manager.score(url) > baseline
+    manager.finish_request(url, 0.5, ok=False)
+    assert manager.stats[url].error_rate > 0
+    assert manager.score(url) > baseline
+
+
+def test_unmeasured_endpoints_share_a_burst() -> None:
+    manager = ProxyEndpointManager()
+    measured, busy, idle = manager.get_endpoints("us-east")[:3]
+    manager.finish_request(measured, 0.4, ok=True)
+    assert manager.prior_latency("us-east") == 0.4
+    manager.start_request(busy)
+    # Without fetch history both score the prior, so in-flight requests decide
+    assert manager.score(idle) == 0.4
+    assert manager.score(busy) == 0.8
+    assert all(manager.choose_endpoint([busy, idle]) == idle for _ in range(10))
+    assert ProxyEndpointManager().prior_latency("asia") == settings.PROXY_PRIOR_LATENCY
+
+
+def test_health_probes_do_not_feed_fetch_latency() -> None:
+    manager = ProxyEndpointManager()
+    url = manager.get_endpoints("asia")[0]
+    manager.record_health({"region": "asia", "endpoint": url, "is_healthy": True, "response_time": 0.01})
+    assert manager.stats[url].ewma_latency is None
+    assert manager.get_healthy_endpoints("asia")[0] == url
+
+
+def test_rank_regions_orders_fallbacks_by_latency() -> None:
+    manager = ProxyEndpointManager()
+    manager.finish_request(manager.get_endpoints("europe")[0], 0.2, ok=True)
+    manager.finish_request(manager.get_endpoints("asia")[0], 0.9, ok=True)
+    ranked = manager.rank_regions("us-west")
+    assert ranked[0] == "us-west"
+    assert ranked[1:3] == ["europe", "asia"]
+    assert sorted(ranked) == sorted(manager.endpoints)
+
+
+def test_endpoint_scores_requires_superuser(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/proxy/admin/endpoints",
+        headers=normal_user_token_headers,
+    )
+    assert r.status_code == 403
+
+
+def test_endpoint_scores(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/proxy/admin/endpoints",
+        headers=superuser_token_headers,
+    )
+    assert r.status_code == 200
+    regions = r.json()["regions"]
+    assert {region["region"] for region in regions} == set(
+        ProxyEndpointManager().endpoints
+    )
+
+
+def test_hedge_budget_caps_extra_traffic() -> None:
+    budget = HedgeBudget(ratio=0.1)
+    hedges = 0
+    for _ in range(100):
+        budget.deposit()
+        if budget.try_spend():
+            hedges += 1
+    assert hedges == budget.hedges
+    assert hedges <= 10
+
+
+def test_hedge_delay_uses_region_percentile() -> None:
+    manager = ProxyEndpointManager()
+    assert manager.hedge_delay("europe") == settings.PROXY_HEDGE_DEFAULT_DELAY
+    url = manager.get_endpoints("europe")[0]
+    for i in range(1, 101):
+        manager.start_request(url)
+        manager.finish_request(url, i / 100, ok=True)
+    assert manager.hedge_delay("europe") == 0.96
+
+
+def test_open_circuit_removes_endpoint_from_rotation() -> None:
+    manager = ProxyEndpointManager()
+    url = manager.get_endpoints("australia")[0]
+    for _ in range(settings.PROXY_CIRCUIT_FAILURE_THRESHOLD):
+        assert manager.start_request(url)
+        manager.finish_request(url, 1.0, ok=False)
+    assert url not in manager.get_healthy_endpoints("australia")
+    assert not manager.start_request(url)
+
+
+def test_cancelled_hedged_fetch_cancels_primary_request() -> None:
+    async def slow_handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(10)
+        return httpx.Response(200, json={"result": "late"})
+
+    async def run() -> int:
+        fetch = asyncio.create_task(fetch_upstream("https://example.com/", "us-east", "ua", hedge=True))
+        await asyncio.sleep(0.05)  # inside the wait for the primary, before any hedge
+        fetch.cancel()
+        await asyncio.sleep(0.05)
+        return sum(stats.in_flight for stats in endpoint_manager.stats.values())
+
+    with mock_upstream(slow_handler):
+        assert asyncio.run(run()) == 0
+
+
+def test_target_errors_are_not_retried_or_held_against_the_endpoint() -> None:
+    calls: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(str(request.url))
+        status = 503 if "missing" not in request.content.decode() else 404
+        return httpx.Response(status)
+
+    with mock_upstream(handler):
+        with pytest.raises(UpstreamTargetError) as error:
+            asyncio.run(fetch_upstream("https://example.com/missing", "us-east", "ua"))
+        assert error.value.status_code == 404
+        assert len(calls) == 1
+        assert all(stats.failures == 0 for stats in endpoint_manager.stats.values())
+
+        # An overloaded endpoint is a fault: every endpoint in every region is tried
+        assert asyncio.run(fetch_upstream("https://example.com/", "us-east", "ua")) is None
+        assert len(calls) == 1 + len(endpoint_manager.stats)
+
+
+class UpstreamBody(httpx.AsyncByteStream):
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        yield self.data
+
+
+def upstream_handler(request: httpx.Request) -> httpx.Response:
+    if request.url.path.endswith("/health"):
+        return httpx.Response(200, json={"status": "ok"})
+    body = json.dumps(
+        {"result": "<html>ok</html>", "public_ip": "1.2.3.4", "device_id": "d1"}
+    ).encode()
+    return httpx.Response(
+        200,
+        stream=UpstreamBody(body),
+        headers={"Content-Type": "application/json", "Content-Length": str(len(body))},
+    )
+
+
+def test_fetch(client: TestClient, db: Session) -> None:
+    _, api_key = create_api_key(db)
+    with mock_upstream(upstream_handler):
+        r = client.post(
+            f"{settings.API_V1_STR}/proxy/fetch",
+            params={"region": "us-east"},
+            headers={"X-API-Key": api_key},
+            json={"url": "https://example.com/"},
+        )
+    assert r.status_code == 200
+    assert r.json() == {
+        "result": "<html>ok</html>",
+        "public_ip": "1.2.3.4",
+        "device_id": "d1",
+        "region_used": "us-east",
+    }
+
+
+def test_fetch_max_age_serves_cached_response(client: TestClient, db: Session) -> None:
+    _, api_key = create_api_key(db)
+    calls: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if not request.url.path.endswith("/health"):
+            calls.append(str(request.url))
+        return upstream_handler(request)
+
+    response_cache.clear()
+    with mock_upstream(handler):
+        responses = [
+            client.post(
+                f"{settings.API_V1_STR}/proxy/fetch",
+                params={"region": "us-east", "max_age": 60},
+                headers={"X-API-Key": api_key},
+                json={"url": "https://example.com/cached"},
+            )
+            for _ in range(2)
+        ]
+    response_cache.clear()
+    assert [r.headers["X-Cache"] for r in responses] == ["MISS", "HIT"]
+    assert responses[0].json() == responses[1].json()
+    assert len(calls) == 1
+    token = db.exec(select(APIToken).where(APIToken.key_hash == hash_api_key(api_key))).one()
+    token_usage.flush()
+    db.refresh(token)
+    assert token.request_count == 2
+
+
+def test_fetch_raw_returns_the_page_from_the_envelope(client: TestClient, db: Session) -> None:
+    _, api_key = create_api_key(db)
+    with mock_upstream(upstream_handler):
+        r = client.post(
+            f"{settings.API_V1_STR}/proxy/fetch",
+            params={"region": "europe", "mode": "raw"},
+            headers={"X-API-Key": api_key},
+            json={"url": "https://example.com/"},
+        )
+    assert r.status_code == 200
+    assert r.text == "<html>ok</html>"
+    assert r.headers["content-type"].startswith("text/plain")
+    assert r.headers["x-region-used"] == "europe"
+    assert r.headers["x-public-ip"] == "1.2.3.4"
+    assert r.headers["x-device-id"] == "d1"
+
+
+def test_fetch_raw_rejects_oversized_body(client: TestClient, db: Session) -> None:
+    _, api_key = create_api_key(db)
+    with (
+        mock_upstream(upstream_handler),
+        patch.object(settings, "PROXY_STREAM_MAX_BYTES", 10),
+    ):
+        r = client.post(
+            f"{settings.API_V1_STR}/proxy/fetch",
+            params={"region": "asia", "mode": "raw"},
+            headers={"X-API-Key": api_key},
+            json={"url": "https://example.com/"},
+        )
+    assert r.status_code == 413
+
+
+def test_fetch_raw_cuts_off_a_page_without_content_length(client: TestClient, db: Session) -> None:
+    _, api_key = create_api_key(db)
+    page = "<p>row</p>" * 100
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.dumps({"public_ip": "1.2.3.4", "device_id": "d1", "result": page}).encode()
+        return httpx.Response(200, stream=UpstreamBody(body))
+
+    with (
+        mock_upstream(handler),
+        patch.object(settings, "PROXY_STREAM_MAX_BYTES", 300),
+        patch.object(settings, "PROXY_STREAM_CHUNK_SIZE", 64),
+    ):
+        r = client.post(
+            f"{settings.API_V1_STR}/proxy/fetch",
+            params={"region": "asia", "mode": "raw"},
+            headers={"X-API-Key": api_key},
+            json={"url": "https://example.com/"},
+        )
+    assert r.status_code == 200
+    assert r.headers["x-public-ip"] == "1.2.3.4"
+    assert 0 < len(r.text) < 300
+    assert page.startswith(r.text)
+
+
+def test_fetch_raw_falls_back_on_an_unreadable_envelope(client: TestClient, db: Session) -> None:
+    _, api_key = create_api_key(db)
+    calls: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(str(request.url))
+        if len(calls) == 1:
+            return httpx.Response(200, content=b"<html>not an envelope</html>")
+        return upstream_handler(request)
+
+    with mock_upstream(handler):
+        r = client.post(
+            f"{settings.API_V1_STR}/proxy/fetch",
+            params={"region": "asia", "mode": "raw"},
+            headers={"X-API-Key": api_key},
+            json={"url": "https://example.com/"},
+        )
+        assert sum(stats.failures for stats in endpoint_manager.stats.values()) == 1
+    assert r.status_code == 200
+    assert r.text == "<html>ok</html>"
+    assert len(calls) == 2
+
+
+def test_fetch_batch_streams_ndjson_and_counts_usage_once(
+    client: TestClient, db: Session
+) -> None:
+    _, api_key = create_api_key(db)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if b"broken" in request.content:
+            return httpx.Response(500)
+        return upstream_handler(request)
+
+    urls = ["https://example.com/a", "https://example.com/broken", "https://example.com/b"]
+    with mock_upstream(handler):
+        r = client.post(
+            f"{settings.API_V1_STR}/proxy/fetch/batch",
+            params={"region": "us-central"},
+            headers={"X-API-Key": api_key},
+            json={"urls": urls},
+        )
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert sorted(line["index"] for line in lines) == [0, 1, 2]
+    by_url = {line["url"]: line for line in lines}
+    assert by_url["https://example.com/a"]["ok"]
+    assert by_url["https://example.com/a"]["result"] == "<html>ok</html>"
+    assert not by_url["https://example.com/broken"]["ok"]
+
+    token = db.exec(select(APIToken).where(APIToken.key_hash == hash_api_key(api_key))).one()
+    token_usage.flush()
+    db.refresh(token)
+    assert token.request_count == 2
+
+
+def test_fetch_batch_rejects_oversized_batch(client: TestClient, db: Session) -> None:
+    _, api_key = create_api_key(db)
+    with patch.object(settings, "PROXY_BATCH_MAX_URLS", 1):
+        r = client.post(
+            f"{settings.API_V1_STR}/proxy/fetch/batch",
+            params={"region": "us-central"},
+            headers={"X-API-Key": api_key},
+            json={"urls": ["https://example.com/a", "https://example.com/b"]},
+        )
+    assert r.status_code == 400
+
+
+def test_api_key_lifecycle(client: TestClient, db: Session) -> None:
+    user, _ = create_api_key(db)
+    headers = authentication_token_from_email(client=client, email=user.email, db=db)
+
+    r = client.post(f"{settings.API_V1_STR}/proxy/generate-api-key", headers=headers)
+    assert r.status_code == 200
+    api_key = r.json()["api_key"]
+
+    r = client.get(f"{settings.API_V1_STR}/proxy/api-keys", headers=headers)
+    assert r.status_code == 200
+    previews = [key["key_preview"] for key in r.json()]
+    assert len(previews) == 2
+    preview = next(p for p in previews if api_key.startswith(p.split("...")[0]))
+
+    with patch("app.api.routes.proxy.send_email"):
+        r = client.delete(f"{settings.API_V1_STR}/proxy/api-keys/{preview}", headers=headers)
+    assert r.status_code == 204
+    r = client.get(f"{settings.API_V1_STR}/proxy/api-keys", headers=headers)
+    assert len(r.json()) == 1
+
+
+def test_cached_api_key_is_invalidated_on_subscription_change(
+    client: TestClient, db: Session, superuser_token_headers: dict[str, str]
+) -> None:
+    user, api_key = create_api_key(db)
+    r = client.get(f"{settings.API_V1_STR}/proxy/regions", headers={"X-API-Key": api_key})
+    assert r.status_code == 200
+    assert api_key_cache.get(api_key) is not None
+
+    r = client.patch(
+        f"{settings.API_V1_STR}/users/{user.id}",
+        headers=superuser_token_headers,
+        json={"has_subscription": False},
+    )
+    assert r.status_code == 200
+    assert api_key_cache.get(api_key) is None
+    r = client.get(f"{settings.API_V1_STR}/proxy/regions", headers={"X-API-Key": api_key})
+    assert r.status_code == 403
+
+
+def test_deleted_api_key_is_rejected(client: TestClient, db: Session) -> None:
+    user, api_key = create_api_key(db)
+    headers = authentication_token_from_email(client=client, email=user.email, db=db)
+    r = client.get(f"{settings.API_V1_STR}/proxy/regions", headers={"X-API-Key": api_key})
+    assert r.status_code == 200
+
+    preview = client.get(f"{settings.API_V1_STR}/proxy/api-keys", headers=headers).json()[0]["key_preview"]
+    with patch("app.api.routes.proxy.send_email"):
+        r = client.delete(f"{settings.API_V1_STR}/proxy/api-keys/{preview}", headers=headers)
+    assert r.status_code == 204
+    r = client.get(f"{settings.API_V1_STR}/proxy/regions", headers={"X-API-Key": api_key})
+    assert r.status_code == 401
+
+
+def test_migrated_legacy_api_key_is_accepted(client: TestClient, db: Session) -> None:
+    user, _ = create_api_key(db)
+    legacy_key = "eyJhbGciOiJIUzI1NiJ9." + random_lower_string()
+    db.add(
+        APIToken(
+            user_id=user.id,
+            token=legacy_key,
+            key_prefix=api_key_lookup_prefix(legacy_key),
+            key_hash=hash_api_key(legacy_key),
+            expires_at=datetime.utcnow() + timedelta(days=1),
+        )
+    )
+    db.commit()
+    r = client.get(f"{settings.API_V1_STR}/proxy/regions", headers={"X-API-Key": legacy_key})
+    assert r.status_code == 200
+    r = client.get(
+        f"{settings.API_V1_STR}/proxy/regions", headers={"X-API-Key": legacy_key + "x"}
+    )
+    assert r.status_code == 401
+
+
+def test_rate_limited_fetch_returns_429(client: TestClient, db: Session) -> None:
+    _, api_key = create_api_key(db)
+    limits = PlanLimits(key_rate=0.01, key_burst=1, user_rate=10.0, user_burst=10)
+    with mock_upstream(upstream_handler), patch("app.api.routes.proxy.get_plan_limits", return_value=limits):
+        responses = [
+            client.post(
+                f"{settings.API_V1_STR}/proxy/fetch",
+                params={"region": "us-east"},
+                headers={"X-API-Key": api_key},
+                json={"url": "https://example.com/"},
+            )
+            for _ in range(2)
+        ]
+    assert responses[0].status_code == 200
+    assert responses[1].status_code == 429
+    assert int(responses[1].headers["Retry-After"]) > 0
+    assert responses[1].headers["X-RateLimit-Limit"] == "1"
+    assert responses[1].headers["X-RateLimit-Remaining"] == "0"
+
+
+def test_serp_serves_cached_results_and_admin_purges(
+    client: TestClient, db: Session, superuser_token_headers: dict[str, str]
+) -> None:
+    _, api_key = create_api_key(db)
+    html = (Path(__file__).parents[2] / "fixtures" / "serp" / "bing_basic.html").read_text()
+    calls: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/health"):
+            return httpx.Response(200, json={"status": "ok"})
+        calls.append(json.loads(request.content)["url"])
+        return httpx.Response(200, json={"result": html, "public_ip": "1.2.3.4", "device_id": "d1"})
+
+    query = random_lower_string()
+    serp_cache.purge()
+    with mock_upstream(handler):
+        responses = [
+            client.get(
+                f"{settings.API_V1_STR}/proxy/serp",
+                params={"q": q, "engine": "bing", "region": "us-east"},
+                headers={"X-API-Key": api_key},
+            )
+            for q in (query, query.upper())
+        ]
+        r = client.delete(
+            f"{settings.API_V1_STR}/proxy/admin/serp-cache",
+            params={"engine": "bing", "q": query},
+            headers=superuser_token_headers,
+        )
+        assert r.json() == {"purged": 1}
+        after_purge = client.get(
+            f"{settings.API_V1_STR}/proxy/serp",
+            params={"q": query, "engine": "bing", "region": "us-east"},
+            headers={"X-API-Key": api_key},
+        )
+    serp_cache.purge()
+    assert [r.headers["X-Cache"] for r in responses] == ["MISS", "HIT"]
+    assert responses[1].json()["search_query"] == query.upper()
+    assert responses[0].json()["organic_results"] == responses[1].json()["organic_results"]
+    assert len(responses[0].json()["organic_results"]) == 6
+    assert after_purge.headers["X-Cache"] == "MISS"
+    assert len(calls) == 2
+    token = db.exec(select(APIToken).where(APIToken.key_hash == hash_api_key(api_key))).one()
+    token_usage.flush()
+    db.refresh(token)
+    assert token.request_count == 3
+
+
+def test_serp_cache_purge_requires_superuser(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    r = client.delete(
+        f"{settings.API_V1_STR}/proxy/admin/serp-cache",
+        headers=normal_user_token_headers,
+    )
+    assert r.status_code == 403
+
+
+def bing_page(links: list[str]) -> str:
+    items = "".join(f'<li class="b_algo"><h2><a href="{link}">{link}</a></h2></li>' for link in links)
+    return f"<html><body><ol>{items}</ol></body></html>"
+
+
+def test_serp_page_urls() -> None:
+    assert serp_page_url("google", "a b", 1) == "https://www.google.com/search?q=a+b&hl=en&gl=us"
+    assert serp_page_url("google", "a b", 3).endswith("&start=20")
+    assert serp_page_url("bing", "a", 2).endswith("&first=11")
+    assert serp_page_url("duckduckgo", "a", 2).endswith("&s=30&dc=31")
+
+
+def test_serp_pages_are_fetched_concurrently_and_merged(client: TestClient, db: Session) -> None:
+    _, api_key = create_api_key(db)
+    pages = {
+        1: [f"https://r{i}.example" for i in range(10)],
+        2: [f"https://r{i}.example" for i in range(9, 19)],
+        3: [f"https://r{i}.example" for i in range(20, 30)],
+    }
+    failing_query = random_lower_string()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/health"):
+            return httpx.Response(200, json={"status": "ok"})
+        url = httpx.URL(json.loads(request.content)["url"])
+        page = (int(url.params.get("first", "1")) - 1) // 10 + 1
+        if page == 3 and url.params["q"] == failing_query:
+            return httpx.Response(500)
+        return httpx.Response(200, json={"result": bing_page(pages[page]), "public_ip": "1.2.3.4", "device_id": "d1"})
+
+    serp_cache.purge()
+    with mock_upstream(handler):
+        r = client.get(
+            f"{settings.API_V1_STR}/proxy/serp",
+            params={"q": random_lower_string(), "engine": "bing", "region": "us-east", "num": 25},
+            headers={"X-API-Key": api_key},
+        )
+        partial = client.get(
+            f"{settings.API_V1_STR}/proxy/serp",
+            params={"q": failing_query, "engine": "bing", "region": "us-east", "pages": 3},
+            headers={"X-API-Key": api_key},
+        )
+    serp_cache.purge()
+    assert r.status_code == 200
+    results = r.json()["organic_results"]
+    assert [result["position"] for result in results] == list(range(1, 26))
+    assert [result["link"] for result in results] == [f"https://r{i}.example" for i in [*range(19), *range(20, 26)]]
+    assert partial.status_code == 200
+    assert len(partial.json()["organic_results"]) == 19
+    token = db.exec(select(APIToken).where(APIToken.key_hash == hash_api_key(api_key))).one()
+    token_usage.flush()
+    db.refresh(token)
+    assert token.request_count == 5
+
+
+def test_serp_quota_is_charged_for_pages_served(client: TestClient, db: Session) -> None:
+    _, api_key = create_api_key(db)
+    limits = PlanLimits(key_rate=10.0, key_burst=10, user_rate=10.0, user_burst=10, monthly_quota=4)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        url = httpx.URL(json.loads(request.content)["url"])
+        # Only two pages of results exist
+        if url.params.get("first", "1") != "1":
+            return httpx.Response(200, json={"result": bing_page([]), "public_ip": "1.2.3.4", "device_id": "d1"})
+        links = [f"https://q{i}.example" for i in range(10)]
+        return httpx.Response(200, json={"result": bing_page(links), "public_ip": "1.2.3.4", "device_id": "d1"})
+
+    def search(pages: int) -> int:
+        return client.get(
+            f"{settings.API_V1_STR}/proxy/serp",
+            params={"q": random_lower_string(), "engine": "bing", "region": "us-east", "pages": pages},
+            headers={"X-API-Key": api_key},
+        ).status_code
+
+    serp_cache.purge()
+    with (
+        mock_upstream(handler),
+        patch.object(settings, "RATE_LIMIT_ENABLED", True),
+        patch("app.api.routes.proxy.get_plan_limits", return_value=limits),
+    ):
+        # 3 pages reserved, 2 served (the empty second page ends the walk): 2 of 4 used
+        assert search(3) == 200
+        # More than the quota left cannot be reserved, but what is left can
+        assert search(3) == 429
+        assert search(2) == 200
+        assert search(1) == 429
+    serp_cache.purge()
+
+
+def test_rank_serp_results_fuses_engines() -> None:
+    def response(engine: str, links: list[str]) -> SerpResponse:
+        return SerpResponse(
+            search_engine=engine,
+            search_query="q",
+            region_used="us-east",
+            organic_results=[
+                SerpResult(position=i, title=f"{engine} {i}", link=link, snippet="")
+                for i, link in enumerate(links, start=1)
+            ],
+        )
+
+    ranked = rank_serp_results({
+        "google": response("google", ["https://a.example/", "https://b.example", "https://c.example"]),
+        "bing": response("bing", ["https://c.example#top", "http://WWW.a.example", "https://d.example"]),
+    })
+    assert [r.link for r in ranked] == [
+        "https://a.example/", "https://c.example#top", "https://b.example", "https://d.example",
+    ]
+    assert [r.position for r in ranked] == [1, 2, 3, 4]
+    assert ranked[0].engines == ["google", "bing"]
+    assert ranked[1].title == "bing 1"
+
+
+def test_multi_engine_serp_returns_partial_results_at_deadline() -> None:
+    async def fake_fetch_engine_serp(q, engine, region, user_agent, pages, num):
+        if engine == "duckduckgo":
+            await asyncio.sleep(10)
+        if engine == "bing":
+            raise HTTPException(status_code=503, detail="No healthy proxy endpoints available across all regions.")
+        results = [SerpResult(position=1, title="t", link="https://a.example", snippet="")]
+        return SerpResponse(search_engine=engine, search_query=q, region_used=region, organic_results=results), "MISS", 1
+
+    with patch("app.api.routes.proxy.fetch_engine_serp", fake_fetch_engine_serp):
+        multi, cache_status, served = asyncio.run(
+            fetch_multi_engine_serp(
+                "q", ["google", "bing", "duckduckgo"], "us-east", "ua",
+                {"google": 1, "bing": 1, "duckduckgo": 1}, None, timeout=0.05,
+            )
+        )
+    assert list(multi.results) == ["google"]
+    assert multi.errors == {
+        "bing": "No healthy proxy endpoints available across all regions.",
+        "duckduckgo": "No response within 0.05s",
+    }
+    assert [r.engines for r in multi.merged_results] == [["google"]]
+    assert (cache_status, served) == ("MISS", 1)
+
+
+def test_serp_fans_out_to_all_engines(client: TestClient, db: Session) -> None:
+    _, api_key = create_api_key(db)
+    fixtures = Path(__file__).parents[2] / "fixtures" / "serp"
+    pages = {
+        "www.google.com": (fixtures / "google_basic.html").read_text(),
+        "www.bing.com": (fixtures / "bing_basic.html").read_text(),
+        "html.duckduckgo.com": (fixtures / "duckduckgo_basic.html").read_text(),
+    }
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/health"):
+            return httpx.Response(200, json={"status": "ok"})
+        html = pages[httpx.URL(json.loads(request.content)["url"]).host]
+        return httpx.Response(200, json={"result": html, "public_ip": "1.2.3.4", "device_id": "d1"})
+
+    serp_cache.purge()
+    with mock_upstream(handler):
+        r = client.get(
+            f"{settings.API_V1_STR}/proxy/serp",
+            params={"q": random_lower_string(), "engine": "all", "region": "us-east"},
+            headers={"X-API-Key": api_key},
+        )
+        unsupported = client.get(
+            f"{settings.API_V1_STR}/proxy/serp",
+            params=[("q", "x"), ("engine", "google"), ("engine", "yahoo"), ("region", "us-east")],
+            headers={"X-API-Key": api_key},
+        )
+    serp_cache.purge()
+    assert r.status_code == 200
+    body = r.json()
+    assert body["search_engines"] == ["google", "bing", "duckduckgo"]
+    assert body["errors"] == {}
+    assert {name: len(res["organic_results"]) for name, res in body["results"].items()} == {
+        "google": 11, "bing": 6, "duckduckgo": 7,
+    }
+    links = [result["link"] for result in body["merged_results"]]
+    assert len(links) == len(set(links))
+    assert body["merged_results"][0]["position"] == 1
+    assert unsupported.status_code == 400
+    token = db.exec(select(APIToken).where(APIToken.key_hash == hash_api_key(api_key))).one()
+    token_usage.flush()
+    db.refresh(token)
+    assert token.request_count == 3
+
+
+def test_parse_engines() -> None:
+    assert parse_engines(None) == ["google"]
+    assert parse_engines(["bing, google", "bing"]) == ["bing", "google"]
+    assert parse_engines(["google", "all"]) == list(SUPPORTED_ENGINES)
+    with pytest.raises(HTTPException) as error:
+        parse_engines(["altavista"])
+    assert error.value.status_code == 400
@@ -0,0 +1,77 @@
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app import crud
+from app.core.config import settings
+from app.core.entitlements import entitlement_cache, upsert_entitlement
+from app.tests.utils.user import authentication_token_from_email
+from app.tests.utils.utils import random_email, random_lower_string
+
+
+def test_feature_access_reads_entitlements(client: TestClient, db: Session) -> None:
+    email = random_email()
+    headers = authentication_token_from_email(client=client, email=email, db=db)
+    r = client.get(f"{settings.API_V1_STR}/api/access/serp-api", headers=headers)
+    assert r.status_code == 200
+    assert r.json()["has_access"] is False
+
+    user = crud.get_user_by_email(session=db, email=email)
+    assert user
+    customer_id = f"cus_{random_lower_string()}"
+    user.stripe_customer_id = customer_id
+    db.add(user)
+    subscription = {
+        "id": f"sub_{random_lower_string()}",
+        "customer": customer_id,
+        "status": "active",
+        "created": 1700000000,
+        "plan": {"id": "price_serp", "nickname": "SERP", "product": "prod_serp"},
+    }
+    product = {"id": "prod_serp", "name": "SERP", "metadata": {"serp-api": "true"}}
+    upsert_entitlement(db, user.id, subscription, product)
+    db.commit()
+
+    r = client.get(f"{settings.API_V1_STR}/api/access/serp-api", headers=headers)
+    assert r.json()["has_access"] is True
+    r = client.get(f"{settings.API_V1_STR}/proxy-api/access", headers=headers)
+    assert r.json()["has_access"] is False
+    r = client.get(f"{settings.API_V1_STR}/subscription-status", headers=headers)
+    assert r.json() == {"hasSubscription": True, "isTrial": False, "isDeactivated": False}
+    r = client.get(f"{settings.API_V1_STR}/customer/subscriptions", headers=headers)
+    assert [s["enabled_features"] for s in r.json()] == [["serp-api"]]
+
+
+def test_serp_api_access_messages(client: TestClient, db: Session) -> None:
+    email = random_email()
+    headers = authentication_token_from_email(client=client, email=email, db=db)
+    r = client.get(f"{settings.API_V1_STR}/serp-api/access", headers=headers)
+    assert r.json() == {
+        "has_access": False,
+        "message": "No subscription found. Please subscribe to a plan with SERP API features.",
+    }
+
+    user = crud.get_user_by_email(session=db, email=email)
+    assert user
+    customer_id = f"cus_{random_lower_string()}"
+    user.stripe_customer_id = customer_id
+    db.add(user)
+    db.commit()
+    r = client.get(f"{settings.API_V1_STR}/serp-api/access", headers=headers)
+    assert r.json() == {
+        "has_access": False,
+        "message": "Your current subscription plan does not include SERP API access. Please upgrade your plan.",
+    }
+
+    subscription = {
+        "id": f"sub_{random_lower_string()}",
+        "customer": customer_id,
+        "status": "past_due",
+        "created": 1700000000,
+        "plan": {"id": "price_serp", "nickname": "SERP", "product": "prod_serp"},
+    }
+    product = {"id": "prod_serp", "name": "SERP", "metadata": {"serp-api": "true"}}
+    upsert_entitlement(db, user.id, subscription, product)
+    db.commit()
+    entitlement_cache.invalidate(user.id)
+    r = client.get(f"{settings.API_V1_STR}/serp-api/access", headers=headers)
+    assert r.json() == {"has_access": True, "message": "Access granted to SERP API features."}
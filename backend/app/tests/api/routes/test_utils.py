@@ -0,0 +1,19 @@
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+
+
+def test_metrics_requires_superuser(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    superuser_token_headers: dict[str, str],
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/metrics", headers=normal_user_token_headers
+    )
+    assert r.status_code == 403
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/metrics", headers=superuser_token_headers
+    )
+    assert r.status_code == 200
+    assert "proxy_circuit_transitions_total" in r.text
@@ -4,10 +4,17 @@ import pytest
 from fastapi.testclient import TestClient
 from sqlmodel import Session, delete
 
+from app.api.routes.proxy import APIToken
 from app.core.config import settings
 from app.core.db import engine, init_db
 from app.main import app
-from app.models import Item, User
+from app.models import (
+    Item,
+    StripeReconciliationRun,
+    SubscriptionResyncJob,
+    User,
+    WebhookEvent,
+)
 from app.tests.utils.user import authentication_token_from_email
 from app.tests.utils.utils import get_superuser_token_headers
 
@@ -19,6 +26,10 @@ def db() -> Generator[Session, None, None]:
         yield session
         statement = delete(Item)
         session.execute(statement)
+        for model in (WebhookEvent, SubscriptionResyncJob, StripeReconciliationRun):
+            session.execute(delete(model))
+        statement = delete(APIToken)
+        session.execute(statement)
         statement = delete(User)
         session.execute(statement)
         session.commit()
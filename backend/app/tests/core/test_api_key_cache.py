@@ -0,0 +1,47 @@
+import uuid
+
+from app.core.api_key_cache import APIKeyCache
+from app.models import User
+
+
+def make_user() -> User:
+    return User(id=uuid.uuid4(), email=f"{uuid.uuid4().hex}@example.com", hashed_password="x")
+
+
+def test_entries_expire_after_ttl() -> None:
+    now = [0.0]
+    cache = APIKeyCache(ttl=60, max_entries=10, clock=lambda: now[0])
+    user = make_user()
+    token_id = uuid.uuid4()
+    cache.set("key", user, token_id)
+    entry = cache.get("key")
+    assert entry is not None
+    assert entry.token_id == token_id
+    assert entry.user.email == user.email
+    assert entry.user is not user
+    now[0] = 61.0
+    assert cache.get("key") is None
+    assert len(cache) == 0
+
+
+def test_invalidate_user_drops_all_their_keys() -> None:
+    cache = APIKeyCache(ttl=60, max_entries=10)
+    user, other = make_user(), make_user()
+    cache.set("a", user, uuid.uuid4())
+    cache.set("b", user, uuid.uuid4())
+    other_token_id = uuid.uuid4()
+    cache.set("c", other, other_token_id)
+    cache.invalidate_user(user.id)
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    cache.invalidate_token(other_token_id)
+    assert len(cache) == 0
+
+
+def test_oldest_entries_are_evicted_beyond_max_entries() -> None:
+    cache = APIKeyCache(ttl=60, max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.set(key, make_user(), uuid.uuid4())
+    assert cache.get("a") is None
+    assert len(cache) == 2
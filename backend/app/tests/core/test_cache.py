@@ -0,0 +1,64 @@
+import asyncio
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from app.core.cache import CacheEntry, DiskCache, LRUCache, TieredCache
+
+
+def test_lru_evicts_least_recently_used_by_size() -> None:
+    cache = LRUCache(max_bytes=10)
+    cache.set("a", CacheEntry(b"aaaa", time.time()))
+    cache.set("b", CacheEntry(b"bbbb", time.time()))
+    assert cache.get("a") is not None  # "b" is now least recently used
+    cache.set("c", CacheEntry(b"cccc", time.time()))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.size_bytes == 8
+    cache.set("huge", CacheEntry(b"x" * 11, time.time()))
+    assert cache.get("huge") is None
+
+
+def test_tiered_cache_respects_max_age() -> None:
+    cache = TieredCache("test", max_bytes=1024)
+
+    async def run() -> tuple[bytes | None, bytes | None]:
+        await cache.set("k", b"value")
+        cache.memory.get("k").stored_at -= 60  # type: ignore[union-attr]
+        return await cache.get("k", max_age=120), await cache.get("k", max_age=30)
+
+    fresh, stale = asyncio.run(run())
+    assert fresh == b"value"
+    assert stale is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_disk_tier_survives_memory_clear(tmp_path: Path) -> None:
+    cache = TieredCache("test", max_bytes=1024, disk_dir=str(tmp_path), disk_max_age=60)
+
+    async def run() -> bytes | None:
+        await cache.set("k", b"value" * 100)
+        cache.clear()
+        return await cache.get("k", max_age=60)
+
+    assert asyncio.run(run()) == b"value" * 100
+    assert len(list(tmp_path.glob("*.z"))) == 1
+
+
+def test_disk_tier_drops_corrupt_entries(tmp_path: Path) -> None:
+    disk = DiskCache(str(tmp_path), max_age=60)
+    (tmp_path / "bad.z").write_bytes(b"x")
+    assert disk.get("bad") is None
+    assert not (tmp_path / "bad.z").exists()
+
+
+def test_disk_tier_removes_temp_file_when_write_fails(tmp_path: Path) -> None:
+    disk = DiskCache(str(tmp_path), max_age=60)
+    with (
+        patch("app.core.cache.os.replace", side_effect=OSError("disk full")),
+        pytest.raises(OSError),
+    ):
+        disk.set("k", CacheEntry(value=b"value", stored_at=time.time()))
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,70 @@
+from app.core.circuit_breaker import CircuitBreaker, CircuitState
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_opens_after_consecutive_failures() -> None:
+    breaker = CircuitBreaker("ep", failure_threshold=3, clock=FakeClock())
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow_request()
+
+
+def test_opens_on_error_rate() -> None:
+    breaker = CircuitBreaker(
+        "ep", failure_threshold=100, error_rate_threshold=0.5, min_requests=4
+    )
+    for ok in (True, False, True, False):
+        breaker.record_success() if ok else breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_half_open_lets_a_trickle_through() -> None:
+    clock = FakeClock()
+    transitions: list[tuple[CircuitState, CircuitState]] = []
+    breaker = CircuitBreaker(
+        "ep",
+        failure_threshold=1,
+        open_duration=10,
+        half_open_max_calls=1,
+        clock=clock,
+        on_transition=lambda _, old, new: transitions.append((old, new)),
+    )
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert breaker.acquire()
+    assert not breaker.acquire()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+
+    clock.now = 20
+    assert breaker.acquire()
+    breaker.record_success()
+    assert breaker.state == CircuitState.CLOSED
+    assert transitions == [
+        (CircuitState.CLOSED, CircuitState.OPEN),
+        (CircuitState.OPEN, CircuitState.HALF_OPEN),
+        (CircuitState.HALF_OPEN, CircuitState.OPEN),
+        (CircuitState.OPEN, CircuitState.HALF_OPEN),
+        (CircuitState.HALF_OPEN, CircuitState.CLOSED),
+    ]
+
+
+def test_release_frees_half_open_slot() -> None:
+    clock = FakeClock()
+    breaker = CircuitBreaker("ep", failure_threshold=1, open_duration=1, clock=clock)
+    breaker.record_failure()
+    clock.now = 1
+    assert breaker.acquire()
+    breaker.release()
+    assert breaker.acquire()
@@ -0,0 +1,101 @@
+import asyncio
+
+from sqlmodel import Session
+
+from app.core.db import async_engine
+from app.core.entitlements import (
+    EntitlementCache,
+    cancel_customer_entitlements,
+    enabled_features,
+    get_plan_limits,
+    has_feature,
+    upsert_entitlement,
+)
+from app.tests.utils.user import create_random_user
+from app.tests.utils.utils import random_lower_string
+
+
+def make_subscription(customer_id: str, status: str = "active", created: int = 1700000000) -> dict:
+    return {
+        "id": f"sub_{random_lower_string()}",
+        "customer": customer_id,
+        "status": status,
+        "created": created,
+        "plan": {"id": "price_pro", "nickname": "Pro", "product": "prod_pro"},
+        "current_period_start": created,
+        "current_period_end": created + 30 * 86400,
+        "cancel_at_period_end": False,
+    }
+
+
+PRODUCT = {
+    "id": "prod_pro",
+    "name": "Pro",
+    "metadata": {"proxy-api": "true", "serp-api": "false", "rate-limit-key-burst": "5"},
+}
+
+
+def test_enabled_features() -> None:
+    assert enabled_features(PRODUCT["metadata"]) == ["proxy-api"]
+    assert enabled_features(None) == []
+
+
+def test_upsert_entitlement_and_cache(db: Session) -> None:
+    user = create_random_user(db)
+    customer_id = f"cus_{random_lower_string()}"
+    subscription = make_subscription(customer_id, status="trialing")
+    upsert_entitlement(db, user.id, subscription, PRODUCT)
+    db.commit()
+
+    cache = EntitlementCache(ttl=60)
+
+    async def run() -> tuple:
+        try:
+            first = await cache.get(user.id)
+            # Updating the same subscription replaces the row
+            upsert_entitlement(db, user.id, {**subscription, "status": "active"}, PRODUCT)
+            older = make_subscription(customer_id, status="canceled", created=1600000000)
+            upsert_entitlement(db, user.id, older, None)
+            db.commit()
+            cached = await cache.get(user.id)
+            cache.invalidate(user.id)
+            reloaded = await cache.get(user.id)
+            return first, cached, reloaded
+        finally:
+            await async_engine.dispose()
+
+    first, cached, reloaded = asyncio.run(run())
+    assert [e.status for e in first] == ["trialing"]
+    assert first[0].features == ["proxy-api"]
+    assert first[0].plan_name == "Pro"
+    assert cached is first
+    assert [e.status for e in reloaded] == ["active", "canceled"]
+    assert reloaded[1].product_metadata == {}
+    assert has_feature(reloaded, "proxy-api")
+    assert not has_feature(reloaded, "serp-api")
+
+    cancel_customer_entitlements(db, customer_id)
+    db.commit()
+    cache.invalidate(user.id)
+
+    async def reload() -> list:
+        try:
+            return await cache.get(user.id)
+        finally:
+            await async_engine.dispose()
+
+    assert not has_feature(asyncio.run(reload()), "proxy-api")
+
+
+def test_plan_limits_come_from_active_entitlements(db: Session) -> None:
+    user = create_random_user(db)
+    upsert_entitlement(db, user.id, make_subscription(f"cus_{random_lower_string()}"), PRODUCT)
+    db.commit()
+
+    async def run():
+        try:
+            return await get_plan_limits(user.id)
+        finally:
+            await async_engine.dispose()
+
+    assert asyncio.run(run()).key_burst == 5
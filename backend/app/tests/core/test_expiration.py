@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app.core.expiration import expire_subscriptions
+from app.tests.utils.user import create_random_user
+
+
+def test_expire_subscriptions_in_batches(db: Session) -> None:
+    now = datetime.utcnow()
+    expired = [create_random_user(db) for _ in range(3)]
+    current = create_random_user(db)
+    for user in expired:
+        user.has_subscription = True
+        user.expiry_date = now - timedelta(days=1)
+        db.add(user)
+    current.has_subscription = True
+    current.expiry_date = now + timedelta(days=1)
+    db.add(current)
+    db.commit()
+
+    assert expire_subscriptions(batch_size=2, max_batches=1) == 2
+    assert expire_subscriptions(batch_size=2) >= 1
+    for user in [*expired, current]:
+        db.refresh(user)
+    assert [u.has_subscription for u in expired] == [False, False, False]
+    assert all(u.expiry_date is None for u in expired)
+    assert current.has_subscription
+    assert current.expiry_date is not None
+
+
+def test_sweep_query_uses_partial_index(db: Session) -> None:
+    db.execute(text("SET LOCAL enable_seqscan = off"))
+    plan = db.execute(
+        text(
+            'EXPLAIN SELECT id FROM "user" WHERE has_subscription AND expiry_date < now() '
+            "ORDER BY expiry_date LIMIT 1000"
+        )
+    ).scalars().all()
+    db.rollback()
+    assert any("ix_user_expiry_date_subscribed" in line for line in plan)
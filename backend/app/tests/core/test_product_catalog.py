@@ -0,0 +1,96 @@
+import uuid
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+from sqlmodel import Session
+
+from app.core.product_catalog import ProductCatalog
+from app.models import WebhookEvent
+
+
+def listing(*objects: dict) -> MagicMock:
+    result = MagicMock()
+    result.auto_paging_iter.return_value = iter(objects)
+    return result
+
+
+PRODUCT = {"id": "prod_pro", "name": "Pro", "metadata": {"proxy-api": "true"}, "updated": 100}
+PRICE = {"id": "price_pro", "product": "prod_pro", "nickname": "Monthly", "unit_amount": 1000, "currency": "usd", "recurring": {"interval": "month"}}
+
+
+def test_load_then_lookups_need_no_stripe_calls() -> None:
+    catalog = ProductCatalog()
+    with (
+        patch("stripe.Product.list", return_value=listing(PRODUCT)),
+        patch("stripe.Price.list", return_value=listing(PRICE)),
+        patch("stripe.Product.retrieve") as retrieve,
+    ):
+        catalog.load()
+        product = catalog.get_product("prod_pro")
+    retrieve.assert_not_called()
+    assert product is not None and product["metadata"] == {"proxy-api": "true"}
+
+
+def test_unknown_product_is_fetched_once() -> None:
+    catalog = ProductCatalog()
+    with patch("stripe.Product.retrieve", return_value=PRODUCT) as retrieve:
+        assert catalog.get_product("prod_pro")["name"] == "Pro"  # type: ignore[index]
+        assert catalog.get_product("prod_pro")["name"] == "Pro"  # type: ignore[index]
+    retrieve.assert_called_once_with("prod_pro")
+
+
+def test_webhook_updates_win_over_older_copies() -> None:
+    catalog = ProductCatalog()
+    catalog.set_product({**PRODUCT, "metadata": {"serp-api": "true"}, "updated": 200})
+    # A stale copy, e.g. from a listing that started before the webhook
+    catalog.set_product(PRODUCT)
+    assert catalog.get_product("prod_pro")["metadata"] == {"serp-api": "true"}  # type: ignore[index]
+    with (
+        patch("stripe.Product.list", return_value=listing(PRODUCT)),
+        patch("stripe.Price.list", return_value=listing()),
+    ):
+        catalog.load()
+    assert catalog.get_product("prod_pro")["metadata"] == {"serp-api": "true"}  # type: ignore[index]
+
+
+def test_events_older_than_the_last_applied_are_skipped() -> None:
+    catalog = ProductCatalog()
+    assert catalog.apply_event("price.created", {**PRICE, "nickname": "Yearly"}, created=200)
+    assert not catalog.apply_event("price.created", PRICE, created=100)
+    assert not catalog.apply_event("price.created", PRICE, created=200)
+    assert catalog._prices["price_pro"]["nickname"] == "Yearly"
+    assert catalog.apply_event("product.updated", PRODUCT, created=100)
+
+
+def test_catalog_events_drained_by_other_workers_are_replayed(db: Session) -> None:
+    catalog = ProductCatalog()
+    product_id = f"prod_{uuid.uuid4().hex}"
+    catalog.set_product({**PRODUCT, "id": product_id})
+    updated = {**PRODUCT, "id": product_id, "metadata": {"serp-api": "true"}, "updated": 200}
+    events = [
+        WebhookEvent(
+            id=f"evt_{uuid.uuid4().hex}",
+            type=event_type,
+            created=1,
+            payload={"type": event_type, "data": {"object": obj}},
+            processed_at=processed_at,
+        )
+        for event_type, obj, processed_at in [
+            ("product.updated", updated, datetime.utcnow()),
+            # Not processed yet, so another worker may still fail it
+            ("product.updated", {**updated, "name": "Pending", "updated": 300}, None),
+        ]
+    ]
+    db.add_all(events)
+    db.commit()
+
+    assert catalog.apply_events() >= 1
+    # The overlap reads the event again, but it is not applied twice
+    assert catalog.apply_events() == 0
+    product = catalog.get_product(product_id)
+    assert product is not None
+    assert product["metadata"] == {"serp-api": "true"}
+    assert product["name"] == "Pro"
+    for event in events:
+        db.delete(event)
+    db.commit()
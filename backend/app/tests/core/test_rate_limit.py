@@ -0,0 +1,134 @@
+import asyncio
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.core.config import settings
+from app.core.rate_limit import (
+    MemoryRateLimitBackend,
+    PlanLimits,
+    PostgresRateLimitBackend,
+    RateLimitBackend,
+    RateLimiter,
+    seconds_until_next_period,
+)
+
+
+def test_plan_limits_from_metadata() -> None:
+    limits = PlanLimits.from_metadata(
+        {"rate-limit-key-per-second": "2.5", "monthly-quota": "1000", "rate-limit-user-burst": "nope", "proxy-api": "true"}
+    )
+    assert limits.key_rate == 2.5
+    assert limits.monthly_quota == 1000
+    assert limits.user_burst == settings.RATE_LIMIT_USER_BURST
+
+
+def test_seconds_until_next_period_rolls_over_year() -> None:
+    now = datetime(2026, 12, 31, 23, 59, 0, tzinfo=timezone.utc)
+    assert seconds_until_next_period(now) == 60
+
+
+def run_limiter(backend: RateLimitBackend) -> list[tuple[bool, str | None]]:
+    now = [1000.0]
+    limiter = RateLimiter(backend, clock=lambda: now[0])
+    limits = PlanLimits(key_rate=1.0, key_burst=2, user_rate=10.0, user_burst=10, monthly_quota=3)
+    token_id, user_id = uuid.uuid4(), uuid.uuid4()
+
+    async def run() -> list[tuple[bool, str | None]]:
+        results = []
+        for step in (0, 0, 0, 1, 0, 10):
+            now[0] += step
+            decision = await limiter.check(token_id, user_id, limits)
+            results.append((decision.allowed, decision.limit))
+        return results
+
+    return asyncio.run(run())
+
+
+EXPECTED = [
+    (True, None),
+    (True, None),
+    (False, "key"),  # burst of 2 used up
+    (True, None),  # one token refilled after a second
+    (False, "key"),
+    (False, "quota"),  # 3 calls were admitted this month
+]
+
+
+def test_memory_backend_bucket_and_quota() -> None:
+    assert run_limiter(MemoryRateLimitBackend()) == EXPECTED
+
+
+def test_postgres_backend_bucket_and_quota() -> None:
+    engine = create_async_engine(str(settings.SQLALCHEMY_DATABASE_URI))
+    backend = PostgresRateLimitBackend(engine)
+
+    async def cleanup() -> None:
+        await backend.prune(float("inf"), "9999-99")
+        await engine.dispose()
+
+    try:
+        assert run_limiter(backend) == EXPECTED
+    finally:
+        asyncio.run(cleanup())
+
+
+def run_rejected_by_user(backend: RateLimitBackend) -> tuple[bool, str | None, float]:
+    limiter = RateLimiter(backend, clock=lambda: 1000.0)
+    limits = PlanLimits(key_rate=1.0, key_burst=5, user_rate=1.0, user_burst=1, monthly_quota=None)
+    token_id, other_token_id, user_id = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+
+    async def run() -> tuple[bool, str | None, float]:
+        await limiter.check(other_token_id, user_id, limits)  # uses up the user's burst
+        decision = await limiter.check(token_id, user_id, limits)
+        _, tokens = await backend.take(f"key:{token_id}", 1.0, 5, 1000.0)
+        return decision.allowed, decision.limit, tokens
+
+    return asyncio.run(run())
+
+
+def test_rejection_by_user_bucket_leaves_key_bucket_alone() -> None:
+    # 5 tokens before the rejected call, so one take leaves 4
+    assert run_rejected_by_user(MemoryRateLimitBackend()) == (False, "user", 4.0)
+
+    engine = create_async_engine(str(settings.SQLALCHEMY_DATABASE_URI))
+    backend = PostgresRateLimitBackend(engine)
+
+    async def cleanup() -> None:
+        await backend.prune(float("inf"), "9999-99")
+        await engine.dispose()
+
+    try:
+        assert run_rejected_by_user(backend) == (False, "user", 4.0)
+    finally:
+        asyncio.run(cleanup())
+
+
+def test_prune_drops_idle_buckets_and_old_periods() -> None:
+    backend = MemoryRateLimitBackend()
+
+    async def run() -> tuple[float, bool]:
+        await backend.take("a", rate=1.0, burst=5, now=0.0)
+        await backend.take("b", rate=1.0, burst=5, now=100.0)
+        await backend.add_usage("u", "2026-09", 1, limit=10)
+        await backend.add_usage("u", "2026-10", 1, limit=10)
+        await backend.prune(idle_before=50.0, period_before="2026-10")
+        return len(backend._buckets), ("u", "2026-09") in backend._usage
+
+    assert asyncio.run(run()) == (1, False)
+
+
+def test_rejection_headers() -> None:
+    limiter = RateLimiter(MemoryRateLimitBackend(), clock=lambda: 0.0)
+    limits = PlanLimits(key_rate=0.5, key_burst=1, user_rate=10.0, user_burst=10)
+    token_id, user_id = uuid.uuid4(), uuid.uuid4()
+
+    async def run() -> dict[str, str]:
+        await limiter.check(token_id, user_id, limits)
+        return (await limiter.check(token_id, user_id, limits)).headers
+
+    headers = asyncio.run(run())
+    assert headers["Retry-After"] == "2"
+    assert headers["X-RateLimit-Limit"] == "1"
+    assert headers["X-RateLimit-Remaining"] == "0"
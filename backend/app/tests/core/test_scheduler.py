@@ -0,0 +1,22 @@
+import asyncio
+
+from app.core.scheduler import Scheduler
+
+
+def test_job_keeps_running_after_failure() -> None:
+    calls: list[int] = []
+
+    async def flaky() -> None:
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+
+    async def run() -> None:
+        scheduler = Scheduler()
+        scheduler.add_job("flaky", 0.01, flaky)
+        scheduler.start()
+        await asyncio.sleep(0.1)
+        await scheduler.shutdown()
+
+    asyncio.run(run())
+    assert len(calls) >= 2
@@ -0,0 +1,100 @@
+import asyncio
+
+from app.core.serp_cache import SerpCache
+from app.core.serp_parser import SerpResponse, SerpResult
+
+
+def make_loader(calls: list[str], results: int = 1):
+    async def load() -> SerpResponse:
+        calls.append("load")
+        return SerpResponse(
+            search_engine="google",
+            search_query="q",
+            region_used="us-east",
+            organic_results=[
+                SerpResult(position=i, title=f"t{len(calls)}", link="https://x", snippet="")
+                for i in range(1, results + 1)
+            ],
+        )
+
+    return load
+
+
+def test_normalized_queries_share_an_entry() -> None:
+    cache = SerpCache(max_bytes=1 << 20, ttl={}, default_ttl=60, stale_ttl=60)
+    calls: list[str] = []
+
+    async def run() -> list[tuple[SerpResponse, str]]:
+        return [
+            await cache.get("Python  asyncio", "google", "us-east", make_loader(calls)),
+            await cache.get(" python asyncio ", "google", "us-east", make_loader(calls)),
+            await cache.get("python asyncio", "bing", "us-east", make_loader(calls)),
+        ]
+
+    (first, s1), (second, s2), (_, s3) = asyncio.run(run())
+    assert (s1, s2, s3) == ("MISS", "HIT", "MISS")
+    assert second.search_query == " python asyncio "
+    assert second.organic_results == first.organic_results
+    assert len(calls) == 2
+
+
+def test_coalesced_misses_keep_their_own_query() -> None:
+    cache = SerpCache(max_bytes=1 << 20, ttl={}, default_ttl=60, stale_ttl=60)
+    calls: list[str] = []
+
+    async def run() -> list[tuple[SerpResponse, str]]:
+        return await asyncio.gather(
+            cache.get("Python asyncio", "google", "us-east", make_loader(calls)),
+            cache.get("python  ASYNCIO", "google", "us-east", make_loader(calls)),
+        )
+
+    (first, s1), (second, s2) = asyncio.run(run())
+    assert (s1, s2) == ("MISS", "MISS")
+    assert len(calls) == 1
+    assert (first.search_query, second.search_query) == ("Python asyncio", "python  ASYNCIO")
+    assert first.organic_results == second.organic_results
+
+
+def test_stale_entry_is_served_and_refreshed_in_background() -> None:
+    cache = SerpCache(max_bytes=1 << 20, ttl={"google": 10}, default_ttl=1000, stale_ttl=60)
+    calls: list[str] = []
+
+    async def run() -> list[str]:
+        statuses = []
+        _, status = await cache.get("q", "google", "us-east", make_loader(calls))
+        statuses.append(status)
+        cache.memory.get(cache.key("q", "google", "us-east")).stored_at -= 30  # type: ignore[union-attr]
+        stale, status = await cache.get("q", "google", "us-east", make_loader(calls))
+        assert stale.organic_results[0].title == "t1"
+        statuses.append(status)
+        await asyncio.sleep(0.01)  # let the refresh run
+        fresh, status = await cache.get("q", "google", "us-east", make_loader(calls))
+        assert fresh.organic_results[0].title == "t2"
+        statuses.append(status)
+        # Past the stale window the entry is reloaded inline
+        cache.memory.get(cache.key("q", "google", "us-east")).stored_at -= 100  # type: ignore[union-attr]
+        _, status = await cache.get("q", "google", "us-east", make_loader(calls))
+        statuses.append(status)
+        return statuses
+
+    assert asyncio.run(run()) == ["MISS", "STALE", "HIT", "MISS"]
+    assert len(calls) == 3
+
+
+def test_empty_results_are_not_cached_and_purge_filters() -> None:
+    cache = SerpCache(max_bytes=1 << 20, ttl={}, default_ttl=60, stale_ttl=0)
+    calls: list[str] = []
+
+    async def run() -> None:
+        await cache.get("nothing", "google", "us-east", make_loader(calls, results=0))
+        for engine in ("google", "bing"):
+            for region in ("us-east", "eu-west"):
+                await cache.get("q", engine, region, make_loader(calls))
+
+    asyncio.run(run())
+    assert len(cache.memory) == 4
+    assert cache.purge(engine="BING") == 2
+    assert cache.purge(q=" Q", region="us-east") == 1
+    assert cache.memory.keys() == [cache.key("q", "google", "eu-west")]
+    assert cache.purge() == 1
+    assert cache.memory.size_bytes == 0
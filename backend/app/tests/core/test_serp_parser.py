@@ -0,0 +1,50 @@
+from pathlib import Path
+
+from app.core.serp_parser import SERP_PARSERS, parse_serp
+
+FIXTURES = Path(__file__).parent.parent / "fixtures" / "serp"
+
+
+def test_backends_agree_on_fixture_corpus() -> None:
+    fixtures = sorted(FIXTURES.glob("*.html"))
+    assert fixtures
+    for path in fixtures:
+        html = path.read_text(encoding="utf-8")
+        for engine in SERP_PARSERS["bs4"]:
+            expected = SERP_PARSERS["bs4"][engine](html)
+            assert SERP_PARSERS["lxml"][engine](html) == expected, f"{path.name} ({engine})"
+
+
+def test_google_results() -> None:
+    results = parse_serp("google", (FIXTURES / "google_basic.html").read_text())
+    assert results[0].link == "https://docs.python.org/3/library/asyncio.html"
+    assert results[0].title == "asyncio — Asynchronous I/O — Python 3.12 documentation"
+    # A result without a link keeps its position but is dropped
+    assert [r.position for r in results] == [1, 2, 3, 4, 5, 6, 7, 9, 10, 11, 12]
+    # An empty data-sncf block still wins over the .VwiC3b fallback
+    assert results[3].snippet == ""
+    assert "script" not in results[-1].snippet and "(n)" not in results[-1].snippet
+
+
+def test_bing_results() -> None:
+    results = parse_serp("bing", (FIXTURES / "bing_basic.html").read_text())
+    assert results[0].title == "References and Borrowing - The Rust Programming Language"
+    assert results[2].snippet == ""
+    assert [r.position for r in results] == [1, 2, 3, 6, 7, 8]
+
+
+def test_duckduckgo_redirects_are_decoded() -> None:
+    results = parse_serp("duckduckgo", (FIXTURES / "duckduckgo_basic.html").read_text())
+    assert results[0].link == "https://www.postgresql.org/docs/current/sql-select.html#SQL-FOR-UPDATE-SHARE"
+    assert results[1].snippet == "A queue table processed by many workers is the classic use case."
+    assert results[2].link == "https://news.ycombinator.com/item?id=20020501"
+    assert results[3].link == "https://example.org/café?q=a+b&lang=fr"
+    assert results[5].link == "//duckduckgo.com/l/uddg=missing-query-string"
+    assert results[6].link == ""
+
+
+def test_empty_documents() -> None:
+    for backend in SERP_PARSERS:
+        for engine in SERP_PARSERS[backend]:
+            assert parse_serp(engine, "", backend) == []
+            assert parse_serp(engine, "  \n", backend) == []
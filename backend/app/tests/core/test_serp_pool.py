@@ -0,0 +1,58 @@
+import asyncio
+from pathlib import Path
+
+from app.core.serp_parser import parse_serp
+from app.core.serp_pool import SerpParserPool, available_cores, serp_parse_queue_depth, serp_parses
+
+FIXTURES = Path(__file__).parent.parent / "fixtures" / "serp"
+
+
+def test_small_pages_and_closed_pool_parse_inline() -> None:
+    html = (FIXTURES / "bing_basic.html").read_text()
+    pool = SerpParserPool("lxml", workers=2, inline_max_chars=len(html) + 1)
+    before = serp_parses.value(engine="bing", mode="inline")
+
+    async def run() -> None:
+        # Not opened yet, so even large pages stay inline
+        assert await pool.parse("bing", html * 2) == parse_serp("bing", html * 2)
+        pool.open()
+        try:
+            assert await pool.parse("bing", html) == parse_serp("bing", html)
+        finally:
+            await pool.aclose()
+
+    asyncio.run(run())
+    assert serp_parses.value(engine="bing", mode="inline") == before + 2
+
+
+def test_large_pages_are_parsed_in_worker_processes() -> None:
+    html = (FIXTURES / "google_basic.html").read_text()
+    pool = SerpParserPool("lxml", workers=1, inline_max_chars=100)
+    before = serp_parses.value(engine="google", mode="pool")
+
+    async def run() -> list[list]:
+        pool.open()
+        try:
+            return await asyncio.gather(*(pool.parse("google", html) for _ in range(3)))
+        finally:
+            await pool.aclose()
+
+    results = asyncio.run(run())
+    assert all(r == parse_serp("google", html) for r in results)
+    assert serp_parses.value(engine="google", mode="pool") == before + 3
+    assert serp_parse_queue_depth.value() == 0
+
+
+def test_disabled_pool_parses_inline() -> None:
+    pool = SerpParserPool("bs4", workers=0, inline_max_chars=0)
+    pool.open()
+    html = (FIXTURES / "duckduckgo_basic.html").read_text()
+    assert asyncio.run(pool.parse("duckduckgo", html)) == parse_serp("duckduckgo", html, "bs4")
+
+
+def test_default_pool_size_shares_the_cores_between_app_workers() -> None:
+    cores = available_cores()
+    assert SerpParserPool("lxml", workers=None, inline_max_chars=0).workers == cores
+    assert SerpParserPool("lxml", workers=None, inline_max_chars=0, app_workers=cores * 2).workers == 1
+    assert SerpParserPool("lxml", workers=None, inline_max_chars=0, app_workers=2).workers == max(1, cores // 2)
+    assert SerpParserPool("lxml", workers=3, inline_max_chars=0, app_workers=8).workers == 3
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from app.core.singleflight import SingleFlight, deduplicated_requests
+
+
+def test_concurrent_calls_share_one_execution() -> None:
+    flights = SingleFlight("test-share")
+    calls: list[str] = []
+
+    async def fetch() -> str:
+        calls.append("fetch")
+        await asyncio.sleep(0.01)
+        return "page"
+
+    async def run() -> list[str]:
+        return await asyncio.gather(*(flights.do("k", fetch) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["page"] * 5
+    assert calls == ["fetch"]
+    assert deduplicated_requests.value(group="test-share") == 4
+    assert len(flights) == 0
+
+
+def test_exception_reaches_every_caller_and_is_not_kept() -> None:
+    flights = SingleFlight("test-error")
+    calls: list[int] = []
+
+    async def fail() -> str:
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def run() -> list[object]:
+        first = await asyncio.gather(
+            flights.do("k", fail), flights.do("k", fail), return_exceptions=True
+        )
+        second = await asyncio.gather(flights.do("k", fail), return_exceptions=True)
+        return first + second
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert len(calls) == 2
+
+
+def test_cancelled_caller_does_not_cancel_shared_call() -> None:
+    flights = SingleFlight("test-cancel")
+
+    async def fetch() -> str:
+        await asyncio.sleep(0.02)
+        return "page"
+
+    async def run() -> str:
+        first = asyncio.create_task(flights.do("k", fetch))
+        second = asyncio.create_task(flights.do("k", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == "page"
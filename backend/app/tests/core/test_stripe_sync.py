@@ -0,0 +1,280 @@
+import uuid
+from datetime import datetime, timedelta
+from typing import Any
+from unittest.mock import MagicMock, patch
+
+from sqlmodel import Session, select
+
+from app.core.db import advisory_lock, engine
+from app.core.entitlements import upsert_entitlement
+from app.core.stripe_sync import (
+    StripeReconciler,
+    SubscriptionResync,
+    apply_subscriptions,
+    backfill_entitlements,
+    needs_entitlement_backfill,
+)
+from app.models import Entitlement, StripeReconciliationRun, SubscriptionResyncJob
+from app.tests.utils.user import create_random_user
+
+
+def listing(objects: list[dict]) -> MagicMock:
+    result = MagicMock()
+    result.auto_paging_iter.return_value = iter(objects)
+    return result
+
+
+PRODUCT_ID = f"prod_{uuid.uuid4().hex}"
+PRODUCT = {"id": PRODUCT_ID, "name": "Pro", "metadata": {"serp-api": "true"}, "updated": 1}
+
+
+def make_subscription(customer_id: str, price_id: str, status: str = "active") -> dict:
+    return {
+        "id": f"sub_{uuid.uuid4().hex}",
+        "customer": customer_id,
+        "status": status,
+        "created": 1700000000,
+        "plan": {"id": price_id, "nickname": "Pro", "product": PRODUCT_ID},
+    }
+
+
+def test_resync_applies_changes_and_resumes_after_failure(db: Session) -> None:
+    users = [create_random_user(db) for _ in range(3)]
+    for user in users:
+        user.stripe_customer_id = f"cus_{uuid.uuid4().hex}"
+        db.add(user)
+    db.commit()
+    subs = {
+        "price_a": [make_subscription(users[0].stripe_customer_id, "price_a"),  # type: ignore[arg-type]
+                    make_subscription(users[1].stripe_customer_id, "price_a", "trialing")],  # type: ignore[arg-type]
+        "price_b": [make_subscription(users[2].stripe_customer_id, "price_b"),  # type: ignore[arg-type]
+                    make_subscription(f"cus_{uuid.uuid4().hex}", "price_b")],
+    }
+    # Already up to date; must not count as a change
+    upsert_entitlement(db, users[0].id, subs["price_a"][0], PRODUCT)
+    users[0].has_subscription = True
+    db.add(users[0])
+    db.commit()
+
+    fail = [True]
+    calls: list[dict[str, Any]] = []
+
+    def list_subscriptions(**params: Any) -> MagicMock:
+        calls.append(params)
+        if params["price"] == "price_b" and fail[0]:
+            raise RuntimeError("Stripe unavailable")
+        page = subs[params["price"]]
+        if "starting_after" in params:
+            ids = [s["id"] for s in page]
+            page = page[ids.index(params["starting_after"]) + 1 :]
+        return listing(page)
+
+    resync = SubscriptionResync(page_size=1)
+    resync.enqueue(db, PRODUCT_ID)
+    db.commit()
+    with (
+        patch("stripe.Product.retrieve", return_value=PRODUCT),
+        patch("stripe.Price.list", side_effect=lambda **_: listing([{"id": "price_b"}, {"id": "price_a"}])),
+        patch("stripe.Subscription.list", side_effect=list_subscriptions),
+    ):
+        assert resync.process_pending() == 1
+        job = db.exec(select(SubscriptionResyncJob).where(SubscriptionResyncJob.product_id == PRODUCT_ID)).one()
+        assert job.status == "running"
+        assert (job.cursor_price, job.cursor_subscription) == ("price_a", subs["price_a"][1]["id"])
+        assert (job.processed, job.changed) == (2, 1)
+        assert job.error == "Stripe unavailable"
+
+        # Leased until it expires, then resumed from the cursor
+        assert resync.process_pending() == 0
+        job.locked_until = datetime.utcnow()
+        db.add(job)
+        db.commit()
+        fail[0] = False
+        calls.clear()
+        assert resync.process_pending() == 1
+
+    assert calls[0] == {"price": "price_a", "status": "all", "limit": 1, "starting_after": subs["price_a"][1]["id"]}
+    db.refresh(job)
+    assert job.status == "done"
+    assert (job.processed, job.changed) == (4, 2)
+    for user in users:
+        db.refresh(user)
+    assert [u.has_subscription for u in users] == [True, True, True]
+    assert [u.is_trial for u in users] == [False, True, False]
+    entitlements = db.exec(select(Entitlement).where(Entitlement.product_id == PRODUCT_ID)).all()
+    assert len(entitlements) == 3
+    assert all(e.features == ["serp-api"] for e in entitlements)
+
+
+def test_resync_flags_follow_the_newest_subscription_of_any_product(db: Session) -> None:
+    user = create_random_user(db)
+    user.stripe_customer_id = f"cus_{uuid.uuid4().hex}"
+    user.has_subscription = True
+    db.add(user)
+    db.commit()
+    # Active on another product, which this resync does not list
+    other = make_subscription(user.stripe_customer_id, "price_other")
+    other["created"] = 1700000100
+    upsert_entitlement(db, user.id, other, {**PRODUCT, "id": f"prod_{uuid.uuid4().hex}"})
+    db.commit()
+    # Listed newest first with status=all: this product's active subscription, then an older canceled one
+    older = make_subscription(user.stripe_customer_id, "price_a", "canceled")
+    older["created"] = 1600000000
+    page = [make_subscription(user.stripe_customer_id, "price_a", "past_due"), older]
+    page[0]["created"] = 1650000000
+
+    with Session(engine) as session:
+        apply_subscriptions(session, page, job="product_resync")
+        session.commit()
+    db.refresh(user)
+    assert (user.has_subscription, user.is_deactivated) == (True, False)
+
+
+def test_resync_keeps_unexpired_local_grants(db: Session) -> None:
+    user = create_random_user(db)
+    user.stripe_customer_id = f"cus_{uuid.uuid4().hex}"
+    user.has_subscription = user.is_trial = True
+    user.expiry_date = datetime.utcnow() + timedelta(days=30)
+    db.add(user)
+    db.commit()
+    page = [make_subscription(user.stripe_customer_id, "price_a", "canceled")]
+
+    with Session(engine) as session:
+        apply_subscriptions(session, page, job="product_resync")
+        session.commit()
+    db.refresh(user)
+    assert (user.has_subscription, user.is_trial, user.is_deactivated) == (True, True, False)
+
+    # Once the grant has expired, Stripe's state applies again
+    user.expiry_date = datetime.utcnow() - timedelta(minutes=1)
+    db.add(user)
+    db.commit()
+    with Session(engine) as session:
+        apply_subscriptions(session, page, job="product_resync")
+        session.commit()
+    db.refresh(user)
+    assert (user.has_subscription, user.is_trial, user.is_deactivated) == (False, False, True)
+
+
+def test_backfill_writes_entitlements_of_existing_subscribers(db: Session) -> None:
+    user = create_random_user(db)
+    user.stripe_customer_id = f"cus_{uuid.uuid4().hex}"
+    user.has_subscription = True
+    db.add(user)
+    db.commit()
+    subscription = make_subscription(user.stripe_customer_id, "price_a")
+
+    with (
+        patch("stripe.Product.list", return_value=listing([PRODUCT])),
+        patch("stripe.Price.list", return_value=listing([])),
+        patch("stripe.Subscription.list", return_value=listing([subscription, make_subscription("cus_unknown", "price_a")])),
+    ):
+        assert backfill_entitlements(page_size=1) == 1
+    entitlement = db.get(Entitlement, subscription["id"])
+    assert entitlement is not None
+    assert (entitlement.user_id, entitlement.features) == (user.id, ["serp-api"])
+    # Existing rows mean the table was filled already
+    assert not needs_entitlement_backfill(db)
+
+
+def test_enqueue_supersedes_unfinished_job(db: Session) -> None:
+    resync = SubscriptionResync()
+    resync.enqueue(db, "prod_superseded")
+    db.commit()
+    resync.enqueue(db, "prod_superseded")
+    db.commit()
+    jobs = db.exec(
+        select(SubscriptionResyncJob)
+        .where(SubscriptionResyncJob.product_id == "prod_superseded")
+        .order_by(SubscriptionResyncJob.created_at)
+    ).all()
+    assert [j.status for j in jobs] == ["superseded", "pending"]
+    for job in jobs:
+        db.delete(job)
+    db.commit()
+
+
+def test_reconcile_corrects_drift(db: Session) -> None:
+    active, unlinked, lapsed, trial, granted = (create_random_user(db) for _ in range(5))
+    for user in (active, lapsed, trial, granted):
+        user.stripe_customer_id = f"cus_{uuid.uuid4().hex}"
+    lapsed.has_subscription = True
+    # Local 30-day trial; its customer has no subscription
+    trial.has_subscription = trial.is_trial = True
+    trial.expiry_date = datetime.utcnow() + timedelta(days=30)
+    # Admin grant running until an expiry date, over an old canceled subscription
+    granted.has_subscription = True
+    granted.expiry_date = datetime.utcnow() + timedelta(days=30)
+    for user in (active, lapsed, trial, granted):
+        db.add(user)
+    db.commit()
+    unlinked_customer = f"cus_{uuid.uuid4().hex}"
+    customers = [
+        {"id": active.stripe_customer_id, "email": active.email, "created": 1},
+        {"id": unlinked_customer, "email": unlinked.email.upper(), "created": 1},
+    ]
+    old = make_subscription(active.stripe_customer_id, "price_a", "canceled")  # type: ignore[arg-type]
+    old["created"] = 1600000000
+    subscriptions = [
+        old,
+        make_subscription(active.stripe_customer_id, "price_a"),  # type: ignore[arg-type]
+        make_subscription(unlinked_customer, "price_a", "trialing"),
+        make_subscription(lapsed.stripe_customer_id, "price_a", "canceled"),  # type: ignore[arg-type]
+        make_subscription(granted.stripe_customer_id, "price_a", "canceled"),  # type: ignore[arg-type]
+    ]
+
+    reconciler = StripeReconciler(interval=3600, page_size=2, batch_size=2)
+    with (
+        patch("stripe.Product.list", side_effect=lambda **_: listing([PRODUCT])),
+        patch("stripe.Price.list", side_effect=lambda **_: listing([])),
+        patch("stripe.Customer.list", side_effect=lambda **_: listing(customers)),
+        patch("stripe.Subscription.list", side_effect=lambda **_: listing(subscriptions)),
+    ):
+        report = reconciler.run_once(force=True)
+        # Not due again until the interval has passed
+        assert reconciler.run_once() is None
+
+    assert report is not None
+    assert report.customers == 2
+    assert report.subscriptions == 5
+    assert report.linked_customers == 1
+    assert f"{lapsed.email}: has_subscription True -> False" in report.examples
+    for user in (active, unlinked, lapsed, trial, granted):
+        db.refresh(user)
+    assert unlinked.stripe_customer_id == unlinked_customer
+    assert (active.has_subscription, active.is_trial) == (True, False)
+    assert (unlinked.has_subscription, unlinked.is_trial) == (True, True)
+    assert lapsed.has_subscription is False
+    assert (trial.has_subscription, trial.is_trial) == (True, True)
+    assert (granted.has_subscription, granted.is_deactivated) == (True, False)
+    entitlements = db.exec(select(Entitlement).where(Entitlement.user_id == active.id)).all()
+    assert len(entitlements) == 2
+    run = db.exec(select(StripeReconciliationRun).order_by(StripeReconciliationRun.started_at.desc())).first()
+    assert run is not None and run.finished_at is not None
+    assert run.report["linked_customers"] == 1
+
+
+def test_reconcile_runs_only_in_the_lock_holder() -> None:
+    reconciler = StripeReconciler(interval=0)
+    with advisory_lock(StripeReconciler.lock_name) as leader:
+        assert leader
+        with patch.object(reconciler, "reconcile") as reconcile:
+            assert reconciler.run_once(force=True) is None
+        reconcile.assert_not_called()
+
+
+def test_set_based_update_skips_rows_changed_meanwhile(db: Session) -> None:
+    user = create_random_user(db)
+    other = create_random_user(db)
+    reconciler = StripeReconciler(interval=3600)
+    rows = [
+        {"id": user.id, "has_subscription": True, "old_has_subscription": False},
+        # Read before a webhook set the flag; must not be overwritten
+        {"id": other.id, "has_subscription": True, "old_has_subscription": True},
+    ]
+    assert reconciler._update_users(db, rows, ("has_subscription",)) == 1
+    db.commit()
+    db.refresh(user)
+    db.refresh(other)
+    assert user.has_subscription is True
+    assert other.has_subscription is False
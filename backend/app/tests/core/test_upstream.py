@@ -0,0 +1,87 @@
+import asyncio
+import json
+from collections.abc import AsyncIterator
+
+import pytest
+
+from app.core.upstream import EnvelopeStream, UpstreamClients, UpstreamTooLarge, limit_bytes
+
+
+def test_clients_are_pooled_per_region() -> None:
+    clients = UpstreamClients()
+    east = clients.get("us-east")
+    assert clients.get("us-east") is east
+    assert clients.get("europe") is not east
+    asyncio.run(clients.aclose())
+    assert east.is_closed
+
+
+def test_closed_client_is_replaced() -> None:
+    clients = UpstreamClients()
+    clients.open(["asia"])
+    first = clients.get("asia")
+    asyncio.run(clients.aclose())
+    second = clients.get("asia")
+    assert second is not first
+    assert not second.is_closed
+    asyncio.run(clients.aclose())
+
+
+def envelope_stream(data: bytes, size: int, sent: list[int]) -> EnvelopeStream:
+    async def chunks() -> AsyncIterator[bytes]:
+        for i in range(0, len(data), size):
+            sent.append(i)
+            yield data[i:i + size]
+
+    return EnvelopeStream(chunks(), chunk_size=8)
+
+
+def test_envelope_result_is_streamed_after_the_metadata() -> None:
+    page = 'say "hi"\n\u00e9t\u00e9 \U0001f600 </html>' * 20
+    data = json.dumps({"device_id": "d1", "public_ip": "1.2.3.4", "result": page}).encode()
+    sent: list[int] = []
+
+    async def run() -> tuple[int, bytes]:
+        envelope = envelope_stream(data, 3, sent)
+        await envelope.start()
+        assert envelope.metadata == {"device_id": "d1", "public_ip": "1.2.3.4"}
+        started = len(sent)
+        return started, b"".join([piece async for piece in envelope.result()])
+
+    started, body = asyncio.run(run())
+    assert body == page.encode()
+    assert started * 3 < len(data) // 2
+
+
+def test_envelope_metadata_after_the_result_is_still_read() -> None:
+    data = json.dumps(
+        {"result": "<p>\u2603</p>", "extra": {"a": [1, "}"]}, "public_ip": "1.2.3.4", "device_id": None}
+    ).encode()
+
+    async def run() -> tuple[dict, bytes]:
+        envelope = envelope_stream(data, 5, [])
+        await envelope.start()
+        return envelope.metadata, b"".join([piece async for piece in envelope.result()])
+
+    metadata, body = asyncio.run(run())
+    assert metadata == {"public_ip": "1.2.3.4"}
+    assert body == "<p>\u2603</p>".encode()
+
+
+def test_envelope_rejects_other_bodies() -> None:
+    for data in (b"<html></html>", b'{"result": null}', b'{"public_ip": "1.2.3.4"}', b'{"result": "cut'):
+        with pytest.raises(ValueError):
+            asyncio.run(envelope_stream(data, 4, []).start())
+
+
+async def aiter_of(chunks: list[bytes]) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+def test_limit_bytes_stops_over_the_limit() -> None:
+    async def run() -> list[bytes]:
+        return [chunk async for chunk in limit_bytes(aiter_of([b"abc", b"def", b"ghi"]), 7)]
+
+    with pytest.raises(UpstreamTooLarge):
+        asyncio.run(run())
@@ -0,0 +1,47 @@
+import pytest
+
+from app.core.usage import UsageAggregator, usage_flush_lag
+
+
+def test_increments_are_summed_per_key() -> None:
+    writes: list[dict[object, int]] = []
+    usage = UsageAggregator("test-sum", writes.append)
+    usage.add("a")
+    usage.add("a")
+    usage.add("b", 3)
+    usage.add("c", 0)
+    assert usage.pending == 5
+    assert usage.flush() == 2
+    assert writes == [{"a": 2, "b": 3}]
+    assert usage.flush() == 0
+    assert len(writes) == 1
+
+
+def test_failed_flush_is_retried() -> None:
+    writes: list[dict[object, int]] = []
+
+    def write(batch: dict[object, int]) -> None:
+        if not writes:
+            writes.append({})
+            raise RuntimeError("database unavailable")
+        writes.append(batch)
+
+    usage = UsageAggregator("test-retry", write)
+    usage.add("a", 2)
+    with pytest.raises(RuntimeError):
+        usage.flush()
+    usage.add("a")
+    usage.flush()
+    assert writes[-1] == {"a": 3}
+    assert usage.pending == 0
+
+
+def test_flush_lag_is_age_of_oldest_increment() -> None:
+    now = [100.0]
+    usage = UsageAggregator("test-lag", lambda batch: None, clock=lambda: now[0])
+    usage.add("a")
+    now[0] = 104.0
+    usage.add("b")
+    now[0] = 105.0
+    usage.flush()
+    assert usage_flush_lag.value(counter="test-lag") == 5.0
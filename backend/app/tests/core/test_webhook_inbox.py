@@ -0,0 +1,121 @@
+import asyncio
+import uuid
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Any
+
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.db import async_engine
+from app.core.webhook_inbox import WebhookInbox, after_commit
+from app.models import User, WebhookEvent
+from app.tests.utils.user import create_random_user
+
+
+def make_event(created: int = 0) -> dict:
+    return {"id": f"evt_{uuid.uuid4().hex}", "type": "test.event", "created": created, "data": {"object": {}}}
+
+
+def test_enqueue_dedupes_on_event_id(db: Session) -> None:
+    inbox = WebhookInbox(lambda session, event: None)
+    event = make_event()
+
+    async def run() -> list[bool]:
+        try:
+            async with AsyncSession(async_engine, expire_on_commit=False) as session:
+                return [await inbox.enqueue(session, event), await inbox.enqueue(session, event)]
+        finally:
+            await async_engine.dispose()
+
+    assert asyncio.run(run()) == [True, False]
+    stored = db.get(WebhookEvent, event["id"])
+    assert stored is not None
+    assert stored.payload == event
+    db.delete(stored)
+    db.commit()
+
+
+def test_failed_events_are_retried_then_processed(db: Session) -> None:
+    first, second = make_event(created=2), make_event(created=1)
+    ids = {first["id"], second["id"]}
+    for event in (first, second):
+        db.add(WebhookEvent(id=event["id"], type=event["type"], created=event["created"], payload=event))
+    db.commit()
+
+    handled: list[str] = []
+    failing = [True]
+
+    def handler(session: Session, event: Mapping[str, Any]) -> None:
+        if event["id"] not in ids:
+            return
+        if event["id"] == first["id"] and failing[0]:
+            raise RuntimeError("upstream unavailable")
+        handled.append(event["id"])
+
+    inbox = WebhookInbox(handler, retry_delay=60)
+    inbox.process_pending()
+    # Processed in creation order; the failure is deferred, not dropped
+    assert handled == [second["id"]]
+    failed = db.get(WebhookEvent, first["id"])
+    assert failed is not None
+    db.refresh(failed)
+    assert failed.processed_at is None
+    assert failed.attempts == 1
+    assert failed.last_error == "upstream unavailable"
+    assert failed.next_attempt_at > datetime.utcnow()
+
+    inbox.process_pending()
+    assert handled == [second["id"]]
+
+    failing[0] = False
+    failed.next_attempt_at = datetime.utcnow()
+    db.add(failed)
+    db.commit()
+    inbox.process_pending()
+    assert handled == [second["id"], first["id"]]
+    db.refresh(failed)
+    assert failed.processed_at is not None
+    assert failed.attempts == 2
+    for event_id in ids:
+        db.delete(db.get(WebhookEvent, event_id))
+    db.commit()
+
+
+def test_handler_changes_and_side_effects_wait_for_the_inbox_commit(db: Session) -> None:
+    user = create_random_user(db)
+    event = make_event()
+    db.add(WebhookEvent(id=event["id"], type=event["type"], created=event["created"], payload=event))
+    db.commit()
+
+    side_effects: list[str] = []
+    failing = [True]
+
+    def handler(session: Session, payload: Mapping[str, Any]) -> None:
+        if payload["id"] != event["id"]:
+            return
+        session.get(User, user.id).full_name = "Renamed"  # type: ignore[union-attr]
+        session.flush()
+        after_commit(session, lambda: side_effects.append(payload["id"]))
+        if failing[0]:
+            raise RuntimeError("crashed before the commit")
+
+    inbox = WebhookInbox(handler, retry_delay=60)
+    inbox.process_pending()
+    db.refresh(user)
+    assert user.full_name != "Renamed"
+    assert side_effects == []
+
+    failing[0] = False
+    stored = db.get(WebhookEvent, event["id"])
+    assert stored is not None
+    db.refresh(stored)
+    stored.next_attempt_at = datetime.utcnow()
+    db.add(stored)
+    db.commit()
+    inbox.process_pending()
+    db.refresh(user)
+    assert user.full_name == "Renamed"
+    assert side_effects == [event["id"]]
+    db.delete(stored)
+    db.commit()
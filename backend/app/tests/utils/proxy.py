@@ -0,0 +1,57 @@
+from collections.abc import Callable, Generator
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import httpx
+from sqlmodel import Session
+
+from app.api.routes.proxy import APIToken, endpoint_manager
+from app.core.security import generate_api_key
+from app.core.upstream import upstream_clients
+from app.models import User
+from app.tests.utils.user import create_random_user
+
+
+def create_api_key(db: Session) -> tuple[User, str]:
+    """
+    Create a subscribed user with an active API key and return both.
+    """
+    user = create_random_user(db)
+    user.has_subscription = True
+    db.add(user)
+    api_key, key_prefix, key_hash = generate_api_key()
+    db.add(
+        APIToken(
+            user_id=user.id,
+            key_prefix=key_prefix,
+            key_hash=key_hash,
+            expires_at=datetime.utcnow() + timedelta(days=365),
+        )
+    )
+    db.commit()
+    return user, api_key
+
+
+@contextmanager
+def mock_upstream(
+    handler: Callable[[httpx.Request], httpx.Response],
+) -> Generator[None, None, None]:
+    """
+    Route every upstream proxy endpoint call to `handler` and start from a clean
+    endpoint manager (all endpoints healthy, breakers closed, no latency history).
+    Background health probes are ignored so they cannot race the test.
+    """
+    endpoint_manager.reset()
+    upstream_clients.reset()
+    with (
+        patch.object(
+            upstream_clients,
+            "_build_client",
+            lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        ),
+        patch.object(endpoint_manager, "record_health"),
+    ):
+        yield
+    upstream_clients.reset()
+    endpoint_manager.reset()
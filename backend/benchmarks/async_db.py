@@ -0,0 +1,75 @@
+"""
+Compare sync and async database sessions under concurrency when the database is slow.
+
+Each simulated request runs one query that takes `--delay` seconds (`pg_sleep`),
+the way a request stuck behind a slow Postgres round trip would. With the sync
+session the query blocks the event loop, so concurrent requests run one after
+another; with the async session they overlap up to the connection pool size.
+
+Run from the backend directory against a configured database:
+
+    python -m benchmarks.async_db --requests 50 --delay 0.05
+"""
+
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import text
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.db import async_engine, engine
+
+SLOW_QUERY = text("SELECT pg_sleep(:delay)")
+
+
+async def sync_request(delay: float) -> None:
+    with Session(engine) as session:
+        session.connection().execute(SLOW_QUERY, {"delay": delay})
+
+
+async def async_request(delay: float) -> None:
+    async with AsyncSession(async_engine) as session:
+        await (await session.connection()).execute(SLOW_QUERY, {"delay": delay})
+
+
+async def ticker(stop: asyncio.Event, gaps: list[float], interval: float = 0.005) -> None:
+    # Measures how long the event loop was unable to run other work
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        gaps.append(now - last - interval)
+        last = now
+
+
+async def run(name: str, request, requests: int, delay: float) -> None:
+    await request(0)  # warm up the pool
+    stop = asyncio.Event()
+    gaps: list[float] = []
+    tick = asyncio.create_task(ticker(stop, gaps))
+    start = time.perf_counter()
+    await asyncio.gather(*(request(delay) for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+    print(
+        f"{name:>5}: {requests} requests in {elapsed:6.3f}s "
+        f"({requests / elapsed:7.1f} req/s), worst event loop stall {max(gaps, default=0) * 1000:7.1f} ms"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds per query")
+    args = parser.parse_args()
+
+    await run("sync", sync_request, args.requests, args.delay)
+    await run("async", async_request, args.requests, args.delay)
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+"""
+Compare the BeautifulSoup and lxml SERP parser backends on the saved SERP corpus.
+
+Every fixture in app/tests/fixtures/serp is parsed with both backends for the
+engine it belongs to (the file name prefix, e.g. google_basic.html); the
+benchmark fails if any pair of results differs, then reports parses per second
+for each backend. `--repeat` inflates each page to simulate full-size SERPs.
+
+Run from the backend directory:
+
+    python -m benchmarks.serp_parsers --iterations 200 --repeat 5
+"""
+
+import argparse
+import re
+import sys
+import time
+import warnings
+from pathlib import Path
+
+from bs4 import XMLParsedAsHTMLWarning
+
+from app.core.serp_parser import SERP_PARSERS
+
+FIXTURES = Path(__file__).parent.parent / "app" / "tests" / "fixtures" / "serp"
+
+
+def load_corpus(repeat: int) -> list[tuple[str, str, str]]:
+    corpus = []
+    for path in sorted(FIXTURES.glob("*.html")):
+        engine = path.name.split("_", 1)[0]
+        if engine not in SERP_PARSERS["bs4"]:
+            continue
+        html = path.read_text(encoding="utf-8")
+        if repeat > 1:
+            # Repeat the body so one page carries `repeat` times as many results
+            match = re.search(r"<body[^>]*>(.*)</body>", html, re.S)
+            if match:
+                html = html.replace(match.group(1), match.group(1) * repeat)
+        corpus.append((path.name, engine, html))
+    return corpus
+
+
+def check_equal(corpus: list[tuple[str, str, str]]) -> bool:
+    ok = True
+    for name, engine, html in corpus:
+        expected = SERP_PARSERS["bs4"][engine](html)
+        actual = SERP_PARSERS["lxml"][engine](html)
+        if actual != expected:
+            ok = False
+            print(f"MISMATCH {name}: bs4 found {len(expected)} results, lxml {len(actual)}")
+        else:
+            print(f"ok       {name}: {len(expected)} results")
+    return ok
+
+
+def bench(backend: str, corpus: list[tuple[str, str, str]], iterations: int) -> float:
+    parsers = SERP_PARSERS[backend]
+    for _, engine, html in corpus:
+        parsers[engine](html)  # warm up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for _, engine, html in corpus:
+            parsers[engine](html)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=1, help="copies of each page body")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore", XMLParsedAsHTMLWarning)
+    corpus = load_corpus(args.repeat)
+    if not check_equal(corpus):
+        sys.exit("Backends disagree; not benchmarking")
+
+    parses = args.iterations * len(corpus)
+    timings = {backend: bench(backend, corpus, args.iterations) for backend in SERP_PARSERS}
+    for backend, elapsed in timings.items():
+        print(
+            f"{backend:>5}: {parses} parses in {elapsed:6.3f}s "
+            f"({parses / elapsed:8.1f} pages/s, {elapsed / parses * 1000:6.2f} ms/page)"
+        )
+    print(f"lxml speedup: {timings['bs4'] / timings['lxml']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
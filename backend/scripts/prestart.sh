@@ -17,4 +17,8 @@ alembic upgrade head
 echo "🌱 Seeding initial data..."
 python app/initial_data.py
 
+# 4. Fill the entitlement table from Stripe on its first deploy.
+echo "🔄 Backfilling subscription entitlements..."
+python app/backfill_entitlements.py
+
 echo "✅ Pre-start complete. Backend can now start."
\ No newline at end of file